@@ -0,0 +1,126 @@
+# api.py
+#
+# The read-only JSON API: parsing of batch (?ids=1,2,3) and field projection
+# (?fields=id,name) parameters, the column sets each resource can be projected
+# onto, and compact streaming serialization of large result sets.
+
+import json
+
+# Most ids one batch request may name
+MAX_BATCH_IDS = 1000
+
+# The C encoder with no whitespace; circular-reference checks are pointless for rows
+_ENCODER = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, check_circular=False)
+
+# Bytes of JSON gathered before a chunk is sent
+_CHUNK_SIZE = 64 * 1024
+
+encode = _ENCODER.encode
+
+# Resource -> {field: SQL expression}. Only the requested fields are selected.
+RECIPE_COLUMNS = {
+    'id': 'r.id',
+    'name': 'r.name',
+    'preparation_instructions': 'r.preparation_instructions',
+    'bake_instructions': 'r.bake_instructions',
+    'yield': 'r.yield',
+    'yield_amount': 'r.yield_amount',
+    'yield_unit': 'r.yield_unit',
+}
+# Recipe fields computed in Python: lines, sub-recipes and costing
+RECIPE_COMPUTED = ('ingredients', 'components', 'cost', 'cost_breakdown')
+RECIPE_DEFAULT_FIELDS = ['id', 'name', 'yield', 'yield_amount', 'yield_unit', 'cost']
+
+INGREDIENT_COLUMNS = {
+    'id': 'i.id',
+    'name': 'i.name',
+    'density_g_ml': 'i.density_g_ml',
+    'latest_brand': 'lp.brand',
+    'latest_store': 'lp.store',
+    'latest_package_amount': 'lp.package_amount',
+    'latest_package_unit': 'lp.package_unit',
+    'latest_price': 'lp.price',
+    'latest_purchase_date': 'lp.purchase_date',
+}
+INGREDIENT_DEFAULT_FIELDS = ['id', 'name', 'density_g_ml', 'latest_package_amount', 'latest_package_unit',
+                             'latest_price', 'latest_purchase_date']
+
+PURCHASE_COLUMNS = {
+    'id': 'ip.id',
+    'ingredient_id': 'ip.ingredient_id',
+    'ingredient_name': 'i.name',
+    'brand': 'ip.brand',
+    'store': 'ip.store',
+    'package_amount': 'ip.package_amount',
+    'package_unit': 'ip.package_unit',
+    'price': 'ip.price',
+    'unit_price': 'ip.unit_price',
+    'base_unit': 'ip.base_unit',
+    'purchase_date': 'ip.purchase_date',
+    'expiry_date': 'ip.expiry_date',
+}
+PURCHASE_DEFAULT_FIELDS = list(PURCHASE_COLUMNS)
+
+def parse_ids(value, name='ids'):
+    """
+    Parses a comma-separated id list such as '1,2,3' into a list of distinct ints
+    in the order given. Returns None when the parameter is absent or empty;
+    raises ValueError for anything else that is not a list of ids.
+    """
+    if value is None or not value.strip():
+        return None
+    ids = []
+    for part in value.split(','):
+        try:
+            ids.append(int(part))
+        except ValueError:
+            raise ValueError(f"{name} must be a comma-separated list of integers, got '{part.strip()}'.")
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MAX_BATCH_IDS:
+        raise ValueError(f'At most {MAX_BATCH_IDS} {name} can be requested at once.')
+    return ids
+
+def parse_fields(value, available, default):
+    """
+    Parses a comma-separated field list, keeping the order given. Returns
+    `default` when the parameter is absent; raises ValueError for unknown fields.
+    """
+    if value is None or not value.strip():
+        return list(default)
+    fields = list(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}. "
+                         f"Available: {', '.join(available)}.")
+    return fields
+
+def select_list(columns, fields, required=('id',)):
+    """
+    Returns the SELECT list for the requested column fields, plus any `required`
+    ones the caller needs internally, each aliased to its field name.
+    """
+    wanted = [field for field in columns if field in fields or field in required]
+    return ', '.join(f'{columns[field]} AS "{field}"' for field in wanted)
+
+def project(row, fields):
+    """Returns a dict of `fields`, in that order, from a row or dict."""
+    return {field: row[field] for field in fields}
+
+def iter_json_array(objects):
+    """
+    Yields a JSON array of `objects` in chunks of about 64 KB, so a large result
+    is encoded while it is sent rather than built in memory first.
+    """
+    parts = ['[']
+    size = 1
+    first = True
+    for obj in objects:
+        text = encode(obj) if first else ',' + encode(obj)
+        first = False
+        parts.append(text)
+        size += len(text)
+        if size >= _CHUNK_SIZE:
+            yield ''.join(parts)
+            parts, size = [], 0
+    parts.append(']')
+    yield ''.join(parts)
@@ -1,192 +1,944 @@
 import sqlite3
 import json
-from flask import Flask, render_template, request, url_for, redirect, flash, g
-from datetime import date
+import hashlib
+import re
+import base64
+import bisect
+import csv
+import io
+import math
+import click
+import contextlib
+import threading
+import time
+from collections import OrderedDict
+from flask import (Flask, render_template, request, url_for, redirect, flash, g, jsonify, Response,
+                   has_request_context, stream_with_context, abort, session, make_response)
+from datetime import date, datetime, timedelta, timezone
+from connection_pool import ConnectionPool, DEFAULT_PRAGMAS
+from importer import READERS, PURCHASE_FIELDS, import_purchases
+from api import (RECIPE_COLUMNS, RECIPE_COMPUTED, RECIPE_DEFAULT_FIELDS, INGREDIENT_COLUMNS,
+                 INGREDIENT_DEFAULT_FIELDS, PURCHASE_COLUMNS, PURCHASE_DEFAULT_FIELDS, parse_ids, parse_fields,
+                 select_list, project, iter_json_array)
+from exporter import stream_export, snapshot, restore, in_read_transaction
+from pantry import (StockShortage, stock_purchase, sync_purchase_lot, discard_lot, record_production_run,
+                    production_run, on_hand, expiring_lots, recent_runs)
+from planner import parse_plan, plan_production
+from recipe_entry import parse_text_lines, add_recipe_lines
+from jobs import JobWorkers, enqueue, queue_status
+from recipe_graph import CycleError, load_component_graph, topological_order, creates_cycle, batch_fraction
+import instrumentation
 
 # --- App and Database Configuration ---
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'
+# Maximum number of recipes whose computed cost is kept in memory
+app.config['COST_CACHE_SIZE'] = 512
+# Maximum number of rendered recipe cards kept in memory (one per recipe version)
+app.config['RECIPE_FRAGMENT_CACHE_SIZE'] = 256
+# Connection pools: read-write for writes and CLI commands, read-only for GET routes.
+# SQLITE_PRAGMAS entries override connection_pool.DEFAULT_PRAGMAS (WAL, busy_timeout, ...).
+app.config['DB_POOL_SIZE'] = 4
+app.config['DB_READ_POOL_SIZE'] = 8
+app.config['DB_POOL_TIMEOUT'] = 10.0
+app.config['SQLITE_PRAGMAS'] = {}
+# Per-request instrumentation: SQL counts and timings, a slow-query log with plans,
+# N+1 warnings and route latency histograms on /metrics. When disabled, pooled
+# connections are plain sqlite3 connections and nothing is measured.
+app.config['INSTRUMENTATION_ENABLED'] = False
+app.config['SLOW_QUERY_MS'] = 100
+# A request running the same statement more times than this is logged as a likely N+1
+app.config['N_PLUS_ONE_THRESHOLD'] = 10
+# Background jobs (see jobs.py): worker threads per web process (0 leaves the queue
+# to `flask run-jobs`), how often idle workers poll for jobs queued elsewhere, how
+# long a job may run before it is presumed dead and requeued, and how long finished
+# jobs are kept for the latency figures on /stats/jobs. All in seconds.
+app.config['JOB_WORKERS'] = 2
+app.config['JOB_POLL_SECONDS'] = 1.0
+app.config['JOB_LEASE_SECONDS'] = 300.0
+app.config['JOB_RETENTION_SECONDS'] = 86400.0
 DATABASE = 'recipes.db'
 
 # --- Unit Definitions and Conversion Logic ---
 
-# Define a single source of truth for all units and their "type" (dimension)
-# (abbreviation, full name, dimension)
-UNITS = [
-    ('g', 'Grams (g)', 'weight'),
-    ('kg', 'Kilograms (kg)', 'weight'),
-    ('lb', 'Pounds (lb)', 'weight'),
-    ('oz', 'Ounces (oz)', 'weight'),
-    ('ml', 'Milliliters (ml)', 'volume'),
-    ('l', 'Liters (l)', 'volume'),
-    ('fl.oz', 'Fluid Ounces-US (fl.oz)', 'volume'),
-    ('Gal', 'Gallon(s)-US (gal)', 'volume'),
-    ('pnt', 'Pint(s)-US (pnt)', 'volume'),
-    ('qrt', 'Quart(s)-US (qrt)', 'volume'),
-    ('tsp', 'Teaspoon-US (tsp)', 'volume'),
-    ('Tbsp', 'Tablespoon-US (Tbsp)', 'volume'),
-    ('Cup', 'Cup(s)-US', 'volume'),
-    ('ea', 'Each (ea)', 'quantity'),
-    ('pack', 'Pack', 'quantity'),
-]
-
-# Create a dictionary for quick dimension lookups: {'g': 'weight', 'kg': 'weight', ...}
-UNIT_DIMENSIONS = {unit[0]: unit[2] for unit in UNITS}
-
-# Define conversion factors TO a standard base unit (g for weight, ml for volume)
-# This is key for comparing different units of the same dimension.
-CONVERSIONS_TO_BASE = {
-    # Weight (base: g)
-    'g': 1.0,
-    'kg': 1000.0,
-    'oz': 28.35,
-    'lb': 453.59,
-    # Volume (base: ml)
-    'ml': 1.0,
-    'l': 1000.0,
-    'tsp': 4.929,
-    'Tbsp': 14.787,
-    'Cup': 236.588,
-    'fl.oz': 29.574,
-    'gal': 3785.41,
-    'pnt': 473.18,
-    'qrt': 946.35,
-    # Quantity (base: ea) - 'pack' is treated specially in the logic
-    'ea': 1.0,
-    'pack': 1.0,
-}
+# Units, their dimensions and conversion factors live in units.py, which compiles
+# them into a shared converter used by costing and the gram display.
+from units import (UNITS, UNIT_DIMENSIONS, BASE_UNITS, conversion_factor, grams_factor, package_size,
+                   unit_price)
+
+# --- Schema and Projections ---
+
+# Table definitions, triggers and indexes live in migrations.py; get_db applies any
+# pending migrations the first time this process connects.
+from migrations import migrate, rebuild_latest_purchases, check_query_plans, get_schema_version, HOT_QUERIES
+
+def get_table_version(db, table_name):
+    """Returns the current change version of a table (0 if it has never been written)."""
+    row = db.execute('SELECT version FROM table_versions WHERE table_name = ?', (table_name,)).fetchone()
+    return row['version'] if row else 0
+
+@app.cli.command('rebuild-latest-purchases')
+def rebuild_latest_purchases_command():
+    """Reconciles the latest_purchase projection against the full purchase history."""
+    db = get_db()
+    with db:
+        drift = rebuild_latest_purchases(db)
+    print(f"latest_purchase rebuilt; {drift} ingredient(s) were out of sync.")
+
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    """Applies any pending schema migrations."""
+    db = sqlite3.connect(DATABASE)
+    try:
+        for version, description in migrate(db):
+            print(f"Applied migration {version}: {description}")
+        print(f"Schema is at version {get_schema_version(db)}.")
+    finally:
+        db.close()
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fails if any hot query's plan scans a whole table or sorts without an index."""
+    problems = check_query_plans(get_db(), dict(HOT_QUERIES, **_purchase_page_hot_queries()))
+    for name, steps in problems.items():
+        print(f"{name}: {'; '.join(steps)}")
+    if problems:
+        raise SystemExit(1)
+    print("All hot queries use indexes.")
 
 # --- Database Connection Handling ---
 
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _get_pools():
+    """Creates the process's connection pools on first use, migrating the schema first."""
+    if not _pools:
+        with _pools_lock, instrumentation.suspended():
+            if not _pools:
+                pragmas = dict(DEFAULT_PRAGMAS, **app.config['SQLITE_PRAGMAS'])
+                factory = (instrumentation.InstrumentedConnection
+                           if app.config['INSTRUMENTATION_ENABLED'] else sqlite3.Connection)
+                write_pool = ConnectionPool(DATABASE, size=app.config['DB_POOL_SIZE'],
+                                            timeout=app.config['DB_POOL_TIMEOUT'], pragmas=pragmas,
+                                            factory=factory)
+                conn = write_pool.acquire()
+                try:
+                    migrate(conn)
+                finally:
+                    write_pool.release(conn)
+                read_pool = ConnectionPool(DATABASE, size=app.config['DB_READ_POOL_SIZE'],
+                                           timeout=app.config['DB_POOL_TIMEOUT'], pragmas=pragmas,
+                                           read_only=True, factory=factory)
+                _pools.update(write=write_pool, read=read_pool)
+    return _pools
+
 def get_db():
-    """Opens a new database connection if there is none yet for the current application context."""
+    """
+    Checks out a pooled database connection if there is none yet for the current
+    application context. GET/HEAD requests get a read-only connection; everything
+    else (other methods, CLI commands) gets a read-write one.
+    """
     if 'db' not in g:
-        g.db = sqlite3.connect(DATABASE)
-        g.db.row_factory = sqlite3.Row
+        pools = _get_pools()
+        read_only = has_request_context() and request.method in ('GET', 'HEAD')
+        pool = pools['read'] if read_only else pools['write']
+        with instrumentation.suspended():  # New connections run their PRAGMAs here
+            g.db = pool.acquire()
+        g.db_pool = pool
     return g.db
 
 @app.teardown_appcontext
 def close_db(exception):
-    """Closes the database again at the end of the request."""
+    """Returns the database connection to its pool at the end of the request."""
     db = g.pop('db', None)
+    pool = g.pop('db_pool', None)
     if db is not None:
-        db.close()
+        pool.release(db)
+
+@app.route('/stats/db-pool')
+def db_pool_stats():
+    """Exposes connection pool sizes and checkout wait-time metrics as JSON."""
+    return jsonify({name: pool.stats() for name, pool in _get_pools().items()})
+
+# --- Instrumentation ---
+
+request_metrics = instrumentation.Metrics()
+
+@app.before_request
+def start_instrumentation():
+    if app.config['INSTRUMENTATION_ENABLED']:
+        g.instrumentation_start = time.perf_counter()
+        instrumentation.start_request(app.config['SLOW_QUERY_MS'] / 1000)
+
+@app.after_request
+def add_server_timing(response):
+    """Reports the request's SQL time and statement count in a Server-Timing header."""
+    stats = instrumentation.current_stats()
+    if stats is not None:
+        response.headers['Server-Timing'] = (
+            f'db;dur={stats.query_time * 1000:.2f};desc="{stats.query_count} queries"')
+    return response
+
+@app.teardown_request
+def finish_instrumentation(exception):
+    """Records the request's latency and SQL statistics; runs after streamed bodies finish."""
+    started = g.pop('instrumentation_start', None)
+    if started is None:
+        return
+    stats = instrumentation.end_request()
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    repeated = request_metrics.observe_request(route, request.method, time.perf_counter() - started,
+                                               stats, app.config['N_PLUS_ONE_THRESHOLD'])
+    for sql, count in repeated.items():
+        instrumentation.logger.warning('Possible N+1 in %s %s: statement ran %d times: %s',
+                                       request.method, route, count, ' '.join(sql.split()))
+
+@app.route('/metrics')
+def metrics():
+    """Exposes request, SQL, cost cache and connection pool metrics in Prometheus text format."""
+    cache = recipe_cost_cache.stats()
+    fragments = recipe_fragment_cache.stats()
+    extra = [
+        '# HELP recipe_manager_cost_cache_lookups_total Recipe cost cache lookups.',
+        '# TYPE recipe_manager_cost_cache_lookups_total counter',
+        f'recipe_manager_cost_cache_lookups_total{{result="hit"}} {cache["hits"]}',
+        f'recipe_manager_cost_cache_lookups_total{{result="miss"}} {cache["misses"]}',
+        '# HELP recipe_manager_cost_cache_entries Recipes currently held in the cost cache.',
+        '# TYPE recipe_manager_cost_cache_entries gauge',
+        f'recipe_manager_cost_cache_entries {cache["size"]}',
+        '# HELP recipe_manager_fragment_cache_lookups_total Rendered recipe card cache lookups.',
+        '# TYPE recipe_manager_fragment_cache_lookups_total counter',
+        f'recipe_manager_fragment_cache_lookups_total{{result="hit"}} {fragments["hits"]}',
+        f'recipe_manager_fragment_cache_lookups_total{{result="miss"}} {fragments["misses"]}',
+        '# HELP recipe_manager_db_pool_checkouts_total Connections checked out, by pool.',
+        '# TYPE recipe_manager_db_pool_checkouts_total counter',
+    ]
+    pools = {name: pool.stats() for name, pool in _get_pools().items()}
+    extra += [f'recipe_manager_db_pool_checkouts_total{{pool="{name}"}} {stats["checkouts"]}'
+              for name, stats in pools.items()]
+    extra += ['# HELP recipe_manager_db_pool_timeouts_total Checkouts that timed out, by pool.',
+              '# TYPE recipe_manager_db_pool_timeouts_total counter']
+    extra += [f'recipe_manager_db_pool_timeouts_total{{pool="{name}"}} {stats["timeouts"]}'
+              for name, stats in pools.items()]
+    jobs = queue_status(get_db(), sample_size=0)
+    extra += ['# HELP recipe_manager_jobs Background jobs in the job table, by state.',
+              '# TYPE recipe_manager_jobs gauge']
+    extra += [f'recipe_manager_jobs{{state="{state}"}} {count}' for state, count in jobs['counts'].items()]
+    return Response(request_metrics.render_prometheus(extra),
+                    mimetype='text/plain; version=0.0.4')
 
 # --- Helper Functions ---
 
-def calculate_recipe_cost(recipe_id):
+def _gram_equivalent(amount, unit, density):
+    """
+    Returns the gram equivalent shown next to a recipe amount, or None when there is
+    nothing useful to show (already in grams, a count, or a volume without density).
+    """
+    if unit == 'g' or UNIT_DIMENSIONS.get(unit) == 'quantity':
+        return None
+    factor = grams_factor(unit, density)
+    return amount * factor if factor is not None else None
+
+def _price_recipe_line(recipe_amount, recipe_unit, purchase, density):
+    """
+    Prices a recipe amount against one purchase (a mapping with package_unit,
+    package_amount and price). Returns (cost, note); the note explains why a line
+    could not be priced and is empty otherwise.
+    """
+    purchase_unit = purchase['package_unit']
+    purchase_amount = purchase['package_amount']
+    purchase_price = purchase['price']
+
+    # Check if units are compatible (same dimension)
+    recipe_dim = UNIT_DIMENSIONS.get(recipe_unit)
+    purchase_dim = UNIT_DIMENSIONS.get(purchase_unit)
+
+    # Case 1: Counted items; a 'pack' purchase is split into its items
+    if recipe_dim == 'quantity' and purchase_dim == 'quantity':
+        cost_per_item = purchase_price / package_size(purchase_amount, purchase_unit)
+        return recipe_amount * cost_per_item, ''
+
+    # Case 2: Counts cannot be converted to or from weight/volume
+    if recipe_dim == 'quantity' or purchase_dim == 'quantity':
+        return 0.0, f"Cannot convert between '{purchase_dim}' and '{recipe_dim}'."
+
+    # Case 3: Weight/volume on both sides; the converter resolves one multiplier,
+    # applying the density when the dimensions differ
+    if recipe_dim is not None and purchase_dim is not None:
+        factor = conversion_factor(recipe_unit, purchase_unit, density)
+        if factor is None:
+            return 0.0, f"Conversion from {purchase_dim} to {recipe_dim} requires a density value."
+        return recipe_amount * factor * purchase_price / purchase_amount, ''
+
+    return 0.0, f"Cannot convert from {purchase_unit} to {recipe_unit}"
+
+def _cost_recipe_line(name, recipe_amount, recipe_unit, latest_purchase):
+    """
+    Prices a single recipe line against an ingredient's latest purchase.
+    `latest_purchase` is a mapping with package_unit, package_amount, price and
+    density_g_ml, or None when the ingredient has never been purchased.
+    Returns (ingredient_cost, breakdown_entry).
+    """
+    density = latest_purchase['density_g_ml'] if latest_purchase else None
+
+    # --- Generate display name with gram equivalent ---
+    grams = _gram_equivalent(recipe_amount, recipe_unit, density)
+    display_grams_str = f" ({round(grams)}g)" if grams is not None else ""
+    display_name = f"{recipe_amount} {recipe_unit}{display_grams_str} of {name}"
+    # --- End of display name generation ---
+
+    if not latest_purchase:
+        return 0.0, {'name': display_name, 'cost': 'N/A', 'note': 'No purchase history'}
+
+    ingredient_cost, cost_note = _price_recipe_line(recipe_amount, recipe_unit, latest_purchase, density)
+    return ingredient_cost, {
+        'name': display_name,
+        'cost': f'{ingredient_cost:.2f}',
+        'note': cost_note
+    }
+
+def _compute_recipe_cost(db, recipe_id, as_of=None):
     """
     Calculates the total cost of a recipe using a robust unit conversion system.
+    Every ingredient line is fetched together with its latest purchase (from the
+    latest_purchase projection) in a single query; the unit/density math then runs in memory.
+    With `as_of` (a YYYY-MM-DD date), lines are priced against each ingredient's
+    latest purchase on or before that date instead, found through the
+    (ingredient_id, purchase_date, id) index.
+    Returns the cost info and the set of ingredient ids the recipe depends on.
     """
-    db = get_db()
-    ingredients = db.execute('''
-        SELECT i.name, ri.amount_needed, ri.unit_needed
+    if as_of is None:
+        purchase_join = 'LEFT JOIN latest_purchase lp ON lp.ingredient_id = ri.ingredient_id'
+        params = (recipe_id,)
+    else:
+        purchase_join = '''
+        LEFT JOIN ingredient_purchases lp ON lp.id = (
+            SELECT p.id FROM ingredient_purchases p
+            WHERE p.ingredient_id = ri.ingredient_id AND p.purchase_date <= ?
+            ORDER BY p.purchase_date DESC, p.id DESC
+            LIMIT 1
+        )'''
+        params = (as_of, recipe_id)
+    rows = db.execute(f'''
+        SELECT ri.ingredient_id, i.name, i.density_g_ml, ri.amount_needed, ri.unit_needed,
+               lp.ingredient_id AS purchase_ingredient_id,
+               lp.package_amount, lp.package_unit, lp.price
         FROM recipe_ingredients ri
-        -- Also fetch the ingredient's ID and density
-        JOIN ingredients i ON ri.ingredient_id = i.id 
+        JOIN ingredients i ON ri.ingredient_id = i.id
+        {purchase_join}
         WHERE ri.recipe_id = ?
         ORDER BY ri.sort_order
-    ''', (recipe_id,)).fetchall()
+    ''', params).fetchall()
 
     total_cost = 0.0
     cost_breakdown = []
 
-    for item in ingredients:
-        recipe_unit = item['unit_needed']
-        recipe_amount = item['amount_needed']
-        
-        latest_purchase = db.execute('''
-            SELECT p.*, i.density_g_ml FROM ingredient_purchases p
-            JOIN ingredients i ON p.ingredient_id = i.id
-            WHERE ingredient_id = (SELECT id FROM ingredients WHERE name = ?)
-            ORDER BY purchase_date DESC
-            LIMIT 1
-        ''', (item['name'],)).fetchone()
+    for row in rows:
+        latest_purchase = row if row['purchase_ingredient_id'] is not None else None
+        ingredient_cost, entry = _cost_recipe_line(
+            row['name'], row['amount_needed'], row['unit_needed'], latest_purchase)
+        total_cost += ingredient_cost
+        cost_breakdown.append(entry)
+
+    ingredient_ids = {row['ingredient_id'] for row in rows}
+    return {'total': total_cost, 'breakdown': cost_breakdown}, ingredient_ids
+
+def _recipe_lines_cost(db, recipe_id, as_of=None):
+    """
+    Returns the cost info of a recipe's own ingredient lines, served from the recipe
+    cost cache when possible. Historical costs (`as_of` a YYYY-MM-DD date) are
+    computed on every call.
+    """
+    if as_of is not None:
+        return _compute_recipe_cost(db, recipe_id, as_of)[0]
 
-        # --- Generate display name with gram equivalent ---
-        grams = None
-        dimension = UNIT_DIMENSIONS.get(recipe_unit)
+    cached = recipe_cost_cache.get(recipe_id)
+    if cached is not None:
+        return cached
 
-        if dimension == 'weight' and recipe_unit != 'g':
-            grams = recipe_amount * CONVERSIONS_TO_BASE[recipe_unit]
-        elif dimension == 'volume' and latest_purchase and latest_purchase['density_g_ml']:
-            base_ml = recipe_amount * CONVERSIONS_TO_BASE[recipe_unit]
-            grams = base_ml * latest_purchase['density_g_ml']
+    generation = recipe_cost_cache.generation
+    cost_info, ingredient_ids = _compute_recipe_cost(db, recipe_id)
+    recipe_cost_cache.put(recipe_id, cost_info, ingredient_ids, generation)
+    return cost_info
 
-        display_grams_str = f" ({round(grams)}g)" if grams is not None else ""
-        display_name = f"{recipe_amount} {recipe_unit}{display_grams_str} of {item['name']}"
-        # --- End of display name generation ---
+def _cost_component_line(edge, component_total, component_unpriced):
+    """
+    Prices a sub-recipe line as its share of the sub-recipe's total cost.
+    `edge` is a row from load_component_graph; `component_unpriced` is true when
+    the sub-recipe has lines that could not be priced, which leaves this line
+    partly unpriced too. Returns (cost, breakdown_entry).
+    """
+    display_name = f"{edge['amount_needed']} {edge['unit_needed']} of {edge['name']} (sub-recipe)"
+    fraction, note = batch_fraction(edge)
+    if fraction is None:
+        return 0.0, {'name': display_name, 'cost': 'N/A', 'note': note}
+    cost = fraction * component_total
+    if component_unpriced:
+        note = 'The sub-recipe has ingredients that could not be priced.'
+    return cost, {'name': display_name, 'cost': f'{cost:.2f}', 'note': note}
+
+def _rollup_recipe_cost(db, recipe_id, lines_cost):
+    """
+    Returns the cost info for a recipe, sub-recipes included. Each recipe's own
+    lines are priced by `lines_cost(db, recipe_id)`; sub-recipes are then rolled
+    up from the bottom of the component graph, so every distinct sub-recipe is
+    costed once however many paths lead to it.
+    """
+    graph = load_component_graph(db, [recipe_id])
+    costs = {}
+    for current_id in topological_order([recipe_id], graph):
+        cost_info = lines_cost(db, current_id)
+        if current_id in graph:
+            total, breakdown = cost_info['total'], list(cost_info['breakdown'])
+            for edge in graph[current_id]:
+                component_cost = costs[edge['component_recipe_id']]
+                line_cost, entry = _cost_component_line(
+                    edge, component_cost['total'], any(entry['note'] for entry in component_cost['breakdown']))
+                total += line_cost
+                breakdown.append(entry)
+            cost_info = {'total': total, 'breakdown': breakdown}
+        costs[current_id] = cost_info
+    return costs[recipe_id]
+
+def calculate_recipe_cost(recipe_id, as_of=None):
+    """
+    Returns the cost info for a recipe, sub-recipes included, with each recipe's
+    own lines served from the recipe cost cache when possible.
+    """
+    return _rollup_recipe_cost(get_db(), recipe_id,
+                               lambda db, current_id: _recipe_lines_cost(db, current_id, as_of))
 
-        if not latest_purchase:
-            cost_breakdown.append({'name': display_name, 'cost': 'N/A', 'note': 'No purchase history'})
-            continue
+def calculate_all_recipe_costs(db, recipe_ids=None, breakdown=False):
+    """
+    Costs every recipe, or only `recipe_ids` (a list), in one pass: one query for
+    the recipe lines, one for their latest purchases, joined in memory, then one
+    for the sub-recipe links. Work is linear in the number of recipe lines and
+    links; a sub-recipe is costed once however many of the recipes use it.
+    Returns a list of dicts ordered by id with id, name, yield, total, lines and
+    unpriced_lines, plus the recipe page's cost breakdown when `breakdown` is true.
+    """
+    if recipe_ids is None:
+        graph = load_component_graph(db)
+        recipe_filter = line_filter = purchase_filter = ''
+        params = ()
+    else:
+        # The requested recipes and every sub-recipe below them
+        graph = load_component_graph(db, recipe_ids)
+        costed = set(recipe_ids).union(
+            edge['component_recipe_id'] for edges in graph.values() for edge in edges)
+        params = (json.dumps(sorted(costed)),)
+        recipe_filter = 'WHERE id IN (SELECT value FROM json_each(?))'
+        line_filter = 'WHERE ri.recipe_id IN (SELECT value FROM json_each(?))'
+        purchase_filter = '''WHERE lp.ingredient_id IN (
+            SELECT ingredient_id FROM recipe_ingredients WHERE recipe_id IN (SELECT value FROM json_each(?))
+        )'''
+
+    latest_purchases = {
+        row['ingredient_id']: row
+        for row in db.execute(f'''
+            SELECT lp.ingredient_id, lp.package_amount, lp.package_unit, lp.price, i.density_g_ml
+            FROM latest_purchase lp
+            JOIN ingredients i ON lp.ingredient_id = i.id
+            {purchase_filter}
+        ''', params)
+    }
 
-        purchase_unit = latest_purchase['package_unit']
-        purchase_amount = latest_purchase['package_amount']
-        purchase_price = latest_purchase['price']
-        
-        # Check if units are compatible (same dimension)
-        recipe_dim = UNIT_DIMENSIONS.get(recipe_unit)
-        purchase_dim = UNIT_DIMENSIONS.get(purchase_unit)
-
-        cost_note = ""
-        ingredient_cost = 0.0 # Default cost is 0
-
-        # Case 1: Dimensions are the same (weight-to-weight, volume-to-volume)
-        if recipe_dim == purchase_dim and recipe_dim is not None:
-            if recipe_dim == 'quantity':
-                items_in_package = purchase_amount if purchase_unit == 'pack' else 1
-                cost_per_item = purchase_price / items_in_package
-                ingredient_cost = recipe_amount * cost_per_item
-            else: # weight or volume
-                purchase_amount_in_base = purchase_amount * CONVERSIONS_TO_BASE[purchase_unit]
-                cost_per_base_unit = purchase_price / purchase_amount_in_base
-                recipe_amount_in_base = recipe_amount * CONVERSIONS_TO_BASE[recipe_unit]
-                ingredient_cost = recipe_amount_in_base * cost_per_base_unit
-        
-        # Case 2: Dimensions are different, requiring density conversion
-        elif recipe_dim != purchase_dim and recipe_dim is not None and purchase_dim is not None:
-            density = latest_purchase['density_g_ml']
-            if density is None:
-                cost_note = f"Conversion from {purchase_dim} to {recipe_dim} requires a density value."
-            else:
-                # Standardize both sides to grams and calculate cost
-                if purchase_dim == 'weight':
-                    purchase_grams = purchase_amount * CONVERSIONS_TO_BASE[purchase_unit]
-                    recipe_ml = recipe_amount * CONVERSIONS_TO_BASE[recipe_unit]
-                    recipe_grams = recipe_ml * density
-                else: # purchase_dim must be 'volume'
-                    purchase_ml = purchase_amount * CONVERSIONS_TO_BASE[purchase_unit]
-                    purchase_grams = purchase_ml * density
-                    recipe_grams = recipe_amount * CONVERSIONS_TO_BASE[recipe_unit]
-                
-                cost_per_gram = purchase_price / purchase_grams
-                ingredient_cost = recipe_grams * cost_per_gram
-        elif recipe_dim == 'quantity' or purchase_dim == 'quantity':
-            cost_note = f"Cannot convert between '{purchase_dim}' and '{recipe_dim}'."
-        else:
-            cost_note = f"Cannot convert from {purchase_unit} to {recipe_unit}"
-        
-        total_cost += ingredient_cost
-        cost_breakdown.append({
-            'name': display_name,
-            'cost': f'{ingredient_cost:.2f}',
-            'note': cost_note
-        })
+    report = {
+        row['id']: {'id': row['id'], 'name': row['name'], 'yield': row['yield'],
+                    'total': 0.0, 'lines': 0, 'unpriced_lines': 0, **({'breakdown': []} if breakdown else {})}
+        for row in db.execute(f'SELECT id, name, yield FROM recipes {recipe_filter} ORDER BY id', params)
+    }
+
+    lines = db.execute(f'''
+        SELECT ri.recipe_id, ri.ingredient_id, i.name, ri.amount_needed, ri.unit_needed
+        FROM recipe_ingredients ri
+        JOIN ingredients i ON ri.ingredient_id = i.id
+        {line_filter}
+        ORDER BY ri.recipe_id, ri.sort_order
+    ''', params)
+    for line in lines:
+        recipe = report.get(line['recipe_id'])
+        if recipe is None:
+            continue # Orphaned line left behind by a deleted recipe
+        ingredient_cost, entry = _cost_recipe_line(
+            line['name'], line['amount_needed'], line['unit_needed'],
+            latest_purchases.get(line['ingredient_id']))
+        _add_report_line(recipe, ingredient_cost, entry)
+
+    # Sub-recipe lines, rolled up from the bottom of the component graph so each
+    # sub-recipe's total is complete before it is used
+    for recipe_id in topological_order(list(graph), graph):
+        recipe = report.get(recipe_id)
+        if recipe is None:
+            continue # Links left behind by a deleted recipe
+        for edge in graph.get(recipe_id, ()):
+            component = report[edge['component_recipe_id']]
+            line_cost, entry = _cost_component_line(edge, component['total'], component['unpriced_lines'] > 0)
+            _add_report_line(recipe, line_cost, entry)
+
+    if recipe_ids is None:
+        return list(report.values())
+    requested = set(recipe_ids)
+    return [recipe for recipe in report.values() if recipe['id'] in requested]
+
+def _add_report_line(recipe, cost, entry):
+    """Adds one priced line (an ingredient or a sub-recipe) to a cost report row."""
+    recipe['total'] += cost
+    recipe['lines'] += 1
+    if entry['note']:
+        recipe['unpriced_lines'] += 1
+    if 'breakdown' in recipe:
+        recipe['breakdown'].append(entry)
+
+def calculate_cost_history(db, recipe_ids, start, end):
+    """
+    Traces how recipe costs moved between two YYYY-MM-DD dates. `recipe_ids` is a
+    list of ids, or None for every recipe. Returns {recipe id: {'id', 'name',
+    'points'}} where points are {'date', 'total', 'unpriced_lines'}: one at `start`
+    and one on every later date whose purchases changed the recipe's cost.
+
+    The purchase history of the recipes' ingredients is read once in date order;
+    each purchase re-prices only the lines using that ingredient. Densities are the
+    ingredients' current values, and only a recipe's own ingredient lines are
+    traced (sub-recipe lines are not).
+    """
+    where, params = '', ()
+    if recipe_ids is not None:
+        where, params = 'WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(recipe_ids),)
+    history = {row['id']: {'id': row['id'], 'name': row['name'], 'points': []}
+               for row in db.execute(f'SELECT id, name FROM recipes {where}', params)}
+
+    # (cost, priced) of every line, per recipe and ingredient; nothing is priced
+    # until the ingredient's first purchase
+    line_costs = {recipe_id: {} for recipe_id in history}
+    lines_by_ingredient = {}
+    for line in db.execute(f'''
+        SELECT ri.recipe_id, ri.ingredient_id, ri.amount_needed, ri.unit_needed, i.density_g_ml
+        FROM recipe_ingredients ri
+        JOIN ingredients i ON ri.ingredient_id = i.id
+        WHERE ri.recipe_id IN (SELECT id FROM recipes {where})
+    ''', params):
+        line_costs[line['recipe_id']][line['ingredient_id']] = (0.0, False)
+        lines_by_ingredient.setdefault(line['ingredient_id'], []).append(line)
+
+    def add_points(day, recipe_ids):
+        for recipe_id in recipe_ids:
+            costs = line_costs[recipe_id].values()
+            point = {'date': day, 'total': sum(cost for cost, _ in costs),
+                     'unpriced_lines': sum(1 for _, priced in costs if not priced)}
+            points = history[recipe_id]['points']
+            # A purchase at an unchanged price is not a price change
+            if not points or (points[-1]['total'], points[-1]['unpriced_lines']) != (
+                    point['total'], point['unpriced_lines']):
+                points.append(point)
+
+    purchases = db.execute('''
+        SELECT ingredient_id, package_amount, package_unit, price, purchase_date
+        FROM ingredient_purchases
+        WHERE ingredient_id IN (SELECT value FROM json_each(?)) AND purchase_date <= ?
+        ORDER BY purchase_date, id
+    ''', (json.dumps(sorted(lines_by_ingredient)), end))
+
+    # Purchases up to `start` only set the opening state; later ones are grouped by date
+    day, changed, started = None, set(), False
+    for purchase in purchases:
+        if purchase['purchase_date'] != day:
+            if started:
+                add_points(day, changed)
+            elif purchase['purchase_date'] > start:
+                add_points(start, history)
+                started = True
+            day, changed = purchase['purchase_date'], set()
+        for line in lines_by_ingredient[purchase['ingredient_id']]:
+            cost, note = _price_recipe_line(line['amount_needed'], line['unit_needed'],
+                                            purchase, line['density_g_ml'])
+            line_costs[line['recipe_id']][line['ingredient_id']] = (cost, not note)
+            changed.add(line['recipe_id'])
+    if started:
+        add_points(day, changed)
+    else:
+        add_points(start, history)
+    return history
+
+COST_REPORT_SORT_KEYS = {
+    'name': lambda r: r['name'].lower(),
+    'total': lambda r: r['total'],
+    'lines': lambda r: r['lines'],
+}
+COST_REPORT_FIELDS = ['id', 'name', 'yield', 'total', 'lines', 'unpriced_lines']
+
+def sort_cost_report(report, sort_by, order):
+    """Sorts a cost report in place; unknown sort keys fall back to name."""
+    report.sort(key=COST_REPORT_SORT_KEYS.get(sort_by, COST_REPORT_SORT_KEYS['name']),
+                reverse=(order == 'desc'))
+    return report
+
+def write_cost_report_csv(report, stream):
+    writer = csv.DictWriter(stream, fieldnames=COST_REPORT_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for row in report:
+        writer.writerow(dict(row, total=f"{row['total']:.2f}"))
+
+@app.cli.command('cost-report')
+@click.option('--sort-by', type=click.Choice(sorted(COST_REPORT_SORT_KEYS)), default='name')
+@click.option('--order', type=click.Choice(['asc', 'desc']), default='asc')
+@click.option('--output', type=click.File('w'), default='-', help='CSV file to write (default: stdout).')
+def cost_report_command(sort_by, order, output):
+    """Writes the current cost of every recipe as CSV."""
+    try:
+        report = sort_cost_report(calculate_all_recipe_costs(get_db()), sort_by, order)
+    except CycleError as e:
+        raise click.ClickException(str(e))
+    write_cost_report_csv(report, output)
+
+# --- Recipe Cost Cache ---
+
+class RecipeCostCache:
+    """
+    A bounded LRU cache of computed recipe costs, keyed by recipe_id.
 
-    return {'total': total_cost, 'breakdown': cost_breakdown}
+    Alongside the entries it keeps a reverse index of ingredient_id -> recipe_ids,
+    so a write touching one ingredient evicts exactly the cached recipes that use it.
+    The cache lives in this process only; writes made by other processes are not seen.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # Bumped on every invalidation, so a cost computed before a concurrent
+        # write is never stored after that write has invalidated it.
+        self.generation = 0
+        self._entries = OrderedDict()  # recipe_id -> (cost_info, ingredient_ids)
+        self._recipes_by_ingredient = {}
+        self._lock = threading.Lock()
+
+    def get(self, recipe_id):
+        with self._lock:
+            entry = self._entries.get(recipe_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(recipe_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, recipe_id, cost_info, ingredient_ids, generation):
+        with self._lock:
+            if generation != self.generation or self.maxsize <= 0:
+                return
+            self._discard(recipe_id)
+            self._entries[recipe_id] = (cost_info, frozenset(ingredient_ids))
+            for ingredient_id in ingredient_ids:
+                self._recipes_by_ingredient.setdefault(ingredient_id, set()).add(recipe_id)
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_recipe(self, recipe_id):
+        with self._lock:
+            self.generation += 1
+            self._discard(recipe_id)
+
+    def invalidate_ingredient(self, ingredient_id):
+        with self._lock:
+            self.generation += 1
+            for recipe_id in list(self._recipes_by_ingredient.get(ingredient_id, ())):
+                self._discard(recipe_id)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._recipes_by_ingredient.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+            }
+
+    def _discard(self, recipe_id):
+        """Removes one entry and its reverse-index links. Caller must hold the lock."""
+        entry = self._entries.pop(recipe_id, None)
+        if entry is None:
+            return
+        for ingredient_id in entry[1]:
+            recipes = self._recipes_by_ingredient.get(ingredient_id)
+            if recipes is not None:
+                recipes.discard(recipe_id)
+                if not recipes:
+                    del self._recipes_by_ingredient[ingredient_id]
+
+recipe_cost_cache = RecipeCostCache(app.config['COST_CACHE_SIZE'])
+
+@app.route('/stats/cost-cache')
+def cost_cache_stats():
+    """Exposes the recipe cost cache's size and hit/miss counters as JSON."""
+    return jsonify(recipe_cost_cache.stats())
+
+class FragmentCache:
+    """
+    A bounded LRU cache of rendered HTML fragments. Each entry remembers the version
+    stamp it was rendered from and is only served for that version, so bumping the
+    stamp is all it takes to invalidate it.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (version, html)
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, html):
+        with self._lock:
+            if self.maxsize <= 0:
+                return
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > version:
+                return  # A newer version was rendered concurrently
+            self._entries[key] = (version, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+            }
+
+recipe_fragment_cache = FragmentCache(app.config['RECIPE_FRAGMENT_CACHE_SIZE'])
+
+# --- Background Jobs ---
+
+# Writes that change ingredient prices or densities queue a "recost_ingredient"
+# job (see jobs.py) in the same transaction. A worker then recomputes every recipe
+# using the ingredient, directly or through sub-recipes, and stores the result in
+# recipe_costs, so the next viewer of those recipes does not pay for it.
+
+def _recipes_affected_by(db, ingredient_id):
+    """Returns the ids of the recipes whose cost depends on an ingredient."""
+    return [row[0] for row in db.execute('''
+        WITH RECURSIVE affected (id) AS (
+            SELECT recipe_id FROM recipe_ingredients WHERE ingredient_id = ?
+            UNION
+            SELECT rc.recipe_id
+            FROM recipe_components rc JOIN affected a ON rc.component_recipe_id = a.id
+        )
+        SELECT id FROM affected
+    ''', (ingredient_id,))]
+
+def store_recipe_costs(db, recipe_ids):
+    """
+    Computes the costs of some recipes and stores them in recipe_costs with the
+    page version each was computed from. Versions and costs are read in one
+    transaction, bypassing the in-memory cost cache, so a stored cost always
+    matches its version. Returns the number of costs stored.
+    """
+    rows = []
+    db.execute('BEGIN')
+    try:
+        for recipe_id in recipe_ids:
+            stamp = _recipe_page_stamp(db, recipe_id)
+            if stamp is None:
+                continue  # Deleted since the job was queued
+            cost_info = _rollup_recipe_cost(db, recipe_id,
+                                            lambda db, current_id: _compute_recipe_cost(db, current_id)[0])
+            rows.append((recipe_id, stamp[0], stamp[1], cost_info['total'], json.dumps(cost_info)))
+    finally:
+        db.execute('COMMIT')
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # An older result never overwrites a newer one. The page version alone does not
+        # grow when only a sub-recipe changes, but the stamp's modified_at does; a tie
+        # within a second at worst stores the older cost, which its version then keeps
+        # from being served.
+        db.executemany('''
+            INSERT INTO recipe_costs (recipe_id, version, modified_at, total, cost_info, computed_at)
+            VALUES (?, ?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%S', 'now'))
+            ON CONFLICT (recipe_id) DO UPDATE SET
+                version = excluded.version, modified_at = excluded.modified_at, total = excluded.total,
+                cost_info = excluded.cost_info, computed_at = excluded.computed_at
+            WHERE (excluded.modified_at, CAST(excluded.version AS INTEGER))
+                  >= (recipe_costs.modified_at, CAST(recipe_costs.version AS INTEGER))
+        ''', rows)
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    return len(rows)
+
+def _stored_recipe_cost(db, recipe_id, version):
+    """Returns the cost info stored by a job for this version of a recipe's page, or None."""
+    row = db.execute('SELECT version, cost_info FROM recipe_costs WHERE recipe_id = ?',
+                     (recipe_id,)).fetchone()
+    if row is None or row['version'] != version:
+        return None
+    return json.loads(row['cost_info'])
+
+def recost_ingredient(db, ingredient_id):
+    """Job handler: stores fresh costs for every recipe that depends on an ingredient."""
+    store_recipe_costs(db, _recipes_affected_by(db, int(ingredient_id)))
+
+JOB_HANDLERS = {
+    'recost_ingredient': recost_ingredient,
+}
+
+def _queue_recost(db, ingredient_ids):
+    """Queues recost jobs for some ingredients in the caller's transaction; does not commit."""
+    enqueue(db, 'recost_ingredient', sorted(set(ingredient_ids)))
+
+@contextlib.contextmanager
+def _job_connection():
+    """A pooled read-write connection for one job, outside any request."""
+    with app.app_context():
+        yield get_db()
+
+_job_workers = []
+_job_workers_lock = threading.Lock()
+
+def _get_job_workers():
+    """Creates the process's job worker pool on first use; it is started by the first request."""
+    if not _job_workers:
+        with _job_workers_lock:
+            if not _job_workers:
+                _job_workers.append(JobWorkers(
+                    JOB_HANDLERS, _job_connection, size=app.config['JOB_WORKERS'],
+                    poll_interval=app.config['JOB_POLL_SECONDS'],
+                    lease_seconds=app.config['JOB_LEASE_SECONDS'],
+                    retention_seconds=app.config['JOB_RETENTION_SECONDS']))
+    return _job_workers[0]
+
+@app.before_request
+def start_job_workers():
+    _get_job_workers().start()
+
+def _notify_job_workers():
+    """Wakes this process's idle workers after a commit that queued jobs."""
+    _get_job_workers().notify()
+
+@app.route('/stats/jobs')
+def job_stats():
+    """Exposes the job queue's depth, the age of its oldest job and recent job latency as JSON."""
+    return jsonify(dict(queue_status(get_db()), workers=_get_job_workers().stats()))
+
+@app.cli.command('run-jobs')
+@click.option('--once', is_flag=True, help='Run the jobs queued now, then exit.')
+@click.option('--workers', 'size', type=int, help='Worker threads (default: JOB_WORKERS, at least 1).')
+def run_jobs_command(once, size):
+    """Runs queued background jobs, e.g. for deployments with JOB_WORKERS = 0."""
+    workers = _get_job_workers()
+    if once:
+        print(f"Ran {workers.run_pending()} job(s).")
+        return
+    workers.size = size or max(workers.size, 1)
+    workers.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        workers.stop()
 
 # --- Recipe Routes ---
 
+RECIPES_PER_PAGE = 25
+
+def _fts_query(text):
+    """Turns free text into an FTS5 query where every word must match as a prefix."""
+    # \w+ tokens never contain quotes or FTS operators, so quoting them is safe
+    return ' '.join(f'"{term}"*' for term in re.findall(r'\w+', text))
+
 @app.route('/')
 def index():
+    """
+    Lists recipes a page at a time. With ?q=..., shows full-text search results
+    ranked by relevance (name and ingredient matches weigh most); otherwise
+    browses by name using ?after=/?before= keyset cursors.
+    """
     db = get_db()
-    recipes = db.execute('SELECT * FROM recipes ORDER BY name').fetchall()
-    return render_template('index.html', recipes=recipes)
-
-@app.route('/recipe/<int:recipe_id>')
-def recipe_detail(recipe_id):
-    db = get_db()
+    per_page = RECIPES_PER_PAGE
+    query_text = request.args.get('q', '').strip()
+    prev_url = next_url = None
+
+    if query_text:
+        page = max(request.args.get('page', 1, type=int), 1)
+        match = _fts_query(query_text)
+        recipes = []
+        if match:
+            # bm25 weights follow the column order: name, preparation, bake, ingredient names
+            recipes = db.execute('''
+                SELECT r.id, r.name, r.yield
+                FROM recipe_search s
+                JOIN recipes r ON r.id = s.rowid
+                WHERE recipe_search MATCH ?
+                ORDER BY bm25(recipe_search, 10.0, 1.0, 1.0, 5.0)
+                LIMIT ? OFFSET ?
+            ''', (match, per_page + 1, (page - 1) * per_page)).fetchall()
+        if len(recipes) > per_page:
+            next_url = url_for('index', q=query_text, page=page + 1)
+        if page > 1:
+            prev_url = url_for('index', q=query_text, page=page - 1)
+        recipes = recipes[:per_page]
+    else:
+        after = request.args.get('after')
+        before = request.args.get('before')
+        if before is not None:
+            recipes = db.execute(
+                'SELECT id, name, yield FROM recipes WHERE name < ? ORDER BY name DESC LIMIT ?',
+                (before, per_page + 1)).fetchall()
+            more = len(recipes) > per_page
+            recipes = recipes[:per_page][::-1]
+            has_prev, has_next = more, True
+        else:
+            recipes = db.execute(
+                'SELECT id, name, yield FROM recipes WHERE name > ? ORDER BY name LIMIT ?',
+                (after or '', per_page + 1)).fetchall()
+            more = len(recipes) > per_page
+            recipes = recipes[:per_page]
+            has_prev, has_next = after is not None, more
+        if recipes:
+            if has_prev:
+                prev_url = url_for('index', before=recipes[0]['name'])
+            if has_next:
+                next_url = url_for('index', after=recipes[-1]['name'])
+
+    return render_template('index.html', recipes=recipes, q=query_text,
+                           prev_url=prev_url, next_url=next_url)
+
+def _render_recipe_card(db, recipe_id, as_of=None, version=None):
+    """
+    Renders the recipe card (ingredients, instructions and costing) as HTML,
+    costed at the latest purchases or, with `as_of`, at the purchases of that date.
+    Given the page `version`, a cost stored by a background job for that version
+    is used instead of computing it.
+    """
     recipe = db.execute('SELECT * FROM recipes WHERE id = ?', (recipe_id,)).fetchone()
     
     # Fetch ingredients along with their density for gram calculation, ORDERED by sort_order
@@ -202,32 +954,142 @@ def recipe_detail(recipe_id):
     ingredients_processed = []
     for item in ingredients_raw:
         item_dict = dict(item) # Convert Row object to a mutable dict
-        unit = item_dict['unit_needed']
-        amount = item_dict['amount_needed']
-        density = item_dict['density_g_ml']
-        dimension = UNIT_DIMENSIONS.get(unit)
-        
-        grams = None # Default to no gram display
-        
-        if dimension == 'weight' and unit != 'g':
-            grams = amount * CONVERSIONS_TO_BASE.get(unit, 0)
-        elif dimension == 'volume' and density:
-            base_ml = amount * CONVERSIONS_TO_BASE.get(unit, 0)
-            grams = base_ml * density
-            
+        grams = _gram_equivalent(item_dict['amount_needed'], item_dict['unit_needed'],
+                                 item_dict['density_g_ml'])
+
         if grams is not None:
             # Add a formatted string to the dictionary for the template
             item_dict['display_grams'] = f"({round(grams)}g)"
         else:
             item_dict['display_grams'] = "" # Keep it empty if no conversion
-            
+
         ingredients_processed.append(item_dict)
 
-    cost_info = calculate_recipe_cost(recipe_id)
-    return render_template('recipe_detail.html', 
-                           recipe=recipe, 
-                           ingredients=ingredients_processed, 
-                           cost_info=cost_info)
+    components = db.execute('''
+        SELECT c.id, c.name, rc.amount_needed, rc.unit_needed
+        FROM recipe_components rc
+        JOIN recipes c ON rc.component_recipe_id = c.id
+        WHERE rc.recipe_id = ?
+        ORDER BY rc.sort_order
+    ''', (recipe_id,)).fetchall()
+
+    cost_info = None
+    if version is not None and as_of is None:
+        cost_info = _stored_recipe_cost(db, recipe_id, version)
+    if cost_info is None:
+        try:
+            cost_info = calculate_recipe_cost(recipe_id, as_of)
+        except CycleError as e:
+            cost_info = {'total': 0.0, 'breakdown': [{'name': 'Sub-recipes', 'cost': 'N/A', 'note': str(e)}]}
+    return render_template('recipe_detail_card.html',
+                           recipe=recipe,
+                           ingredients=ingredients_processed,
+                           components=components,
+                           cost_info=cost_info,
+                           as_of=as_of)
+
+def _parse_iso_date(value):
+    """Returns `value` as a normalized YYYY-MM-DD string, or raises ValueError."""
+    return date.fromisoformat(value.strip()).isoformat()
+
+def _recipe_page_stamp(db, recipe_id):
+    """
+    Returns (version, modified_at) of a recipe page, or None if the recipe does
+    not exist. The page shows the costs of the recipe's sub-recipes, so a recipe
+    with sub-recipes is stamped with all of their versions too.
+    """
+    stamps = db.execute('''
+        WITH RECURSIVE below (id) AS (
+            SELECT ?
+            UNION
+            SELECT rc.component_recipe_id
+            FROM recipe_components rc JOIN below b ON rc.recipe_id = b.id
+        )
+        SELECT v.recipe_id, v.version, v.modified_at
+        FROM below b JOIN recipe_versions v ON v.recipe_id = b.id
+        ORDER BY v.recipe_id
+    ''', (recipe_id,)).fetchall()
+    own = next((stamp for stamp in stamps if stamp['recipe_id'] == recipe_id), None)
+    if own is None:
+        return None
+    version = str(own['version'])
+    if len(stamps) > 1:
+        below = ','.join(f"{stamp['recipe_id']}:{stamp['version']}" for stamp in stamps)
+        version += '.' + hashlib.sha1(below.encode('ascii')).hexdigest()[:12]
+    return version, max(stamp['modified_at'] for stamp in stamps)
+
+@app.route('/recipe/<int:recipe_id>')
+def recipe_detail(recipe_id):
+    """
+    Shows a recipe with its costing. The page is validated by the version stamps of
+    the recipe and its sub-recipes (ETag and Last-Modified), so an unchanged page is answered with 304 after
+    a single lookup, and the rendered card is cached per version.
+    With ?as_of=YYYY-MM-DD the recipe is costed at the purchases of that date; such
+    pages depend on the purchase history rather than the version, so they are
+    rendered on every request.
+    """
+    db = get_db()
+    as_of = request.args.get('as_of', '')
+    if as_of:
+        try:
+            as_of = _parse_iso_date(as_of)
+        except ValueError:
+            flash(f"'{as_of}' is not a valid date (YYYY-MM-DD); showing the current cost.", 'error')
+            as_of = ''
+
+    stamp = _recipe_page_stamp(db, recipe_id)
+    if stamp is None:
+        abort(404)
+    version, modified_at = stamp
+    etag = f'recipe-{recipe_id}-{version}'
+    last_modified = datetime.strptime(modified_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+    if as_of:
+        card = _render_recipe_card(db, recipe_id, as_of)
+        return render_template('recipe_detail.html', recipe_card=card)
+
+    # A page showing flashed messages is a one-off, so it is neither validated nor cached
+    cacheable = '_flashes' not in session
+    not_modified = cacheable and (
+        etag in request.if_none_match
+        or (not request.if_none_match and request.if_modified_since is not None
+            and last_modified <= request.if_modified_since))
+
+    if not_modified:
+        response = app.response_class(status=304)
+    else:
+        card = recipe_fragment_cache.get(recipe_id, version)
+        if card is None:
+            card = _render_recipe_card(db, recipe_id, version=version)
+            recipe_fragment_cache.put(recipe_id, version, card)
+        response = make_response(render_template('recipe_detail.html', recipe_card=card))
+
+    if cacheable:
+        response.set_etag(etag)
+        response.last_modified = last_modified
+    # Always revalidate; the ETag makes revalidation a cheap 304.
+    response.cache_control.no_cache = True
+    return response
+
+def _parse_recipe_yield(form):
+    """
+    Reads the optional yield amount and unit from the recipe form; a recipe needs
+    both to be used by amount as a sub-recipe. Returns (amount, unit), (None, None)
+    when both are empty, or raises ValueError.
+    """
+    amount = form.get('yield_amount', '').strip()
+    unit = form.get('yield_unit', '').strip()
+    if not amount and not unit:
+        return None, None
+    try:
+        amount = float(amount)
+    except ValueError:
+        raise ValueError('The yield amount must be a number.')
+    if not amount > 0 or amount == float('inf'):
+        raise ValueError('The yield amount must be greater than zero.')
+    if unit not in UNIT_DIMENSIONS:
+        raise ValueError('Choose a unit for the yield amount.')
+    return amount, unit
 
 @app.route('/recipe/add', methods=('GET', 'POST'))
 def add_recipe():
@@ -240,12 +1102,19 @@ def add_recipe():
         if not name:
             flash('Recipe name is required!', 'error')
             return render_template('recipe_form.html', units=UNITS)
+        try:
+            yield_amount, yield_unit = _parse_recipe_yield(request.form)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return render_template('recipe_form.html', units=UNITS)
         
         db = get_db()
         cursor = db.cursor()
         try:
-            cursor.execute('INSERT INTO recipes (name, preparation_instructions, bake_instructions, yield) VALUES (?, ?, ?, ?)',
-                           (name, prep, bake, yld))
+            cursor.execute('''
+                INSERT INTO recipes (name, preparation_instructions, bake_instructions, yield, yield_amount, yield_unit)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (name, prep, bake, yld, yield_amount, yield_unit))
             db.commit()
             new_recipe_id = cursor.lastrowid
             flash('Recipe created successfully! Now add ingredients.', 'success')
@@ -270,16 +1139,25 @@ def edit_recipe(recipe_id):
 
         if not name:
             flash('Recipe name is required!', 'error')
+            return _render_recipe_form(db, recipe_id, recipe)
+        try:
+            yield_amount, yield_unit = _parse_recipe_yield(request.form)
+        except ValueError as e:
+            flash(str(e), 'error')
         else:
             db.execute('''
-                UPDATE recipes SET name = ?, preparation_instructions = ?, bake_instructions = ?, yield = ?
+                UPDATE recipes SET name = ?, preparation_instructions = ?, bake_instructions = ?, yield = ?,
+                                   yield_amount = ?, yield_unit = ?
                 WHERE id = ?
-            ''', (name, prep, bake, yld, recipe_id))
+            ''', (name, prep, bake, yld, yield_amount, yield_unit, recipe_id))
             db.commit()
             flash('Recipe details updated successfully!', 'success')
             return redirect(url_for('edit_recipe', recipe_id=recipe_id))
 
-    # Fetch ingredients ORDERED by their sort_order
+    return _render_recipe_form(db, recipe_id, recipe)
+
+def _render_recipe_form(db, recipe_id, recipe, **context):
+    """Renders the edit page of an existing recipe, with its lines in display order."""
     recipe_ingredients = db.execute('''
         SELECT i.id, i.name, ri.amount_needed, ri.unit_needed, ri.sort_order
         FROM recipe_ingredients ri
@@ -287,109 +1165,280 @@ def edit_recipe(recipe_id):
         WHERE ri.recipe_id = ? ORDER BY ri.sort_order
     ''', (recipe_id,)).fetchall()
 
-    all_ingredients = db.execute('SELECT * FROM ingredients ORDER BY name').fetchall()
+    recipe_components = db.execute('''
+        SELECT c.id, c.name, c.yield_amount, c.yield_unit, rc.amount_needed, rc.unit_needed
+        FROM recipe_components rc
+        JOIN recipes c ON rc.component_recipe_id = c.id
+        WHERE rc.recipe_id = ? ORDER BY rc.sort_order
+    ''', (recipe_id,)).fetchall()
+
+    all_recipes = db.execute('SELECT id, name FROM recipes WHERE id != ? ORDER BY name', (recipe_id,)).fetchall()
 
     return render_template('recipe_form.html',
                            recipe=recipe,
                            recipe_ingredients=recipe_ingredients,
-                           all_ingredients=all_ingredients,
-                           units=UNITS)
+                           recipe_components=recipe_components,
+                           all_recipes=all_recipes,
+                           units=UNITS,
+                           **context)
 
 @app.route('/recipe/delete/<int:recipe_id>', methods=('POST',))
 def delete_recipe(recipe_id):
     """Deletes a recipe and its associated ingredients from the database."""
     db = get_db()
+
+    # A recipe still used as a sub-recipe would silently drop out of those recipes
+    users = db.execute('''
+        SELECT r.name FROM recipe_components rc JOIN recipes r ON rc.recipe_id = r.id
+        WHERE rc.component_recipe_id = ? ORDER BY r.name
+    ''', (recipe_id,)).fetchall()
+    if users:
+        flash('This recipe is a sub-recipe of ' + ', '.join(row['name'] for row in users)
+              + '. Remove it from those recipes first.', 'error')
+        return redirect(url_for('recipe_detail', recipe_id=recipe_id))
     
-    # First, delete the links in the recipe_ingredients table
+    # First, delete the links in the recipe_ingredients and recipe_components tables
     db.execute('DELETE FROM recipe_ingredients WHERE recipe_id = ?', (recipe_id,))
+    db.execute('DELETE FROM recipe_components WHERE recipe_id = ?', (recipe_id,))
     
     # Then, delete the recipe itself
     db.execute('DELETE FROM recipes WHERE id = ?', (recipe_id,))
     
     db.commit()
+    recipe_cost_cache.invalidate_recipe(recipe_id)
     
     flash('Recipe has been deleted successfully.', 'success')
     return redirect(url_for('index'))
 
 
+# Recipe lines are ordered by sparse integer sort keys, SORT_KEY_GAP apart when
+# freshly numbered. A moved line takes a key between its new neighbours, so a move
+# rewrites a single row; the recipe's keys are only renumbered when two neighbours
+# have no integer left between them.
+SORT_KEY_GAP = 1024
+
+def _longest_increasing_run(keys):
+    """Returns the positions of a longest strictly increasing subsequence of `keys`."""
+    tail_keys, tail_positions = [], []
+    previous = [None] * len(keys)
+    for position, key in enumerate(keys):
+        length = bisect.bisect_left(tail_keys, key)
+        previous[position] = tail_positions[length - 1] if length else None
+        if length == len(tail_keys):
+            tail_keys.append(key)
+            tail_positions.append(position)
+        else:
+            tail_keys[length] = key
+            tail_positions[length] = position
+    run = []
+    position = tail_positions[-1] if tail_positions else None
+    while position is not None:
+        run.append(position)
+        position = previous[position]
+    return run[::-1]
+
+def _plan_sort_keys(keys):
+    """
+    Takes the current sort keys of a recipe's lines, listed in their new order, and
+    returns the new key of every line. Lines on a longest already-increasing run
+    keep their keys; the others are spread out between their neighbours. Returns
+    None if there is no room (or a key is missing) and the lines must be renumbered.
+    """
+    if any(key is None for key in keys):
+        return None
+    kept = set(_longest_increasing_run(keys))
+    new_keys = list(keys)
+    start = 0
+    while start < len(keys):
+        if start in kept:
+            start += 1
+            continue
+        end = start
+        while end < len(keys) and end not in kept:
+            end += 1
+        # Lines start..end-1 go strictly between the kept keys on either side
+        steps = end - start + 1
+        low = keys[start - 1] if start else None
+        high = keys[end] if end < len(keys) else None
+        if low is None:
+            low = high - steps * SORT_KEY_GAP
+        if high is None:
+            high = low + steps * SORT_KEY_GAP
+        if high - low < steps:
+            return None
+        for step in range(1, steps):
+            new_keys[start + step - 1] = low + (high - low) * step // steps
+        start = end
+    return new_keys
+
+def _reorder_recipe_lines(db, recipe_id, reorder):
+    """
+    Re-sorts a recipe's lines in one transaction. `reorder` is given the ingredient
+    ids in their current order and returns them in the desired order. Only lines
+    whose key changes are written, with a single executemany. Returns the number of
+    lines updated; raises ValueError if the order is not a permutation of the lines.
+    """
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        lines = db.execute('''
+            SELECT ingredient_id, sort_order FROM recipe_ingredients
+            WHERE recipe_id = ? ORDER BY sort_order, ingredient_id
+        ''', (recipe_id,)).fetchall()
+        current_keys = {line['ingredient_id']: line['sort_order'] for line in lines}
+        order = reorder([line['ingredient_id'] for line in lines])
+        if len(order) != len(current_keys) or set(order) != set(current_keys):
+            raise ValueError('The new order must list every ingredient of the recipe exactly once.')
+
+        new_keys = _plan_sort_keys([current_keys[ingredient_id] for ingredient_id in order])
+        if new_keys is None:
+            new_keys = [(position + 1) * SORT_KEY_GAP for position in range(len(order))]
+        updates = [(key, recipe_id, ingredient_id)
+                   for ingredient_id, key in zip(order, new_keys) if key != current_keys[ingredient_id]]
+        db.executemany('UPDATE recipe_ingredients SET sort_order = ? WHERE recipe_id = ? AND ingredient_id = ?',
+                       updates)
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    return len(updates)
+
 @app.route('/recipe/<int:recipe_id>/add_ingredient', methods=('POST',))
 def add_ingredient_to_recipe(recipe_id):
     db = get_db()
-    ingredient_id = request.form['ingredient_id']
+    ingredient_id = _ingredient_from_form(db, request.form)
+    ingredient_name = request.form.get('ingredient_name', '').strip()
     amount = request.form['amount_needed']
     unit = request.form['unit_needed']
 
-    if not all([ingredient_id, amount, unit]):
+    if not all([amount, unit]) or (ingredient_id is None and not ingredient_name):
         flash('All ingredient fields are required.', 'error')
+    elif ingredient_id is None:
+        flash(f"Unknown ingredient '{ingredient_name}'. "
+              'Add a purchase for it on the Ingredients page first.', 'error')
     else:
         try:
-            # --- NEW: Calculate the next sort_order ---
-            # COALESCE ensures we get 0 if there are no ingredients yet.
-            max_order_result = db.execute(
-                'SELECT COALESCE(MAX(sort_order), 0) FROM recipe_ingredients WHERE recipe_id = ?', 
-                (recipe_id,)
-            ).fetchone()
-            next_order = max_order_result[0] + 1
-            
-            # Insert with the new sort_order
+            # The new line goes SORT_KEY_GAP after the last one; the INSERT reads the
+            # last key from the (recipe_id, sort_order) index itself.
             db.execute('''
                 INSERT INTO recipe_ingredients (recipe_id, ingredient_id, amount_needed, unit_needed, sort_order)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (recipe_id, int(ingredient_id), float(amount), unit, next_order))
+                SELECT ?, ?, ?, ?, IFNULL(MAX(sort_order), 0) + ?
+                FROM recipe_ingredients WHERE recipe_id = ?
+            ''', (recipe_id, ingredient_id, float(amount), unit, SORT_KEY_GAP, recipe_id))
             db.commit()
+            recipe_cost_cache.invalidate_recipe(recipe_id)
             flash('Ingredient added to recipe.', 'success')
         except sqlite3.IntegrityError:
             flash('This ingredient is already in the recipe.', 'error')
 
     return redirect(url_for('edit_recipe', recipe_id=recipe_id))
 
-# --- NEW: Routes for reordering ingredients ---
+@app.route('/recipe/<int:recipe_id>/add_ingredients', methods=('POST',))
+def add_ingredients_to_recipe(recipe_id):
+    """
+    Adds a whole ingredient list to a recipe in one request and one transaction.
+    Accepts JSON {"lines": [{"name" or "ingredient_id", "amount", "unit"}, ...],
+    "create_missing": true}, answered with JSON, or the edit page's text box with
+    one "<amount> <unit> <ingredient>" per line. Unknown ingredient names become
+    new base ingredients unless create_missing is off. If any line is invalid,
+    nothing is added and every problem is reported by line number.
+    """
+    db = get_db()
+    wants_json = request.is_json
+    text = ''
+    if wants_json:
+        payload = request.get_json(silent=True) or {}
+        raw_lines = payload.get('lines') if isinstance(payload, dict) else None
+        create_missing = bool(payload.get('create_missing', True)) if isinstance(payload, dict) else True
+        numbered_lines = list(enumerate(raw_lines, start=1)) if isinstance(raw_lines, list) else []
+    else:
+        text = request.form.get('lines', '')
+        create_missing = 'create_missing' in request.form
+        numbered_lines = parse_text_lines(text)
+
+    try:
+        result = add_recipe_lines(db, recipe_id, numbered_lines, create_missing, SORT_KEY_GAP)
+    except (ValueError, LookupError) as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 404 if isinstance(e, LookupError) else 400
+        flash(str(e), 'error')
+        return redirect(url_for('edit_recipe', recipe_id=recipe_id))
+
+    if result.errors:
+        if wants_json:
+            return jsonify({'errors': [{'line': line_number, 'error': message}
+                                       for line_number, message in result.errors]}), 400
+        recipe = db.execute('SELECT * FROM recipes WHERE id = ?', (recipe_id,)).fetchone()
+        return _render_recipe_form(db, recipe_id, recipe, batch_text=text, batch_errors=result.errors,
+                                   create_missing=create_missing)
+
+    recipe_cost_cache.invalidate_recipe(recipe_id)
+    if wants_json:
+        return jsonify({'added': result.added, 'ingredients_created': result.ingredients_created})
+    message = f'Added {result.added} ingredient(s) to the recipe'
+    if result.ingredients_created:
+        message += f', including {result.ingredients_created} new base ingredient(s)'
+    flash(message + '.', 'success')
+    return redirect(url_for('edit_recipe', recipe_id=recipe_id))
+
 @app.route('/recipe/<int:recipe_id>/move_ingredient/<int:ingredient_id>/<direction>', methods=('POST',))
 def move_ingredient(recipe_id, ingredient_id, direction):
     """Handles moving an ingredient up or down in the list."""
-    db = get_db()
-
-    # Get the item we want to move
-    current_item = db.execute('SELECT * FROM recipe_ingredients WHERE recipe_id = ? AND ingredient_id = ?', 
-                              (recipe_id, ingredient_id)).fetchone()
-    if not current_item:
-        flash('Ingredient not found in recipe.', 'error')
+    if direction not in ('up', 'down'):
+        flash('Invalid move direction.', 'error')
         return redirect(url_for('edit_recipe', recipe_id=recipe_id))
 
-    current_sort_order = current_item['sort_order']
-    
-    # Determine the target item to swap with
-    if direction == 'up':
-        # Find the item with the highest sort_order that is *less than* the current one
-        swap_item = db.execute('''
-            SELECT * FROM recipe_ingredients WHERE recipe_id = ? AND sort_order < ?
-            ORDER BY sort_order DESC LIMIT 1
-        ''', (recipe_id, current_sort_order)).fetchone()
-    elif direction == 'down':
-        # Find the item with the lowest sort_order that is *greater than* the current one
-        swap_item = db.execute('''
-            SELECT * FROM recipe_ingredients WHERE recipe_id = ? AND sort_order > ?
-            ORDER BY sort_order ASC LIMIT 1
-        ''', (recipe_id, current_sort_order)).fetchone()
-    else:
-        flash('Invalid move direction.', 'error')
+    def swap_with_neighbour(ingredient_ids):
+        if ingredient_id not in ingredient_ids:
+            raise ValueError('Ingredient not found in recipe.')
+        position = ingredient_ids.index(ingredient_id)
+        target = position - 1 if direction == 'up' else position + 1
+        if 0 <= target < len(ingredient_ids):
+            ingredient_ids[position], ingredient_ids[target] = ingredient_ids[target], ingredient_ids[position]
+        return ingredient_ids
+
+    try:
+        updated = _reorder_recipe_lines(get_db(), recipe_id, swap_with_neighbour)
+    except ValueError as e:
+        flash(str(e), 'error')
         return redirect(url_for('edit_recipe', recipe_id=recipe_id))
 
-    # If a swap partner was found, perform the swap
-    if swap_item:
-        swap_sort_order = swap_item['sort_order']
-        
-        # Update the target item to have the current item's order
-        db.execute('UPDATE recipe_ingredients SET sort_order = ? WHERE recipe_id = ? AND ingredient_id = ?',
-                   (current_sort_order, recipe_id, swap_item['ingredient_id']))
-                   
-        # Update the current item to have the target item's order
-        db.execute('UPDATE recipe_ingredients SET sort_order = ? WHERE recipe_id = ? AND ingredient_id = ?',
-                   (swap_sort_order, recipe_id, current_item['ingredient_id']))
-                   
-        db.commit()
+    if updated:
+        recipe_cost_cache.invalidate_recipe(recipe_id)
         flash('Ingredient order updated.', 'success')
+    return redirect(url_for('edit_recipe', recipe_id=recipe_id))
+
+@app.route('/recipe/<int:recipe_id>/reorder_ingredients', methods=('POST',))
+def reorder_recipe_ingredients(recipe_id):
+    """
+    Applies a complete new ingredient order in one transaction. Accepts JSON
+    {"order": [ingredient ids]}, answered with JSON, or the ingredient_id fields of
+    the edit page's reorder form, answered with a redirect.
+    """
+    wants_json = request.is_json
+    if wants_json:
+        payload = request.get_json(silent=True)
+        raw_order = payload.get('order') if isinstance(payload, dict) else None
+    else:
+        raw_order = request.form.getlist('ingredient_id')
+    try:
+        try:
+            if not isinstance(raw_order, list):
+                raise TypeError
+            order = [int(ingredient_id) for ingredient_id in raw_order]
+        except (TypeError, ValueError):
+            raise ValueError('The order must be a list of ingredient ids.')
+        updated = _reorder_recipe_lines(get_db(), recipe_id, lambda ingredient_ids: order)
+    except ValueError as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        flash(str(e), 'error')
+        return redirect(url_for('edit_recipe', recipe_id=recipe_id))
 
+    if updated:
+        recipe_cost_cache.invalidate_recipe(recipe_id)
+    if wants_json:
+        return jsonify({'updated': updated})
+    flash('Ingredient order updated.', 'success')
     return redirect(url_for('edit_recipe', recipe_id=recipe_id))
 
 
@@ -398,6 +1447,7 @@ def delete_ingredient_from_recipe(recipe_id, ingredient_id):
     db = get_db()
     db.execute('DELETE FROM recipe_ingredients WHERE recipe_id = ? AND ingredient_id = ?', (recipe_id, ingredient_id))
     db.commit()
+    recipe_cost_cache.invalidate_recipe(recipe_id)
     flash('Ingredient removed from recipe.', 'success')
     return redirect(url_for('edit_recipe', recipe_id=recipe_id))
 
@@ -407,10 +1457,13 @@ def edit_recipe_ingredient(recipe_id, ingredient_id):
     db = get_db()
 
     if request.method == 'POST':
-        new_ingredient_id = request.form['ingredient_id']
+        new_ingredient_id = _ingredient_from_form(db, request.form)
         amount_needed = request.form['amount_needed']
         unit_needed = request.form['unit_needed']
 
+        if new_ingredient_id is None:
+            flash('Please pick an existing ingredient.', 'error')
+            return redirect(url_for('edit_recipe_ingredient', recipe_id=recipe_id, ingredient_id=ingredient_id))
         try:
             db.execute('''
                 UPDATE recipe_ingredients
@@ -418,6 +1471,7 @@ def edit_recipe_ingredient(recipe_id, ingredient_id):
                 WHERE recipe_id = ? AND ingredient_id = ?
             ''', (new_ingredient_id, amount_needed, unit_needed, recipe_id, ingredient_id))
             db.commit()
+            recipe_cost_cache.invalidate_recipe(recipe_id)
             flash('Recipe ingredient updated successfully!', 'success')
         except sqlite3.IntegrityError:
             flash('Could not update: That ingredient is already in the recipe.', 'error')
@@ -425,17 +1479,486 @@ def edit_recipe_ingredient(recipe_id, ingredient_id):
         return redirect(url_for('edit_recipe', recipe_id=recipe_id))
 
     recipe_ingredient = db.execute('''
-        SELECT * FROM recipe_ingredients WHERE recipe_id = ? AND ingredient_id = ?
+        SELECT ri.*, i.name FROM recipe_ingredients ri
+        JOIN ingredients i ON ri.ingredient_id = i.id
+        WHERE ri.recipe_id = ? AND ri.ingredient_id = ?
     ''', (recipe_id, ingredient_id)).fetchone()
 
     if recipe_ingredient is None:
         flash('Recipe ingredient not found.', 'error')
         return redirect(url_for('edit_recipe', recipe_id=recipe_id))
 
-    all_ingredients = db.execute('SELECT * FROM ingredients ORDER BY name').fetchall()
-
     return render_template('edit_recipe_ingredient.html', recipe_id=recipe_id,
-                           recipe_ingredient=recipe_ingredient, all_ingredients=all_ingredients, units=UNITS)
+                           recipe_ingredient=recipe_ingredient, units=UNITS)
+
+@app.route('/recipe/<int:recipe_id>/add_component', methods=('POST',))
+def add_component_to_recipe(recipe_id):
+    """Adds another recipe to this one as a sub-recipe, refusing links that would form a cycle."""
+    db = get_db()
+    component_recipe_id = request.form.get('component_recipe_id', type=int)
+    amount = request.form.get('amount_needed', type=float)
+    unit = request.form.get('unit_needed', '')
+
+    if component_recipe_id is None or amount is None or not amount > 0 or unit not in UNIT_DIMENSIONS:
+        flash('Choose a recipe, a positive amount and a unit.', 'error')
+        return redirect(url_for('edit_recipe', recipe_id=recipe_id))
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        known = db.execute('SELECT COUNT(*) FROM recipes WHERE id IN (?, ?)',
+                           (recipe_id, component_recipe_id)).fetchone()[0]
+        if component_recipe_id == recipe_id:
+            error = 'A recipe cannot be a sub-recipe of itself.'
+        elif known < 2:
+            error = 'Recipe not found.'
+        elif creates_cycle(db, recipe_id, component_recipe_id):
+            error = 'That recipe already uses this one, so it cannot also be a sub-recipe of it.'
+        else:
+            error = None
+            db.execute('''
+                INSERT INTO recipe_components (recipe_id, component_recipe_id, amount_needed, unit_needed, sort_order)
+                SELECT ?, ?, ?, ?, IFNULL(MAX(sort_order), 0) + ?
+                FROM recipe_components WHERE recipe_id = ?
+            ''', (recipe_id, component_recipe_id, amount, unit, SORT_KEY_GAP, recipe_id))
+        db.execute('COMMIT')
+    except sqlite3.IntegrityError:
+        db.execute('ROLLBACK')
+        error = 'This recipe is already a sub-recipe of this one.'
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+
+    if error:
+        flash(error, 'error')
+    else:
+        flash('Sub-recipe added to recipe.', 'success')
+    return redirect(url_for('edit_recipe', recipe_id=recipe_id))
+
+@app.route('/recipe/<int:recipe_id>/delete_component/<int:component_recipe_id>', methods=('POST',))
+def delete_component_from_recipe(recipe_id, component_recipe_id):
+    db = get_db()
+    db.execute('DELETE FROM recipe_components WHERE recipe_id = ? AND component_recipe_id = ?',
+               (recipe_id, component_recipe_id))
+    db.commit()
+    flash('Sub-recipe removed from recipe.', 'success')
+    return redirect(url_for('edit_recipe', recipe_id=recipe_id))
+
+# --- Report Routes ---
+
+@app.route('/reports/costs')
+def cost_report():
+    """Shows (or exports as CSV with ?format=csv) the current cost of every recipe."""
+    sort_by = request.args.get('sort_by', 'name')
+    if sort_by not in COST_REPORT_SORT_KEYS:
+        sort_by = 'name'
+    order = request.args.get('order', 'asc')
+    if order not in ['asc', 'desc']:
+        order = 'asc'
+
+    try:
+        report = sort_cost_report(calculate_all_recipe_costs(get_db()), sort_by, order)
+    except CycleError as e:
+        flash(f'Recipes could not be costed: {e}', 'error')
+        return render_template('cost_report.html', report=[], sort_by=sort_by, order=order)
+
+    if request.args.get('format') == 'csv':
+        stream = io.StringIO()
+        write_cost_report_csv(report, stream)
+        return Response(stream.getvalue(), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=recipe_costs.csv'})
+
+    return render_template('cost_report.html', report=report, sort_by=sort_by, order=order)
+
+@app.route('/reports/cost-history')
+def cost_history_report():
+    """
+    Returns, as JSON, how recipe costs moved over a period. Query parameters:
+    ids (comma-separated recipe ids, default every recipe), start and end
+    (YYYY-MM-DD, default the year up to today). Each recipe lists a point at
+    start and one on every date its cost changed.
+    """
+    try:
+        end = _parse_iso_date(request.args.get('end') or date.today().isoformat())
+        start = _parse_iso_date(request.args.get('start')
+                                or (date.fromisoformat(end) - timedelta(days=365)).isoformat())
+    except ValueError:
+        return jsonify({'error': 'start and end must be dates formatted as YYYY-MM-DD.'}), 400
+    if start > end:
+        return jsonify({'error': 'start must not be after end.'}), 400
+
+    recipe_ids = None
+    if request.args.get('ids'):
+        try:
+            recipe_ids = [int(recipe_id) for recipe_id in request.args['ids'].split(',')]
+        except ValueError:
+            return jsonify({'error': 'ids must be a comma-separated list of recipe ids.'}), 400
+
+    history = calculate_cost_history(get_db(), recipe_ids, start, end)
+    return jsonify({'start': start, 'end': end, 'recipes': list(history.values())})
+
+# One row per ingredient and base unit it was bought in: the purchase with the
+# lowest unit price, found by a seek on idx_purchases_cheapest, next to the
+# ingredient's latest purchase. Unit prices are only comparable within a base unit.
+CHEAPEST_PURCHASES_QUERY = '''
+    WITH base_units (base_unit) AS (VALUES {base_units})
+    SELECT i.id AS ingredient_id, i.name, b.base_unit,
+           p.store, p.brand, p.unit_price, p.purchase_date,
+           latest.unit_price AS latest_unit_price, latest.store AS latest_store
+    FROM ingredients i
+    CROSS JOIN base_units b
+    JOIN ingredient_purchases p ON p.id = (
+        SELECT q.id FROM ingredient_purchases q
+        WHERE q.ingredient_id = i.id AND q.base_unit = b.base_unit AND q.unit_price IS NOT NULL
+        ORDER BY q.unit_price, q.id
+        LIMIT 1
+    )
+    LEFT JOIN latest_purchase lp ON lp.ingredient_id = i.id
+    LEFT JOIN ingredient_purchases latest ON latest.id = lp.purchase_id AND latest.base_unit = b.base_unit
+    ORDER BY i.name, b.base_unit
+'''.format(base_units=', '.join(f"('{base_unit}')" for base_unit in BASE_UNITS.values()))
+
+@app.route('/reports/cheapest-stores')
+def cheapest_stores_report():
+    """Shows, per ingredient, the store where it was bought at the lowest unit price."""
+    rows = get_db().execute(CHEAPEST_PURCHASES_QUERY).fetchall()
+    return render_template('cheapest_stores.html', rows=rows)
+
+# --- Production Planner Routes ---
+
+@app.route('/planner', methods=('GET', 'POST'))
+def production_planner():
+    """Plans a production run of several recipes and builds the consolidated shopping list."""
+    db = get_db()
+    result = None
+    rows = []
+    if request.method == 'POST':
+        recipe_ids = request.form.getlist('recipe_id')
+        batches = request.form.getlist('batches')
+        rows = [(recipe_id, count) for recipe_id, count in zip(recipe_ids, batches) if recipe_id]
+        try:
+            plan = parse_plan(dict(rows))
+            result = plan_production(db, plan)
+        except ValueError as e:  # Includes CycleError from the sub-recipe graph
+            flash(str(e), 'error')
+
+    all_recipes = db.execute('SELECT id, name FROM recipes ORDER BY name').fetchall()
+    return render_template('planner.html', all_recipes=all_recipes, rows=rows, result=result)
+
+@app.route('/api/planner', methods=('POST',))
+def production_planner_api():
+    """JSON version of the planner: POST {recipe_id: batches}, get the shopping list back."""
+    try:
+        plan = parse_plan(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        return jsonify(plan_production(get_db(), plan))
+    except CycleError as e:
+        return jsonify({'error': str(e)}), 409
+
+# --- Pantry Routes ---
+
+PANTRY_EXPIRY_DAYS = 7
+
+def _parse_expiry_days(value):
+    """Returns the expiry window in whole days (0 or more), or raises ValueError."""
+    days = int(value)
+    if days < 0:
+        raise ValueError
+    return days
+
+@app.route('/pantry')
+def pantry():
+    """Shows the stock on hand, the lots expiring within ?days= days (default 7) and recent production runs."""
+    db = get_db()
+    try:
+        days = _parse_expiry_days(request.args.get('days', PANTRY_EXPIRY_DAYS))
+    except ValueError:
+        flash('The expiry window must be a whole number of days.', 'error')
+        days = PANTRY_EXPIRY_DAYS
+    all_recipes = db.execute('SELECT id, name FROM recipes ORDER BY name').fetchall()
+    return render_template('pantry.html', stock=on_hand(db), expiring=expiring_lots(db, days), days=days,
+                           runs=recent_runs(db), all_recipes=all_recipes, today=date.today().isoformat())
+
+@app.route('/api/pantry/expiring')
+def pantry_expiring_api():
+    """JSON list of the lots expiring within ?days= days (default 7), soonest first, for alerts."""
+    try:
+        days = _parse_expiry_days(request.args.get('days', PANTRY_EXPIRY_DAYS))
+    except ValueError:
+        return jsonify({'error': 'days must be a whole number of 0 or more.'}), 400
+    return jsonify([dict(lot) for lot in expiring_lots(get_db(), days)])
+
+@app.route('/pantry/run', methods=('POST',))
+def record_run():
+    """Records a production run, taking its ingredients from the pantry oldest lot first."""
+    try:
+        recipe_id = int(request.form.get('recipe_id', ''))
+        batches = float(request.form.get('batches', ''))
+        if not batches > 0 or math.isinf(batches):
+            raise ValueError
+    except ValueError:
+        flash('Choose a recipe and a positive number of batches.', 'error')
+        return redirect(url_for('pantry'))
+    try:
+        run_date = _parse_iso_date(request.form.get('run_date') or date.today().isoformat())
+        run_id = record_production_run(get_db(), recipe_id, batches, run_date)
+    except StockShortage as e:
+        for shortage in e.shortages:
+            flash(shortage, 'error')
+        return redirect(url_for('pantry'))
+    except (LookupError, ValueError) as e:
+        flash(str(e), 'error')
+        return redirect(url_for('pantry'))
+    flash('Production run recorded.', 'success')
+    return redirect(url_for('production_run_detail', run_id=run_id))
+
+@app.route('/pantry/run/<int:run_id>')
+def production_run_detail(run_id):
+    """Shows the lots a production run consumed and its cost, next to the cost at today's prices."""
+    db = get_db()
+    run = production_run(db, run_id)
+    if run is None:
+        abort(404)
+    current_cost = None
+    if run['recipe_name'] is not None:
+        try:
+            current_cost = calculate_recipe_cost(run['recipe_id'])['total'] * run['batches']
+        except CycleError as e:
+            flash(f"The cost at today's prices is unavailable: {e}", 'error')
+    return render_template('production_run.html', run=run, current_cost=current_cost)
+
+@app.route('/pantry/lot/<int:lot_id>/discard', methods=('POST',))
+def discard_pantry_lot(lot_id):
+    """Writes off what is left of a lot."""
+    try:
+        discard_lot(get_db(), lot_id)
+    except LookupError as e:
+        flash(str(e), 'error')
+    else:
+        flash('Lot discarded.', 'success')
+    return redirect(url_for('pantry', days=request.args.get('days', PANTRY_EXPIRY_DAYS)))
+
+# --- JSON API Routes ---
+
+# Read-only JSON for other systems (POS, label printers). Every list endpoint
+# takes ?ids=1,2,3 to fetch a batch with one IN query per table, and ?fields= to
+# project onto the fields a client needs; only those columns are selected and
+# only the computed fields asked for are computed. Responses are streamed from one
+# read snapshot.
+
+def _api_stream(db, objects):
+    """
+    Streams `objects` as a JSON array, all read from one snapshot. The first chunk
+    is made before the response starts, so costing errors (a cycle in the
+    sub-recipe graph) are still answered with an error status.
+    """
+    chunks = in_read_transaction(db, iter_json_array(objects))
+    try:
+        first = next(chunks)
+    except CycleError as e:
+        return jsonify({'error': str(e)}), 409
+    return Response(stream_with_context(_resume(first, chunks)), mimetype='application/json')
+
+def _resume(first, chunks):
+    yield first
+    yield from chunks
+
+def _iter_projected(db, sql, params, fields):
+    """Runs a query when first iterated and yields each row projected onto `fields`."""
+    for row in db.execute(sql, params):
+        yield project(row, fields)
+
+def _ids_filter(column, ids):
+    """Returns (WHERE clause, params) restricting `column` to `ids`, or no restriction for None."""
+    if ids is None:
+        return '', ()
+    return f'WHERE {column} IN (SELECT value FROM json_each(?))', (json.dumps(ids),)
+
+def _api_recipe_children(db, query, ids):
+    """Runs a per-recipe child query (lines or sub-recipes) once for all `ids`; returns {recipe_id: [rows]}."""
+    where, params = _ids_filter('recipe_id', ids)
+    children = {}
+    for row in db.execute(query.format(where=where), params):
+        children.setdefault(row['recipe_id'], []).append(
+            {key: row[key] for key in row.keys() if key != 'recipe_id'})
+    return children
+
+def _iter_api_recipes(db, ids, fields):
+    where, params = _ids_filter('r.id', ids)
+    rows = db.execute(f'SELECT {select_list(RECIPE_COLUMNS, fields)} FROM recipes r {where} ORDER BY r.id',
+                      params).fetchall()
+    lines = components = {}
+    if 'ingredients' in fields:
+        lines = _api_recipe_children(db, '''
+            SELECT recipe_id, ingredient_id, i.name, amount_needed, unit_needed
+            FROM recipe_ingredients ri JOIN ingredients i ON i.id = ri.ingredient_id
+            {where} ORDER BY recipe_id, sort_order
+        ''', ids)
+    if 'components' in fields:
+        components = _api_recipe_children(db, '''
+            SELECT recipe_id, component_recipe_id, c.name, amount_needed, unit_needed
+            FROM recipe_components rc JOIN recipes c ON c.id = rc.component_recipe_id
+            {where} ORDER BY recipe_id, sort_order
+        ''', ids)
+    costs = {}
+    if 'cost' in fields or 'cost_breakdown' in fields:
+        # The whole batch, sub-recipes included, is costed in one pass
+        costs = {recipe['id']: recipe
+                 for recipe in calculate_all_recipe_costs(db, ids, breakdown='cost_breakdown' in fields)}
+
+    for row in rows:
+        recipe_id = row['id']
+        recipe = {}
+        for field in fields:
+            if field in RECIPE_COLUMNS:
+                recipe[field] = row[field]
+            elif field == 'ingredients':
+                recipe[field] = lines.get(recipe_id, [])
+            elif field == 'components':
+                recipe[field] = components.get(recipe_id, [])
+            elif field == 'cost':
+                recipe[field] = costs[recipe_id]['total']
+            else:
+                recipe[field] = costs[recipe_id]['breakdown']
+        yield recipe
+
+@app.route('/api/recipes')
+def api_recipes():
+    """
+    Recipes as a JSON array, ordered by id: all of them or ?ids=1,2,3. ?fields=
+    picks from the recipe columns and the computed fields ingredients,
+    components, cost (the total, sub-recipes included) and cost_breakdown.
+    Costs are those shown on the recipe pages, computed for the whole batch at once.
+    """
+    try:
+        ids = parse_ids(request.args.get('ids'))
+        fields = parse_fields(request.args.get('fields'), [*RECIPE_COLUMNS, *RECIPE_COMPUTED],
+                              RECIPE_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    db = get_db()
+    return _api_stream(db, _iter_api_recipes(db, ids, fields))
+
+def _iter_api_costs(db, ids, fields):
+    for recipe in calculate_all_recipe_costs(db, ids):
+        yield project(recipe, fields)
+
+@app.route('/api/costs')
+def api_costs():
+    """
+    Current recipe costs as a JSON array, ordered by recipe id, with the cost
+    report's fields (id, name, yield, total, lines, unpriced_lines). All recipes,
+    or just ?ids=1,2,3 and their sub-recipes, are costed in one pass.
+    """
+    try:
+        ids = parse_ids(request.args.get('ids'))
+        fields = parse_fields(request.args.get('fields'), COST_REPORT_FIELDS, COST_REPORT_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    db = get_db()
+    return _api_stream(db, _iter_api_costs(db, ids, fields))
+
+@app.route('/api/ingredients')
+def api_ingredients():
+    """
+    Ingredients as a JSON array, ordered by id: all of them or ?ids=1,2,3, with
+    their latest purchase. ?fields= picks the fields (see api.INGREDIENT_COLUMNS).
+    """
+    try:
+        ids = parse_ids(request.args.get('ids'))
+        fields = parse_fields(request.args.get('fields'), INGREDIENT_COLUMNS, INGREDIENT_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    db = get_db()
+    where, params = _ids_filter('i.id', ids)
+    return _api_stream(db, _iter_projected(db, f'''
+        SELECT {select_list(INGREDIENT_COLUMNS, fields)}
+        FROM ingredients i LEFT JOIN latest_purchase lp ON lp.ingredient_id = i.id
+        {where} ORDER BY i.id
+    ''', params, fields))
+
+@app.route('/api/purchases')
+def api_purchases():
+    """
+    Purchases as a JSON array, ordered by id: all of them, ?ids=1,2,3, or the
+    purchases of ?ingredient_ids=4,5. ?fields= picks the fields (see
+    api.PURCHASE_COLUMNS). The whole history can be large; it is streamed
+    straight from the cursor.
+    """
+    try:
+        ids = parse_ids(request.args.get('ids'))
+        ingredient_ids = parse_ids(request.args.get('ingredient_ids'), 'ingredient_ids')
+        fields = parse_fields(request.args.get('fields'), PURCHASE_COLUMNS, PURCHASE_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    db = get_db()
+    if ids is not None:
+        where, params = _ids_filter('ip.id', ids)
+    else:
+        where, params = _ids_filter('ip.ingredient_id', ingredient_ids)
+    if ids is not None and ingredient_ids is not None:
+        where += ' AND ip.ingredient_id IN (SELECT value FROM json_each(?))'
+        params += (json.dumps(ingredient_ids),)
+    return _api_stream(db, _iter_projected(db, f'''
+        SELECT {select_list(PURCHASE_COLUMNS, fields)}
+        FROM ingredient_purchases ip JOIN ingredients i ON i.id = ip.ingredient_id
+        {where} ORDER BY ip.id
+    ''', params, fields))
+
+# --- Export Routes ---
+
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+@app.route('/export/<export_name>.<file_format>')
+def export_data(export_name, file_format):
+    """
+    Streams a table (or 'all' tables, NDJSON only) from one consistent read
+    snapshot, without building the response in memory.
+    """
+    if file_format not in EXPORT_MIMETYPES:
+        abort(404)
+    try:
+        chunks = stream_export(get_db(), export_name, file_format)
+    except ValueError:
+        abort(404)
+    filename = f'{export_name}.{file_format}'
+    return Response(stream_with_context(chunks), mimetype=EXPORT_MIMETYPES[file_format],
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.cli.command('export-data')
+@click.argument('export_name', default='all')
+@click.option('--format', 'file_format', type=click.Choice(sorted(EXPORT_MIMETYPES)), default='ndjson')
+@click.option('--output', type=click.File('w'), default='-', help='File to write (default: stdout).')
+def export_data_command(export_name, file_format, output):
+    """Streams a table, or 'all' tables as NDJSON, to a file."""
+    try:
+        chunks = stream_export(get_db(), export_name, file_format)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for chunk in chunks:
+        output.write(chunk)
+
+@app.cli.command('snapshot')
+@click.argument('dest')
+@click.option('--pages', default=256, show_default=True, help='Pages copied per backup step.')
+def snapshot_command(dest, pages):
+    """Takes a consistent online copy of the database, a few pages at a time."""
+    def progress(status, remaining, total):
+        print(f"\r{total - remaining}/{total} pages", end='', flush=True)
+    snapshot(get_db(), dest, pages_per_step=pages, progress=progress)
+    print(f"\nSnapshot written to {dest}.")
+
+@app.cli.command('restore')
+@click.argument('export_path', type=click.Path(exists=True, dir_okay=False))
+@click.argument('dest')
+def restore_command(export_path, dest):
+    """Bulk-loads a full NDJSON export (see export-data) into a new database file."""
+    start = time.perf_counter()
+    with open(export_path, encoding='utf-8') as stream:
+        counts = restore(stream, dest)
+    summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+    print(f"Restored {summary} into {dest} in {time.perf_counter() - start:.2f}s.")
 
 # --- Base Ingredient Management Routes ---
 
@@ -463,7 +1986,11 @@ def edit_base_ingredient(ingredient_id):
 
         db.execute('UPDATE ingredients SET name = ?, density_g_ml = ? WHERE id = ?',
                    (name, density, ingredient_id))
+        # Name and density both show up in cost breakdowns
+        _queue_recost(db, [ingredient_id])
         db.commit()
+        recipe_cost_cache.invalidate_ingredient(ingredient_id)
+        _notify_job_workers()
         flash(f"'{name}' has been updated.", 'success')
         return redirect(url_for('list_base_ingredients'))
 
@@ -472,40 +1999,104 @@ def edit_base_ingredient(ingredient_id):
 
 # --- Ingredient Purchase Routes ---
 
+# The purchase list pages by keyset: each page starts strictly after (or before)
+# the (sort value, id) of the last row shown, so deep pages cost the same as the
+# first. Each sort has its own FROM clause so SQLite walks a matching index.
+PURCHASE_SORTS = {
+    # sort_by: (FROM clause, sort expression)
+    'name': ('ingredients i CROSS JOIN ingredient_purchases ip ON ip.ingredient_id = i.id', 'i.name'),
+    'store': ('ingredient_purchases ip JOIN ingredients i ON ip.ingredient_id = i.id', "IFNULL(ip.store, '')"),
+    'purchase_date': ('ingredient_purchases ip JOIN ingredients i ON ip.ingredient_id = i.id', 'ip.purchase_date'),
+    'unit_price': ('ingredient_purchases ip JOIN ingredients i ON ip.ingredient_id = i.id', 'IFNULL(ip.unit_price, 0)'),
+}
+PURCHASES_PER_PAGE = 25
+
+def _purchases_page_query(sort_by, descending, with_cursor):
+    """Builds the keyset query for one page; params are (value, value, id, limit) or (limit,)."""
+    from_clause, sort_expr = PURCHASE_SORTS[sort_by]
+    cmp = '<' if descending else '>'
+    direction = 'DESC' if descending else 'ASC'
+    where = f'WHERE {sort_expr} {cmp}= ? AND ({sort_expr} {cmp} ? OR ip.id {cmp} ?)' if with_cursor else ''
+    return f'''
+        SELECT ip.*, i.name, {sort_expr} AS sort_key
+        FROM {from_clause}
+        {where}
+        ORDER BY {sort_expr} {direction}, ip.id {direction}
+        LIMIT ?
+    '''
+
+def _encode_cursor(row):
+    raw = json.dumps([row['sort_key'], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def _decode_cursor(token):
+    """Returns (sort value, id) from a page cursor, or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        return value, int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+def _purchase_page_hot_queries():
+    """The purchase list queries, for the query plan check."""
+    queries = {}
+    for sort_by in PURCHASE_SORTS:
+        for descending in (False, True):
+            label = f"purchases page by {sort_by} {'desc' if descending else 'asc'}"
+            queries[label + ' (first)'] = (_purchases_page_query(sort_by, descending, False), (26,))
+            queries[label + ' (deep)'] = (_purchases_page_query(sort_by, descending, True), ('m', 'm', 1, 26))
+    return queries
+
 @app.route('/ingredients')
 def list_ingredients():
     db = get_db()
 
     page = request.args.get('page', 1, type=int)
-    per_page = 25
-    offset = (page - 1) * per_page
+    per_page = PURCHASES_PER_PAGE
 
     sort_by = request.args.get('sort_by', 'purchase_date')
     order = request.args.get('order', 'desc')
 
-    allowed_sort_columns = {
-        'name': 'i.name',
-        'store': 'ip.store',
-        'purchase_date': 'ip.purchase_date'
-    }
-    sort_column = allowed_sort_columns.get(sort_by, 'ip.purchase_date')
-    
+    if sort_by not in PURCHASE_SORTS:
+        sort_by = 'purchase_date'
     if order not in ['asc', 'desc']:
         order = 'desc'
 
-    query = f'''
-        SELECT ip.*, i.name
-        FROM ingredient_purchases ip JOIN ingredients i ON ip.ingredient_id = i.id
-        ORDER BY {sort_column} {order}
-        LIMIT ? OFFSET ?
-    '''
-    purchases = db.execute(query, (per_page, offset)).fetchall()
-
-    total_purchases = db.execute('SELECT COUNT(id) FROM ingredient_purchases').fetchone()[0]
-    total_pages = (total_purchases + per_page - 1) // per_page
+    # A page is requested relative to a neighbour: ?after=<cursor> for the next
+    # page, ?before=<cursor> for the previous one. Neither means the first page.
+    before = request.args.get('before')
+    forward = not before
+    cursor = _decode_cursor(request.args.get('after') if forward else before)
+    if cursor is None:
+        forward, page = True, 1
+
+    # Walking backwards scans in the opposite order, then flips the page around
+    descending = (order == 'desc') == forward
+    query = _purchases_page_query(sort_by, descending, cursor is not None)
+    params = (cursor[0], cursor[0], cursor[1], per_page + 1) if cursor else (per_page + 1,)
+    purchases = db.execute(query, params).fetchall()
+
+    more = len(purchases) > per_page
+    purchases = purchases[:per_page]
+    if not forward:
+        purchases.reverse()
+        if not more:
+            page = 1
+
+    has_next = more if forward else True
+    has_prev = (cursor is not None) if forward else more
+    next_cursor = _encode_cursor(purchases[-1]) if has_next and purchases else None
+    prev_cursor = _encode_cursor(purchases[0]) if has_prev and purchases else None
+
+    total_purchases = db.execute(
+        "SELECT row_count FROM row_counts WHERE table_name = 'ingredient_purchases'").fetchone()[0]
+    total_pages = max((total_purchases + per_page - 1) // per_page, 1)
 
     return render_template('ingredients.html', purchases=purchases,
                            page=page, total_pages=total_pages,
+                           next_cursor=next_cursor, prev_cursor=prev_cursor,
                            sort_by=sort_by, order=order)
 
 @app.route('/ingredient/add', methods=('GET', 'POST'))
@@ -533,49 +2124,209 @@ def add_ingredient():
             else:
                 cursor.execute("INSERT INTO ingredients (name) VALUES (?)", (name,))
                 ingredient_id = cursor.lastrowid
+            package_amount, price = float(package_amount), float(price)
             cursor.execute('''
-                INSERT INTO ingredient_purchases (ingredient_id, brand, store, package_amount, package_unit, price, purchase_date, expiry_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (ingredient_id, brand, store, float(package_amount), package_unit, float(price), purchase_date, expiry_date))
+                INSERT INTO ingredient_purchases (ingredient_id, brand, store, package_amount, package_unit, price, purchase_date, expiry_date,
+                                                  unit_price, base_unit)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (ingredient_id, brand, store, package_amount, package_unit, price, purchase_date, expiry_date,
+                  *unit_price(price, package_amount, package_unit)))
+            if request.form.get('add_to_pantry'):
+                stock_purchase(db, cursor.lastrowid)
+            _queue_recost(db, [ingredient_id])
             db.commit()
+            recipe_cost_cache.invalidate_ingredient(ingredient_id)
+            _notify_job_workers()
             flash('Ingredient purchase added successfully!', 'success')
             return redirect(url_for('list_ingredients'))
     
-    # For a GET request, prepare data for the auto-fill form
-    all_ingredients = db.execute('SELECT id, name FROM ingredients ORDER BY name').fetchall()
-    
-    latest_purchases_data = {}
-    for ingredient in all_ingredients:
-        latest_purchase = db.execute('''
-            SELECT brand, store, package_amount, package_unit, price
-            FROM ingredient_purchases
-            WHERE ingredient_id = ?
-            ORDER BY purchase_date DESC
-            LIMIT 1
-        ''', (ingredient['id'],)).fetchone()
-        
-        if latest_purchase:
-            # Store the data using the ingredient's name as the key
-            latest_purchases_data[ingredient['name']] = {
-                'brand': latest_purchase['brand'],
-                'store': latest_purchase['store'],
-                'package_amount': latest_purchase['package_amount'],
-                'package_unit': latest_purchase['package_unit'],
-                'price': latest_purchase['price']
-            }
-            
+    # For a GET request, the form looks names up in ingredient_search as they are
+    # typed and fetches their auto-fill data from ingredient_autofill
     return render_template('ingredient_form.html',
                            units=UNITS,
-                           today_date=date.today().isoformat(),
-                           all_ingredients=all_ingredients,
-                           # Pass the raw dictionary, NOT a JSON string
-                           latest_purchases_data=latest_purchases_data)
+                           today_date=date.today().isoformat())
+
+@app.route('/ingredient/autofill')
+def ingredient_autofill():
+    """
+    Returns the latest purchase details per ingredient name as JSON, for the
+    add-purchase form. Pass ?name=... to fetch a single ingredient.
+    Responses carry an ETag derived from the table change versions, so an
+    unchanged catalog is answered with 304 before anything is queried.
+    """
+    db = get_db()
+    name = request.args.get('name')
+    etag = 'autofill-{}-{}'.format(get_table_version(db, 'ingredient_purchases'),
+                                   get_table_version(db, 'ingredients'))
+    if name is not None:
+        etag += '-' + hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        query = '''
+            SELECT i.name, lp.brand, lp.store, lp.package_amount, lp.package_unit, lp.price
+            FROM latest_purchase lp
+            JOIN ingredients i ON lp.ingredient_id = i.id
+        '''
+        params = ()
+        if name is not None:
+            query += ' WHERE i.name = ?'
+            params = (name.strip(),)
+
+        # Keyed by ingredient name, matching what the form's name field holds
+        latest_purchases_data = {
+            row['name']: {
+                'brand': row['brand'],
+                'store': row['store'],
+                'package_amount': row['package_amount'],
+                'package_unit': row['package_unit'],
+                'price': row['price']
+            }
+            for row in db.execute(query, params)
+        }
+        response = jsonify(latest_purchases_data)
+
+    response.set_etag(etag)
+    # Always revalidate; the ETag makes revalidation a cheap 304.
+    response.cache_control.no_cache = True
+    return response
+
+class NameIndex:
+    """
+    An in-memory array of (name, id) pairs sorted case-insensitively, for typeahead
+    lookups: names starting with the text are found by bisection, then names
+    containing it elsewhere by a scan. The array is rebuilt whenever the source
+    table's change version moves, so it is at most one lookup behind the database.
+    """
+
+    def __init__(self, table, query):
+        self.table = table
+        self.query = query  # Must return id and name
+        self.version = None
+        self._keys = []     # Case-folded names, sorted
+        self._entries = []  # (case-folded name, name, id), parallel to _keys
+        self._lock = threading.Lock()
+
+    def search(self, db, text, limit):
+        """Returns up to `limit` {'id', 'name'} dicts matching `text`, prefix matches first."""
+        version = get_table_version(db, self.table)
+        with self._lock:
+            if version != self.version:
+                self._entries = sorted((row['name'].casefold(), row['name'], row['id'])
+                                       for row in db.execute(self.query))
+                self._keys = [entry[0] for entry in self._entries]
+                self.version = version
+            keys, entries = self._keys, self._entries
+
+        needle = text.strip().casefold()
+        if not needle or limit <= 0:
+            return []
+        matches = []
+        for position in range(bisect.bisect_left(keys, needle), len(keys)):
+            if len(matches) == limit or not keys[position].startswith(needle):
+                break
+            matches.append(entries[position])
+        if len(matches) < limit:
+            for entry in entries:
+                if needle in entry[0] and not entry[0].startswith(needle):
+                    matches.append(entry)
+                    if len(matches) == limit:
+                        break
+        return [{'id': ingredient_id, 'name': name} for _, name, ingredient_id in matches]
+
+ingredient_names = NameIndex('ingredients', 'SELECT id, name FROM ingredients')
+
+INGREDIENT_SEARCH_LIMIT = 10
+
+@app.route('/ingredients/search')
+def ingredient_search():
+    """
+    Returns the ingredients whose names start with (or else contain) ?q=, as a JSON
+    list of {id, name}, for the typeahead ingredient fields. ?limit= caps the
+    number of matches (default 10, at most 50).
+    """
+    try:
+        limit = min(int(request.args.get('limit', INGREDIENT_SEARCH_LIMIT)), 50)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer.'}), 400
+    return jsonify(ingredient_names.search(get_db(), request.args.get('q', ''), limit))
+
+def _ingredient_from_form(db, form):
+    """
+    Returns the id of the ingredient picked in a typeahead field: the ingredient_id
+    filled in by the picker, or else the ingredient whose name was typed in full
+    into ingredient_name. Returns None if neither names an ingredient.
+    """
+    ingredient_id = form.get('ingredient_id', '').strip()
+    if ingredient_id:
+        try:
+            return int(ingredient_id)
+        except ValueError:
+            return None
+    row = db.execute('SELECT id FROM ingredients WHERE name = ?',
+                     (form.get('ingredient_name', '').strip(),)).fetchone()
+    return row['id'] if row else None
+
+@app.route('/ingredients/import', methods=('GET', 'POST'))
+def import_ingredients():
+    """Bulk-imports purchases from an uploaded CSV or JSON file."""
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        file_format = request.form.get('format', 'csv')
+        if upload is None or not upload.filename:
+            flash('Please choose a file to import.', 'error')
+        elif file_format not in READERS:
+            flash('Unsupported file format.', 'error')
+        else:
+            # Decode the upload as a text stream so it is read row by row
+            stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+            try:
+                result = _run_purchase_import(get_db(), READERS[file_format](stream))
+            except (ValueError, UnicodeDecodeError, csv.Error) as e:
+                flash(f'The file could not be read: {e}', 'error')
+            else:
+                category = 'error' if result.rejected else 'success'
+                flash(f'Imported {result.imported} purchase(s); {result.rejected} row(s) rejected.', category)
+                return render_template('import_form.html', result=result, fields=PURCHASE_FIELDS)
+
+    return render_template('import_form.html', result=None, fields=PURCHASE_FIELDS)
+
+def _run_purchase_import(db, rows):
+    """Imports rows, invalidates the cached costs of every recipe they affect and queues their recosting."""
+    result = import_purchases(db, rows)
+    for ingredient_id in result.ingredient_ids:
+        recipe_cost_cache.invalidate_ingredient(ingredient_id)
+    with db:
+        _queue_recost(db, result.ingredient_ids)
+    _notify_job_workers()
+    return result
+
+@app.cli.command('import-purchases')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(sorted(READERS)),
+              help='File format (default: guessed from the extension).')
+@click.option('--chunk-size', default=5000, show_default=True, help='Rows per transaction.')
+def import_purchases_command(path, file_format, chunk_size):
+    """Bulk-imports ingredient purchases from a CSV or JSON file."""
+    file_format = file_format or ('json' if path.lower().endswith(('.json', '.ndjson', '.jsonl')) else 'csv')
+    start = time.perf_counter()
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        result = import_purchases(get_db(), READERS[file_format](stream), chunk_size=chunk_size)
+    # Web processes (or `flask run-jobs`) pick the recosting up from the job table
+    with get_db() as db:
+        _queue_recost(db, result.ingredient_ids)
+    elapsed = time.perf_counter() - start
+    for row_number, message in result.errors:
+        print(f"Row {row_number}: {message}")
+    print(f"Imported {result.imported} purchase(s) ({result.ingredients_created} new ingredient(s)), "
+          f"rejected {result.rejected}, in {elapsed:.2f}s.")
 
 @app.route('/ingredient/edit/<int:purchase_id>', methods=('GET', 'POST'))
 def edit_ingredient(purchase_id):
     db = get_db()
     purchase = db.execute('''
-        SELECT ip.id, ip.brand, ip.store, ip.package_amount, ip.package_unit, ip.price, ip.purchase_date, ip.expiry_date, i.name
+        SELECT ip.id, ip.ingredient_id, ip.brand, ip.store, ip.package_amount, ip.package_unit, ip.price, ip.purchase_date, ip.expiry_date, i.name
         FROM ingredient_purchases ip
         JOIN ingredients i ON ip.ingredient_id = i.id
         WHERE ip.id = ?
@@ -608,14 +2359,21 @@ def edit_ingredient(purchase_id):
             cursor.execute("INSERT INTO ingredients (name) VALUES (?)", (name,))
             ingredient_id = cursor.lastrowid
 
+        package_amount, price = float(package_amount), float(price)
         cursor.execute('''
             UPDATE ingredient_purchases
             SET ingredient_id = ?, brand = ?, store = ?, package_amount = ?, package_unit = ?,
-                price = ?, purchase_date = ?, expiry_date = ?
+                price = ?, purchase_date = ?, expiry_date = ?, unit_price = ?, base_unit = ?
             WHERE id = ?
-        ''', (ingredient_id, brand, store, float(package_amount), package_unit, float(price),
-              purchase_date, expiry_date, purchase_id))
+        ''', (ingredient_id, brand, store, package_amount, package_unit, price,
+              purchase_date, expiry_date, *unit_price(price, package_amount, package_unit), purchase_id))
+        sync_purchase_lot(db, purchase_id)
+        # The purchase may have moved to another ingredient; both latest prices can change
+        _queue_recost(db, [purchase['ingredient_id'], ingredient_id])
         db.commit()
+        recipe_cost_cache.invalidate_ingredient(purchase['ingredient_id'])
+        recipe_cost_cache.invalidate_ingredient(ingredient_id)
+        _notify_job_workers()
 
         flash('Ingredient purchase updated successfully!', 'success')
         return redirect(url_for('list_ingredients'))
@@ -0,0 +1,177 @@
+# bench_routes.py
+#
+# Benchmarks the hot routes through Flask's test client against a database built
+# by generate_data.py. Reports p50/p95 latency and SQL statements per request,
+# and compares them with a stored baseline.
+#
+# Usage (from the project root):
+#     python benchmarks/generate_data.py bench.db
+#     python benchmarks/bench_routes.py bench.db --save-baseline   # record a baseline
+#     python benchmarks/bench_routes.py bench.db                   # compare against it
+#
+# The comparison exits non-zero when a case's p95 grows by more than --tolerance
+# or it runs more statements per request than the baseline did.
+
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as recipe_app
+import instrumentation
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+_QUERIES_HEADER = re.compile(r'desc="(\d+) queries"')
+
+def _percentile(sorted_values, fraction):
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+def _deep_cursor(db, sort_by, descending, depth):
+    """The cursor of the row `depth` rows into the purchase list, as the route would encode it."""
+    row = db.execute(f'''
+        SELECT * FROM ({recipe_app._purchases_page_query(sort_by, descending, False)})
+        LIMIT 1 OFFSET ?
+    ''', (depth + 1, depth)).fetchone()
+    return recipe_app._encode_cursor(row)
+
+def build_cases(db_path, rng):
+    """Returns {case name: callable returning (latency seconds, statements executed)}."""
+    db = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    db.row_factory = sqlite3.Row
+    recipe_ids = [row[0] for row in db.execute('SELECT id FROM recipes')]
+    purchases = db.execute("SELECT row_count FROM row_counts WHERE table_name = 'ingredient_purchases'").fetchone()[0]
+    deep = max(purchases - purchases // 10, 0)
+    deep_by_date = _deep_cursor(db, 'purchase_date', True, deep)
+    deep_by_name = _deep_cursor(db, 'name', False, deep)
+    ingredient_names = [row[0] for row in db.execute('SELECT name FROM ingredients')]
+    recipe_words = sorted({word for (name,) in db.execute('SELECT name FROM recipes')
+                           for word in name.lower().split() if not word.isdigit()})
+    db.close()
+
+    client = recipe_app.app.test_client()
+    # Recipe pages are visited in a shuffled rotation, so each timed request is a
+    # page not rendered before; the cached case revisits a handful of recipes
+    detail_ids = rng.sample(recipe_ids, len(recipe_ids))
+    detail_rotation = itertools.cycle(detail_ids)
+    cached_detail_ids = detail_ids[:5]
+
+    def get(url_factory, prepare=None):
+        def run():
+            if prepare is not None:
+                prepare()
+            start = time.perf_counter()
+            response = client.get(url_factory())
+            response.get_data()
+            elapsed = time.perf_counter() - start
+            if response.status_code != 200:
+                raise RuntimeError(f'{response.request.path} returned {response.status_code}')
+            match = _QUERIES_HEADER.search(response.headers.get('Server-Timing', ''))
+            return elapsed, int(match.group(1)) if match else 0
+        return run
+
+    def cold_recipe_cost():
+        recipe_id = rng.choice(recipe_ids)
+        with recipe_app.app.app_context():
+            recipe_app.recipe_cost_cache.invalidate_recipe(recipe_id)
+            instrumentation.start_request(float('inf'))
+            start = time.perf_counter()
+            recipe_app.calculate_recipe_cost(recipe_id)
+            elapsed = time.perf_counter() - start
+            stats = instrumentation.end_request()
+        return elapsed, stats.query_count
+
+    return {
+        'index': get(lambda: '/'),
+        'index search': get(lambda: f'/?q={rng.choice(recipe_words)}'),
+        'recipe_detail': get(lambda: f'/recipe/{next(detail_rotation)}',
+                             prepare=recipe_app.recipe_fragment_cache.clear),
+        'recipe_detail (cached)': get(lambda: f'/recipe/{rng.choice(cached_detail_ids)}'),
+        'list_ingredients first page': get(lambda: '/ingredients'),
+        'list_ingredients deep page (date)': get(lambda: f'/ingredients?after={deep_by_date}'),
+        'list_ingredients deep page (name)': get(
+            lambda: f'/ingredients?sort_by=name&order=asc&after={deep_by_name}'),
+        'add_ingredient GET': get(lambda: '/ingredient/add'),
+        'ingredient autofill': get(lambda: f'/ingredient/autofill?name={rng.choice(ingredient_names)}'),
+        'calculate_recipe_cost (cold)': cold_recipe_cost,
+    }
+
+def run_benchmarks(cases, requests, warmup):
+    results = {}
+    for name, run in cases.items():
+        for _ in range(warmup):
+            run()
+        latencies, queries = [], []
+        for _ in range(requests):
+            elapsed, statements = run()
+            latencies.append(elapsed)
+            queries.append(statements)
+        latencies.sort()
+        results[name] = {
+            'p50_ms': _percentile(latencies, 0.50) * 1000,
+            'p95_ms': _percentile(latencies, 0.95) * 1000,
+            'queries': sum(queries) / len(queries),
+        }
+    return results
+
+def compare(results, baseline, tolerance):
+    """Prints results next to the baseline; returns the names of regressed cases."""
+    regressions = []
+    print(f"{'case':<36} {'p50 ms':>9} {'p95 ms':>9} {'queries':>8}   vs baseline")
+    for name, result in results.items():
+        line = f"{name:<36} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} {result['queries']:8.1f}"
+        base = baseline.get(name)
+        if base:
+            change = (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0.0
+            line += f"   p95 {change:+.0%}, queries {result['queries'] - base['queries']:+.1f}"
+            if change > tolerance or result['queries'] > base['queries'] + 0.05:
+                regressions.append(name)
+                line += '  REGRESSION'
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot routes.')
+    parser.add_argument('database', help='a database built by generate_data.py')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per case')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests per case')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 growth (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    # Instrumentation provides the per-request statement counts (Server-Timing header)
+    recipe_app.DATABASE = os.path.abspath(args.database)
+    recipe_app.app.config['INSTRUMENTATION_ENABLED'] = True
+    recipe_app.app.config['SLOW_QUERY_MS'] = float('inf')
+    recipe_app.app.config['N_PLUS_ONE_THRESHOLD'] = float('inf')
+
+    cases = build_cases(recipe_app.DATABASE, random.Random(args.seed))
+    results = run_benchmarks(cases, args.requests, args.warmup)
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'database': os.path.basename(args.database), 'results': results}, f, indent=2)
+        print(f"Baseline written to {args.baseline}.")
+    elif not baseline:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one.")
+    if regressions:
+        print(f"{len(regressions)} case(s) regressed: {', '.join(regressions)}")
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# bench_units.py
+#
+# Micro-benchmark for the unit converter: per-row cost of the old string-keyed
+# branching versus the compiled lookup in units.py.
+#
+# Usage (from the project root):
+#     python benchmarks/bench_units.py [rows]
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from units import UNITS, UNIT_DIMENSIONS, CONVERSIONS_TO_BASE, conversion_factor, convert_many
+
+def legacy_to_grams(amount, unit, density):
+    """The branching previously inlined in recipe_detail and calculate_recipe_cost."""
+    dimension = UNIT_DIMENSIONS.get(unit)
+    if dimension == 'weight':
+        return amount * CONVERSIONS_TO_BASE.get(unit, 0)
+    elif dimension == 'volume' and density:
+        base_ml = amount * CONVERSIONS_TO_BASE.get(unit, 0)
+        return base_ml * density
+    return None
+
+def compiled_to_grams(amount, unit, density):
+    factor = conversion_factor(unit, 'g', density)
+    return amount * factor if factor is not None else None
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = random.Random(42)
+    convertible = [unit[0] for unit in UNITS if unit[2] != 'quantity']
+    data = [(rng.uniform(0.1, 500), rng.choice(convertible), rng.choice([None, 0.92, 1.03]))
+            for _ in range(rows)]
+    amounts = [row[0] for row in data]
+
+    cases = {
+        'legacy branching (per row)': lambda: [legacy_to_grams(*row) for row in data],
+        'compiled factor (per row)': lambda: [compiled_to_grams(*row) for row in data],
+        'compiled convert_many (batch)': lambda: convert_many(amounts, 'Cup', 'g', 0.92),
+    }
+    print(f"{rows} rows")
+    for label, fn in cases.items():
+        best = min(timeit.repeat(fn, number=1, repeat=5))
+        print(f"  {label:<32} {best * 1e9 / rows:8.1f} ns/row")
+
+if __name__ == '__main__':
+    main()
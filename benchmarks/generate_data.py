@@ -0,0 +1,178 @@
+# generate_data.py
+#
+# Builds a synthetic recipes database for benchmarking. The same seed always
+# produces the same data. Purchases use every unit in UNITS, and ingredients mix
+# weight, volume and count units, with and without a density, so every
+# conversion path in costing is exercised.
+#
+# Usage (from the project root):
+#     python benchmarks/generate_data.py bench.db [--ingredients 2000]
+#         [--purchases-per-ingredient 500] [--recipes 5000]
+#         [--ingredients-per-recipe 12] [--seed 42]
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from exporter import BASE_TABLES_VERSION
+from migrations import migrate
+from units import UNITS
+
+UNITS_BY_DIMENSION = {}
+for _code, _label, _dimension in UNITS:
+    UNITS_BY_DIMENSION.setdefault(_dimension, []).append(_code)
+
+# (dimension purchased in, has a density) for each kind of ingredient. Recipes can
+# ask for a weight ingredient by volume (and vice versa); that only costs out
+# when the ingredient has a density, so both cases are generated.
+INGREDIENT_KINDS = [
+    ('weight', True),
+    ('weight', False),
+    ('volume', True),
+    ('volume', False),
+    ('quantity', False),
+]
+
+WORDS = ['flour', 'sugar', 'butter', 'milk', 'cream', 'yeast', 'salt', 'honey', 'oil',
+         'vanilla', 'cocoa', 'almond', 'oat', 'rye', 'egg', 'lemon', 'cinnamon', 'rice',
+         'walnut', 'raisin', 'cheese', 'tomato', 'basil', 'garlic', 'onion', 'pepper']
+QUALIFIERS = ['organic', 'fine', 'raw', 'whole', 'light', 'dark', 'smoked', 'fresh',
+              'dried', 'ground', 'sweet', 'bitter', 'toasted', 'wild', 'golden']
+STORES = ['Costco', 'Walmart', 'Kroger', 'Aldi', 'Trader Joes', 'Whole Foods',
+          'Safeway', 'Local Market', None]
+BRANDS = ['Acme', 'Best Choice', 'Great Value', 'Kirkland', 'Simply', 'Farm Fresh', None]
+
+# Package sizes per unit, so prices per gram stay in a believable range
+PACKAGE_AMOUNTS = {
+    'g': (100, 5000), 'kg': (0.5, 25), 'lb': (1, 50), 'oz': (4, 64),
+    'ml': (100, 4000), 'l': (0.5, 20), 'fl.oz': (8, 128), 'Gal': (0.5, 5),
+    'pnt': (1, 8), 'qrt': (1, 8), 'tsp': (12, 96), 'Tbsp': (8, 64), 'Cup': (2, 32),
+    'ea': (1, 1), 'pack': (6, 48),
+}
+RECIPE_AMOUNTS = {'weight': ('g', 5, 1000), 'volume': ('ml', 5, 750), 'quantity': ('ea', 1, 12)}
+
+def _ingredients(rng, count):
+    for ingredient_id in range(1, count + 1):
+        dimension, has_density = INGREDIENT_KINDS[ingredient_id % len(INGREDIENT_KINDS)]
+        density = round(rng.uniform(0.3, 1.8), 3) if has_density else None
+        name = f"{rng.choice(QUALIFIERS)} {rng.choice(WORDS)} {ingredient_id}"
+        yield ingredient_id, name, density, dimension
+
+def _purchases(rng, ingredients, per_ingredient, start_date, days):
+    unit_cycle = 0
+    for ingredient_id, _name, _density, dimension in ingredients:
+        units = UNITS_BY_DIMENSION[dimension]
+        for _ in range(per_ingredient):
+            # Cycle through the units so every one of them appears in the data
+            unit = units[unit_cycle % len(units)]
+            unit_cycle += 1
+            low, high = PACKAGE_AMOUNTS[unit]
+            amount = round(rng.uniform(low, high), 2) if low != high else low
+            purchased = start_date + timedelta(days=rng.randrange(days))
+            expiry = (purchased + timedelta(days=rng.randrange(7, 720))).isoformat() if rng.random() < 0.6 else None
+            yield (ingredient_id, rng.choice(BRANDS), rng.choice(STORES), amount, unit,
+                   round(rng.uniform(0.5, 60), 2), purchased.isoformat(), expiry)
+
+def _recipe_lines(rng, recipe_count, ingredients, per_recipe):
+    for recipe_id in range(1, recipe_count + 1):
+        chosen = rng.sample(ingredients, min(per_recipe, len(ingredients)))
+        for sort_order, (ingredient_id, _name, _density, dimension) in enumerate(chosen, start=1):
+            unit_dimension = dimension
+            # Occasionally ask for a weight by volume or a volume by weight; without a
+            # density these lines cannot be costed, which the app must handle.
+            if dimension != 'quantity' and rng.random() < 0.3:
+                unit_dimension = 'volume' if dimension == 'weight' else 'weight'
+            unit = rng.choice(UNITS_BY_DIMENSION[unit_dimension])
+            base_unit, low, high = RECIPE_AMOUNTS[unit_dimension]
+            amount = round(rng.uniform(low, high), 2)
+            if unit != base_unit and unit_dimension != 'quantity':
+                amount = round(amount / 100, 3) or 0.1
+            yield recipe_id, ingredient_id, amount, unit, sort_order
+
+def _insert_chunks(db, sql, rows, chunk_size):
+    count = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            db.executemany(sql, chunk)
+            count += len(chunk)
+            chunk.clear()
+    if chunk:
+        db.executemany(sql, chunk)
+        count += len(chunk)
+    return count
+
+def generate(path, ingredients=2000, purchases_per_ingredient=500, recipes=5000,
+             ingredients_per_recipe=12, seed=42, chunk_size=50000):
+    """
+    Creates a new database at `path` filled with synthetic data. Rows are loaded
+    with only the base tables in place; the remaining migrations then build the
+    indexes, projections and search index once. Returns a dict of row counts.
+    """
+    if os.path.exists(path):
+        raise FileExistsError(f"'{path}' already exists.")
+    rng = random.Random(seed)
+    db = sqlite3.connect(path)
+    try:
+        db.execute('PRAGMA journal_mode = OFF')
+        db.execute('PRAGMA synchronous = OFF')
+        migrate(db, target_version=BASE_TABLES_VERSION)
+
+        ingredient_rows = list(_ingredients(rng, ingredients))
+        db.execute('BEGIN')
+        db.executemany('INSERT INTO ingredients (id, name, density_g_ml) VALUES (?, ?, ?)',
+                       [row[:3] for row in ingredient_rows])
+        db.executemany('INSERT INTO recipes (id, name, preparation_instructions, bake_instructions, yield) '
+                       'VALUES (?, ?, ?, ?, ?)',
+                       [(recipe_id,
+                         f"{rng.choice(QUALIFIERS).title()} {rng.choice(WORDS)} bake {recipe_id}",
+                         'Mix the dry ingredients, then fold in the wet ones.',
+                         f"Bake at {rng.choice([160, 175, 180, 200, 220])} C for {rng.randrange(10, 90)} minutes.",
+                         f"{rng.randrange(1, 48)} servings")
+                        for recipe_id in range(1, recipes + 1)])
+        lines = _insert_chunks(db, '''
+            INSERT INTO recipe_ingredients (recipe_id, ingredient_id, amount_needed, unit_needed, sort_order)
+            VALUES (?, ?, ?, ?, ?)
+        ''', _recipe_lines(rng, recipes, ingredient_rows, ingredients_per_recipe), chunk_size)
+        purchases = _insert_chunks(db, '''
+            INSERT INTO ingredient_purchases (ingredient_id, brand, store, package_amount, package_unit, price, purchase_date, expiry_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', _purchases(rng, ingredient_rows, purchases_per_ingredient, date(2020, 1, 1), 5 * 365), chunk_size)
+        db.execute('COMMIT')
+
+        db.execute('PRAGMA synchronous = NORMAL')
+        db.execute('PRAGMA journal_mode = DELETE')
+        migrate(db)
+    except BaseException:
+        db.close()
+        os.remove(path)
+        raise
+    db.close()
+    return {'ingredients': ingredients, 'recipes': recipes,
+            'recipe_ingredients': lines, 'purchases': purchases}
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic recipes database.')
+    parser.add_argument('path')
+    parser.add_argument('--ingredients', type=int, default=2000)
+    parser.add_argument('--purchases-per-ingredient', type=int, default=500)
+    parser.add_argument('--recipes', type=int, default=5000)
+    parser.add_argument('--ingredients-per-recipe', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = generate(args.path, args.ingredients, args.purchases_per_ingredient, args.recipes,
+                      args.ingredients_per_recipe, args.seed)
+    print(f"Wrote {args.path} in {time.perf_counter() - start:.1f}s: "
+          + ', '.join(f"{count} {name}" for name, count in counts.items()))
+
+if __name__ == '__main__':
+    main()
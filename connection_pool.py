@@ -0,0 +1,138 @@
+# connection_pool.py
+#
+# A small per-process pool of SQLite connections. Connections are opened once,
+# tuned with PRAGMAs (WAL, busy_timeout, ...) and reused across requests instead
+# of being reconnected for every request.
+
+import queue
+import sqlite3
+import threading
+import time
+
+# Applied to every connection, in this order. journal_mode is persistent in the
+# database file and only set through read-write connections.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,          # ms to wait on a locked database before failing
+    'synchronous': 'NORMAL',       # safe with WAL; fsync at checkpoints only
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,          # negative = KiB, so ~20 MB of page cache
+}
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Raised when no pooled connection becomes free within the pool timeout."""
+
+class ConnectionPool:
+    """
+    A bounded LIFO pool of sqlite3 connections for one database file.
+
+    Connections are created lazily up to `size`; when all are checked out,
+    `acquire` waits up to `timeout` seconds for one to be released. A read-only
+    pool opens the file with mode=ro and query_only, so writes fail loudly.
+    Checkout wait times are recorded for `stats`. `factory` is the sqlite3.Connection
+    subclass to open connections with (see instrumentation.InstrumentedConnection).
+    """
+
+    def __init__(self, database, size=5, timeout=10.0, pragmas=None, read_only=False,
+                 factory=sqlite3.Connection):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.read_only = read_only
+        self.factory = factory
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        # Metrics
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _connect(self):
+        if self.read_only:
+            conn = sqlite3.connect(f'file:{self.database}?mode=ro', uri=True,
+                                   check_same_thread=False, factory=self.factory)
+        else:
+            conn = sqlite3.connect(self.database, check_same_thread=False,
+                                   factory=self.factory)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            if name == 'journal_mode' and self.read_only:
+                continue
+            conn.execute(f'PRAGMA {name} = {value}')
+        if self.read_only:
+            conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    def acquire(self):
+        """Checks out a connection, creating one if the pool has not reached its size."""
+        start = time.perf_counter()
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self.timeouts += 1
+                    raise PoolTimeoutError(
+                        f'No database connection became free within {self.timeout}s.')
+
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return conn
+
+    def release(self, conn):
+        """Returns a connection to the pool, discarding any uncommitted work."""
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    def close_all(self):
+        """Closes every idle connection; connections still checked out close on release."""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'read_only': self.read_only,
+                'size': self.size,
+                'open_connections': self._created,
+                'idle_connections': self._idle.qsize(),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': (self.total_wait / self.checkouts * 1000) if self.checkouts else 0.0,
+                'max_wait_ms': self.max_wait * 1000,
+            }
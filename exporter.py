@@ -0,0 +1,226 @@
+# exporter.py
+#
+# Getting data out of (and back into) recipes.db without stopping the app:
+# streaming NDJSON/CSV exports, online snapshots through the sqlite3 backup API,
+# and a restore that bulk-loads an export into a fresh database.
+
+import csv
+import io
+import json
+import os
+import sqlite3
+
+from migrations import migrate
+
+# Export name -> (table, columns), in an order that satisfies foreign keys on restore
+EXPORT_TABLES = {
+    'ingredients': ('ingredients', ['id', 'name', 'density_g_ml']),
+    'recipes': ('recipes', ['id', 'name', 'preparation_instructions', 'bake_instructions', 'yield',
+                            'yield_amount', 'yield_unit']),
+    'recipe_ingredients': ('recipe_ingredients',
+                           ['recipe_id', 'ingredient_id', 'amount_needed', 'unit_needed', 'sort_order']),
+    'recipe_components': ('recipe_components',
+                          ['recipe_id', 'component_recipe_id', 'amount_needed', 'unit_needed', 'sort_order']),
+    'purchases': ('ingredient_purchases',
+                  ['id', 'ingredient_id', 'brand', 'store', 'package_amount', 'package_unit',
+                   'price', 'purchase_date', 'expiry_date']),
+    'pantry_lots': ('pantry_lots', ['id', 'purchase_id', 'ingredient_id', 'base_unit', 'quantity', 'remaining',
+                                    'unit_cost', 'received_date', 'expiry_date']),
+    'production_runs': ('production_runs', ['id', 'recipe_id', 'batches', 'run_date', 'total_cost', 'created_at']),
+    'pantry_movements': ('pantry_movements', ['id', 'lot_id', 'run_id', 'kind', 'quantity', 'cost', 'created_at']),
+}
+
+# The last migration that only creates base tables. Restores load data at this
+# version, then run the rest, so indexes, projections and search are built once
+# over the loaded data instead of being maintained row by row by triggers.
+BASE_TABLES_VERSION = 2
+
+# Exports whose table or columns are added by a later migration: export name ->
+# (that migration's version, the columns it adds, or None for the whole table).
+# Restore stages their rows in temp tables and copies them in once the schema has them.
+LATER_EXPORTS = {
+    'recipes': (11, ['yield_amount', 'yield_unit']),
+    'recipe_components': (11, None),
+    'pantry_lots': (13, None),
+    'production_runs': (13, None),
+    'pantry_movements': (13, None),
+}
+
+def _select(db, export_name):
+    table, columns = EXPORT_TABLES[export_name]
+    cursor = db.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid")
+    return columns, cursor
+
+def in_read_transaction(db, rows):
+    """
+    Runs a generator inside one read transaction so every table is read from the
+    same snapshot, even while the app keeps writing (WAL readers never block).
+    """
+    db.execute('BEGIN')
+    try:
+        yield from rows
+    finally:
+        if db.in_transaction:
+            db.rollback()
+
+# --- Streaming Exports ---
+
+def iter_ndjson(db, export_name):
+    """Yields one JSON line per row of a single table."""
+    columns, cursor = _select(db, export_name)
+    for row in cursor:
+        yield json.dumps(dict(zip(columns, row))) + '\n'
+
+def iter_csv(db, export_name):
+    """Yields a CSV header line followed by one line per row of a single table."""
+    columns, cursor = _select(db, export_name)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in cursor:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def iter_full_export(db):
+    """Yields every exported table as NDJSON lines of {"table": ..., "row": {...}}."""
+    for export_name in EXPORT_TABLES:
+        columns, cursor = _select(db, export_name)
+        for row in cursor:
+            yield json.dumps({'table': export_name, 'row': dict(zip(columns, row))}) + '\n'
+
+def stream_export(db, export_name, file_format):
+    """
+    Returns a generator of text chunks for an export. `export_name` is a key of
+    EXPORT_TABLES, or 'all' for the full NDJSON export used by `restore`.
+    """
+    if export_name == 'all':
+        if file_format != 'ndjson':
+            raise ValueError('The full export is only available as NDJSON.')
+        rows = iter_full_export(db)
+    elif export_name not in EXPORT_TABLES:
+        raise ValueError(f"Unknown export '{export_name}'.")
+    elif file_format == 'ndjson':
+        rows = iter_ndjson(db, export_name)
+    elif file_format == 'csv':
+        rows = iter_csv(db, export_name)
+    else:
+        raise ValueError(f"Unknown export format '{file_format}'.")
+    return in_read_transaction(db, rows)
+
+# --- Snapshots ---
+
+def snapshot(db, dest_path, pages_per_step=256, sleep=0.005, progress=None):
+    """
+    Copies the live database to `dest_path` with the backup API, `pages_per_step`
+    pages at a time. Between steps the source is unlocked for `sleep` seconds, so
+    writers are never blocked for long; if they change the database mid-copy the
+    backup restarts, and the result is always a consistent copy.
+    """
+    if os.path.exists(dest_path):
+        raise FileExistsError(f"'{dest_path}' already exists.")
+    target = sqlite3.connect(dest_path)
+    try:
+        db.backup(target, pages=pages_per_step, progress=progress, sleep=sleep)
+    finally:
+        target.close()
+
+# --- Restore ---
+
+def _staged_columns(export_name):
+    """Returns the columns of an export that restore stages until a later migration."""
+    columns = EXPORT_TABLES[export_name][1]
+    added = LATER_EXPORTS[export_name][1]
+    return columns if added is None else ['id'] + added
+
+def _load_staged(db, version):
+    """Copies staged rows of the exports added by migration `version` into their tables."""
+    for export_name, (added_in, added) in LATER_EXPORTS.items():
+        if added_in != version:
+            continue
+        table, columns = EXPORT_TABLES[export_name]
+        staged = f'temp.restore_{export_name}'
+        if added is None:
+            db.execute(f"INSERT INTO {table} ({', '.join(columns)}) "
+                       f"SELECT {', '.join(columns)} FROM {staged} ORDER BY rowid")
+        else:
+            assignments = ', '.join(f'{column} = s.{column}' for column in added)
+            db.execute(f'UPDATE {table} SET {assignments} FROM {staged} s WHERE s.id = {table}.id')
+        db.execute(f'DROP TABLE {staged}')
+
+def restore(stream, dest_path, chunk_size=5000):
+    """
+    Bulk-loads a full NDJSON export into a new database at `dest_path`.
+    Returns a dict of export name -> rows loaded. The file is removed if loading fails.
+    """
+    if os.path.exists(dest_path):
+        raise FileExistsError(f"'{dest_path}' already exists.")
+    db = sqlite3.connect(dest_path)
+    counts = {name: 0 for name in EXPORT_TABLES}
+    try:
+        # A half-loaded file is deleted anyway, so durability is not needed yet
+        db.execute('PRAGMA journal_mode = OFF')
+        db.execute('PRAGMA synchronous = OFF')
+        migrate(db, target_version=BASE_TABLES_VERSION)
+        for export_name in LATER_EXPORTS:
+            db.execute(f"CREATE TEMP TABLE restore_{export_name} ({', '.join(_staged_columns(export_name))})")
+
+        pending_table, pending = None, []
+
+        def insert(table, columns, rows):
+            placeholders = ', '.join('?' for _ in columns)
+            db.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+
+        def flush():
+            table, columns = EXPORT_TABLES[pending_table]
+            if pending_table in LATER_EXPORTS:
+                staged = _staged_columns(pending_table)
+                insert(f'temp.restore_{pending_table}', staged,
+                       ([row[columns.index(column)] for column in staged] for row in pending))
+                added = LATER_EXPORTS[pending_table][1]
+                if added is not None:
+                    base = [column for column in columns if column not in added]
+                    insert(table, base, ([row[columns.index(column)] for column in base] for row in pending))
+            else:
+                insert(table, columns, pending)
+            counts[pending_table] += len(pending)
+            pending.clear()
+
+        db.execute('BEGIN')
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                export_name, row = record['table'], record['row']
+                columns = EXPORT_TABLES[export_name][1]
+            except (ValueError, KeyError, TypeError):
+                raise ValueError(f'Line {line_number} is not a valid export record.')
+            if export_name != pending_table or len(pending) >= chunk_size:
+                if pending:
+                    flush()
+                pending_table = export_name
+            pending.append([row.get(column) for column in columns])
+        if pending:
+            flush()
+        db.execute('COMMIT')
+
+        # Indexes, projections, counts and the search index are built here; staged
+        # rows go in as soon as the migration adding their table or columns has run
+        db.execute('PRAGMA synchronous = NORMAL')
+        db.execute('PRAGMA journal_mode = DELETE')
+        for version in sorted({added_in for added_in, _ in LATER_EXPORTS.values()}):
+            migrate(db, target_version=version)
+            db.execute('BEGIN')
+            _load_staged(db, version)
+            db.execute('COMMIT')
+        migrate(db)
+    except BaseException:
+        db.close()
+        os.remove(dest_path)
+        raise
+    db.close()
+    return counts
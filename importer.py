@@ -0,0 +1,189 @@
+# importer.py
+#
+# Bulk import of ingredient purchases from CSV or JSON. Files are read row by row,
+# so memory use does not grow with the file, and rows are written in chunks of
+# `executemany` inserts, one transaction per chunk.
+
+import csv
+import json
+from datetime import date
+
+from units import canonical_unit, unit_price
+
+# Columns accepted in an import file; they match the add-purchase form fields.
+PURCHASE_FIELDS = ['name', 'brand', 'store', 'package_amount', 'package_unit',
+                   'price', 'purchase_date', 'expiry_date']
+REQUIRED_FIELDS = ['name', 'store', 'package_amount', 'package_unit', 'price', 'purchase_date']
+
+# Only the first errors are kept in full; the rest are just counted
+MAX_REPORTED_ERRORS = 1000
+
+class ImportResult:
+    """Counts and per-row validation errors from one import run."""
+
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []  # (row number, message)
+        self.ingredients_created = 0
+        self.ingredient_ids = set()
+
+    def add_error(self, row_number, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_number, message))
+
+# --- Readers ---
+
+def iter_csv_rows(stream):
+    """Yields one dict per CSV data row; the first line must be a header."""
+    yield from csv.DictReader(stream)
+
+class InvalidRow:
+    """Placeholder yielded for a row that could not even be parsed."""
+
+    def __init__(self, message):
+        self.message = message
+
+def iter_json_rows(stream, chunk_size=64 * 1024):
+    """
+    Yields objects from either a JSON array of objects or newline-delimited JSON
+    (one object per line), decoding incrementally so the whole document is never
+    held in memory. A malformed NDJSON line yields an InvalidRow; a malformed
+    array is fatal.
+    """
+    buffer = stream.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        # Newline-delimited JSON: finish the first (possibly partial) line, then go line by line
+        for line in _iter_lines(buffer, stream):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield InvalidRow(f'Invalid JSON: {e.msg}.')
+        return
+
+    decoder = json.JSONDecoder()
+    buffer = buffer[1:]
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(','):
+            buffer = buffer[1:]
+            continue
+        if buffer.startswith(']'):
+            return
+        if buffer:
+            try:
+                obj, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                buffer = buffer[end:]
+                yield obj
+                continue
+        elif eof:
+            raise ValueError('JSON array is not terminated.')
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+
+def _iter_lines(head, stream):
+    """Yields complete lines from an already-read head followed by the rest of the stream."""
+    lines = head.splitlines(keepends=True)
+    if lines and not lines[-1].endswith(('\n', '\r')):
+        lines[-1] += stream.readline()
+    yield from lines
+    yield from stream
+
+READERS = {'csv': iter_csv_rows, 'json': iter_json_rows}
+
+# --- Validation ---
+
+def _parse_date(value, field):
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"{field} must be a date in YYYY-MM-DD format, got '{value}'.")
+
+def _parse_number(value, field, allow_zero):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number, got '{value}'.")
+    if number < 0 or (number == 0 and not allow_zero) or number != number:
+        raise ValueError(f"{field} must be {'zero or more' if allow_zero else 'greater than zero'}.")
+    return number
+
+def validate_purchase_row(row):
+    """
+    Normalizes one import row. Returns a dict of clean values, or raises
+    ValueError with a message describing the first problem found.
+    """
+    if isinstance(row, InvalidRow):
+        raise ValueError(row.message)
+    if not isinstance(row, dict):
+        raise ValueError('Row must be an object with named fields.')
+    values = {field: ('' if row.get(field) is None else str(row.get(field)).strip())
+              for field in PURCHASE_FIELDS}
+    missing = [field for field in REQUIRED_FIELDS if not values[field]]
+    if missing:
+        raise ValueError(f"Missing required field(s): {', '.join(missing)}.")
+
+    unit = canonical_unit(values['package_unit'])
+    if unit is None:
+        raise ValueError(f"Unknown package_unit '{values['package_unit']}'.")
+    values['package_unit'] = unit
+    values['package_amount'] = _parse_number(values['package_amount'], 'package_amount', allow_zero=False)
+    values['price'] = _parse_number(values['price'], 'price', allow_zero=True)
+    values['purchase_date'] = _parse_date(values['purchase_date'], 'purchase_date')
+    if values['expiry_date']:
+        values['expiry_date'] = _parse_date(values['expiry_date'], 'expiry_date')
+    return values
+
+# --- Import ---
+
+def import_purchases(db, rows, chunk_size=5000):
+    """
+    Validates and inserts purchase rows. Ingredient names are resolved against an
+    in-memory name -> id map loaded once; unknown names create new ingredients.
+    Each chunk of valid rows is written with executemany in a single transaction,
+    so a failure loses at most the current chunk. Returns an ImportResult.
+    """
+    result = ImportResult()
+    ingredient_ids = {row[1]: row[0] for row in db.execute('SELECT id, name FROM ingredients')}
+    pending = []
+
+    def flush():
+        with db:
+            for values in pending:
+                if values['name'] not in ingredient_ids:
+                    cursor = db.execute('INSERT INTO ingredients (name) VALUES (?)', (values['name'],))
+                    ingredient_ids[values['name']] = cursor.lastrowid
+                    result.ingredients_created += 1
+            db.executemany('''
+                INSERT INTO ingredient_purchases (ingredient_id, brand, store, package_amount, package_unit, price, purchase_date, expiry_date,
+                                                  unit_price, base_unit)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(ingredient_ids[v['name']], v['brand'], v['store'], v['package_amount'],
+                   v['package_unit'], v['price'], v['purchase_date'], v['expiry_date'],
+                   *unit_price(v['price'], v['package_amount'], v['package_unit']))
+                  for v in pending])
+        result.imported += len(pending)
+        result.ingredient_ids.update(ingredient_ids[v['name']] for v in pending)
+        pending.clear()
+
+    # Row numbers count data rows from 1 (a CSV header line is not counted)
+    for row_number, row in enumerate(rows, start=1):
+        try:
+            pending.append(validate_purchase_row(row))
+        except ValueError as e:
+            result.add_error(row_number, str(e))
+            continue
+        if len(pending) >= chunk_size:
+            flush()
+    if pending:
+        flush()
+    return result
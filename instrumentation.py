@@ -0,0 +1,230 @@
+# instrumentation.py
+#
+# Optional per-request performance instrumentation: SQL statement counts and
+# timings, a slow-query log with EXPLAIN plans, N+1 detection and per-route
+# latency histograms, rendered in the Prometheus text format.
+#
+# Statements are only timed on connections created with InstrumentedConnection
+# as their factory, so when instrumentation is off the database path is untouched.
+
+import contextlib
+import contextvars
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger('recipe_manager.sql')
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Statistics for the request being handled on this thread, or None outside a request
+_current = contextvars.ContextVar('request_stats', default=None)
+
+class RequestStats:
+    """SQL activity recorded during one request."""
+
+    def __init__(self, slow_query_threshold):
+        self.slow_query_threshold = slow_query_threshold
+        self.query_count = 0
+        self.query_time = 0.0
+        self.slow_queries = 0
+        self.statements = Counter()
+
+def start_request(slow_query_threshold):
+    """Begins collecting statistics for the current request (threshold in seconds)."""
+    _current.set(RequestStats(slow_query_threshold))
+
+def current_stats():
+    """Returns the RequestStats being collected, or None outside an instrumented request."""
+    return _current.get()
+
+def end_request():
+    """Stops collecting and returns the RequestStats gathered since start_request."""
+    stats = _current.get()
+    _current.set(None)
+    return stats
+
+@contextlib.contextmanager
+def suspended():
+    """Stops counting statements inside the block, e.g. connection setup and migrations."""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+# --- Instrumented Connections ---
+
+class _Execution:
+    """One statement execution; time spent fetching its rows is added as it happens."""
+
+    __slots__ = ('sql', 'params', 'elapsed', 'logged')
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+        self.elapsed = 0.0
+        self.logged = False
+
+def _record_time(connection, execution, elapsed):
+    stats = _current.get()
+    if stats is None:
+        return
+    execution.elapsed += elapsed
+    stats.query_time += elapsed
+    if not execution.logged and execution.elapsed > stats.slow_query_threshold:
+        execution.logged = True
+        stats.slow_queries += 1
+        _log_slow_query(connection, execution)
+
+def _log_slow_query(connection, execution):
+    plan = ''
+    # executemany has no single parameter set to explain with
+    if execution.params is not None and \
+            execution.sql.lstrip()[:6].upper() in ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT'):
+        try:
+            rows = sqlite3.Connection.execute(connection, 'EXPLAIN QUERY PLAN ' + execution.sql,
+                                              execution.params).fetchall()
+            plan = '; '.join(row[3] for row in rows)
+        except Exception as e:  # The plan is a diagnostic aid; never fail the request over it
+            plan = f'unavailable ({e})'
+    logger.warning('Slow query (%.1f ms): %s | params=%r | plan: %s',
+                   execution.elapsed * 1000, ' '.join(execution.sql.split()), execution.params, plan)
+
+def _start_execution(sql, params):
+    stats = _current.get()
+    if stats is not None:
+        stats.query_count += 1
+        stats.statements[sql] += 1
+    return _Execution(sql, params)
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """A cursor that attributes execute and fetch time to the statement it ran."""
+
+    _execution = None
+
+    def execute(self, sql, parameters=()):
+        self._execution = _start_execution(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_time(self.connection, self._execution, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._execution = _start_execution(sql, None)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_time(self.connection, self._execution, time.perf_counter() - start)
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._execution is not None:
+                _record_time(self.connection, self._execution, time.perf_counter() - start)
+
+    def fetchone(self):
+        return self._timed(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(super().fetchall)
+
+    def __next__(self):
+        return self._timed(super().__next__)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """A sqlite3 connection whose statements are counted and timed per request."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# --- Metrics Registry ---
+
+class _Histogram:
+    __slots__ = ('buckets', 'count', 'sum')
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+class Metrics:
+    """Per-route request metrics accumulated since the process started."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}           # (route, method) -> _Histogram
+        self._queries = Counter()    # (route, method) -> statements executed
+        self._query_time = Counter() # (route, method) -> seconds spent in SQL
+        self._slow = Counter()       # (route, method) -> slow statements
+        self._n_plus_one = Counter() # (route, method) -> requests flagged as N+1
+
+    def observe_request(self, route, method, duration, stats, n_plus_one_threshold):
+        """Records one finished request; returns the statements that looked like N+1 queries."""
+        repeated = {sql: count for sql, count in stats.statements.items()
+                    if count > n_plus_one_threshold}
+        key = (route, method)
+        with self._lock:
+            self._latency.setdefault(key, _Histogram()).observe(duration)
+            self._queries[key] += stats.query_count
+            self._query_time[key] += stats.query_time
+            self._slow[key] += stats.slow_queries
+            if repeated:
+                self._n_plus_one[key] += 1
+        return repeated
+
+    def render_prometheus(self, extra_lines=()):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            header('recipe_manager_request_duration_seconds', 'histogram', 'Request latency by route.')
+            for (route, method), hist in sorted(self._latency.items()):
+                labels = f'route="{_escape(route)}",method="{method}"'
+                for bound, count in zip(LATENCY_BUCKETS, hist.buckets):
+                    lines.append(f'recipe_manager_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'recipe_manager_request_duration_seconds_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f'recipe_manager_request_duration_seconds_sum{{{labels}}} {hist.sum}')
+                lines.append(f'recipe_manager_request_duration_seconds_count{{{labels}}} {hist.count}')
+            for name, kind, help_text, counter in (
+                ('recipe_manager_sql_queries_total', 'counter', 'SQL statements executed, by route.', self._queries),
+                ('recipe_manager_sql_seconds_total', 'counter', 'Time spent executing SQL, by route.', self._query_time),
+                ('recipe_manager_slow_queries_total', 'counter', 'Statements over the slow-query threshold.', self._slow),
+                ('recipe_manager_n_plus_one_requests_total', 'counter', 'Requests that repeated a statement too often.', self._n_plus_one),
+            ):
+                header(name, kind, help_text)
+                for (route, method), value in sorted(counter.items()):
+                    lines.append(f'{name}{{route="{_escape(route)}",method="{method}"}} {value}')
+
+        lines.extend(extra_lines)
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
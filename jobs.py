@@ -0,0 +1,199 @@
+# jobs.py
+#
+# Background jobs. A job is a row in the jobs table, so queued work survives a
+# restart and can be run by any process sharing the database; JobWorkers runs
+# jobs on a bounded number of threads. Jobs are identified by a kind and a key
+# (e.g. 'recost_ingredient', '42'), and at most one copy of a job waits in the
+# queue, so a burst of writes touching the same ingredient collapses into one run.
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger('recipe_manager.jobs')
+
+def enqueue(db, kind, keys):
+    """
+    Queues one `kind` job per key, skipping jobs that are already queued. Runs in
+    the caller's transaction and does not commit, so the jobs are queued exactly
+    when the write that needs them commits. Returns the number of new jobs.
+    """
+    now = time.time()
+    cursor = db.executemany('''
+        INSERT OR IGNORE INTO jobs (kind, key, state, enqueued_at) VALUES (?, ?, 'queued', ?)
+    ''', [(kind, str(key), now) for key in keys])
+    return max(cursor.rowcount, 0)
+
+def claim(db, lease_seconds):
+    """
+    Marks the oldest queued job running and returns it (id, kind, key), or None
+    if the queue is empty. Jobs left running for longer than `lease_seconds`,
+    whose worker has died, are put back in the queue first.
+    """
+    now = time.time()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # A requeued job replaces an identical one queued after it
+        db.execute('''
+            UPDATE OR REPLACE jobs SET state = 'queued', started_at = NULL
+            WHERE state = 'running' AND started_at < ?
+        ''', (now - lease_seconds,))
+        jobs = db.execute('''
+            UPDATE jobs SET state = 'running', started_at = ?, attempts = attempts + 1
+            WHERE id = (SELECT id FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1)
+            RETURNING id, kind, key
+        ''', (now,)).fetchall()
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    return jobs[0] if jobs else None
+
+def finish(db, job_id, error=None):
+    """Records a claimed job as done, or as failed with an error message."""
+    db.execute('UPDATE jobs SET state = ?, finished_at = ?, error = ? WHERE id = ?',
+               ('failed' if error else 'done', time.time(), error, job_id))
+    db.commit()
+
+def prune(db, retention_seconds):
+    """Deletes finished jobs older than `retention_seconds`. Returns the number deleted."""
+    cursor = db.execute("DELETE FROM jobs WHERE state IN ('done', 'failed') AND finished_at < ?",
+                        (time.time() - retention_seconds,))
+    db.commit()
+    return cursor.rowcount
+
+def queue_status(db, sample_size=100):
+    """
+    Returns the number of jobs in each state, the age of the oldest queued job,
+    and wait (queued to started) and run times over the last `sample_size` jobs
+    that finished successfully, in seconds.
+    """
+    counts = {state: 0 for state in ('queued', 'running', 'done', 'failed')}
+    counts.update(db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+    oldest = db.execute("SELECT MIN(enqueued_at) FROM jobs WHERE state = 'queued'").fetchone()[0]
+    recent = db.execute('''
+        SELECT started_at - enqueued_at, finished_at - started_at FROM jobs
+        WHERE state = 'done' ORDER BY id DESC LIMIT ?
+    ''', (sample_size,)).fetchall()
+    return {
+        'counts': counts,
+        'oldest_queued_seconds': time.time() - oldest if oldest is not None else None,
+        'latency': {
+            'sample_size': len(recent),
+            'wait': _summarize([row[0] for row in recent]),
+            'run': _summarize([row[1] for row in recent]),
+            'total': _summarize([row[0] + row[1] for row in recent]),
+        },
+    }
+
+def _summarize(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'avg': sum(values) / len(values),
+        'p50': values[(len(values) - 1) // 2],
+        'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+        'max': values[-1],
+    }
+
+class JobWorkers:
+    """
+    A bounded pool of daemon threads running jobs from the jobs table.
+
+    `handlers` maps job kinds to callables taking (db, key). `connection` is a
+    context manager factory yielding a database connection, entered once per job.
+    Idle workers poll the table every `poll_interval` seconds to pick up jobs
+    queued by other processes; notify() wakes them at once for local ones.
+    """
+
+    def __init__(self, handlers, connection, size=2, poll_interval=1.0, lease_seconds=300.0,
+                 retention_seconds=86400.0):
+        self.handlers = handlers
+        self.connection = connection
+        self.size = size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self.completed = 0
+        self.failed = 0
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def start(self):
+        """Starts the worker threads; does nothing if they are already running."""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for number in range(1, self.size + 1):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stops the worker threads once their current jobs finish."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in threads:
+            thread.join(timeout)
+
+    def notify(self):
+        """Wakes idle workers after this process has queued jobs."""
+        self._wakeup.set()
+
+    def run_pending(self):
+        """Runs queued jobs on the calling thread until none are left. Returns the number run."""
+        ran = 0
+        while self._run_one():
+            ran += 1
+        return ran
+
+    def stats(self):
+        with self._lock:
+            alive = sum(thread.is_alive() for thread in self._threads)
+            return {'size': self.size, 'alive': alive,
+                    'completed': self.completed, 'failed': self.failed}
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                ran = self._run_one()
+            except Exception:
+                logger.exception('Job worker could not reach the job table')
+                ran = False
+            if not ran:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _run_one(self):
+        """Claims and runs one job. Returns False if the queue was empty."""
+        with self.connection() as db:
+            job = claim(db, self.lease_seconds)
+            if job is None:
+                if time.time() - self._last_prune > self.retention_seconds / 24:
+                    self._last_prune = time.time()
+                    prune(db, self.retention_seconds)
+                return False
+            handler = self.handlers.get(job['kind'])
+            try:
+                if handler is None:
+                    raise LookupError(f"No handler for job kind '{job['kind']}'.")
+                handler(db, job['key'])
+            except Exception as e:
+                if db.in_transaction:
+                    db.rollback()
+                logger.exception('Job %s (%s %s) failed', job['id'], job['kind'], job['key'])
+                finish(db, job['id'], f'{type(e).__name__}: {e}')
+                with self._lock:
+                    self.failed += 1
+            else:
+                finish(db, job['id'])
+                with self._lock:
+                    self.completed += 1
+            return True
@@ -0,0 +1,713 @@
+# migrations.py
+#
+# Versioned schema migrations for recipes.db. The schema version is stored in the
+# database itself (PRAGMA user_version); `migrate` applies every pending migration
+# in order, each in its own transaction, so existing databases upgrade in place.
+
+import sqlite3
+
+from units import unit_price
+
+# --- Baseline Schema ---
+
+# The schema as the application actually uses it. Databases created by the
+# original setup script may differ (see _repair_schema_drift).
+BASELINE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS ingredients (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL,
+    density_g_ml REAL
+);
+
+CREATE TABLE IF NOT EXISTS ingredient_purchases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ingredient_id INTEGER NOT NULL,
+    store TEXT,
+    package_amount REAL NOT NULL,
+    package_unit TEXT NOT NULL,
+    price REAL NOT NULL,
+    purchase_date TEXT NOT NULL,
+    expiry_date TEXT,
+    brand TEXT,
+    FOREIGN KEY (ingredient_id) REFERENCES ingredients (id)
+);
+
+CREATE TABLE IF NOT EXISTS recipes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL,
+    preparation_instructions TEXT,
+    bake_instructions TEXT,
+    yield TEXT
+);
+
+CREATE TABLE IF NOT EXISTS recipe_ingredients (
+    recipe_id INTEGER NOT NULL,
+    ingredient_id INTEGER NOT NULL,
+    amount_needed REAL NOT NULL,
+    unit_needed TEXT NOT NULL,
+    sort_order INTEGER,
+    PRIMARY KEY (recipe_id, ingredient_id),
+    FOREIGN KEY (recipe_id) REFERENCES recipes (id),
+    FOREIGN KEY (ingredient_id) REFERENCES ingredients (id)
+);
+'''
+
+def _columns(db, table):
+    return {row[1] for row in db.execute(f'PRAGMA table_info({table})')}
+
+def _repair_schema_drift(db):
+    """Brings databases made by the original setup script in line with the live schema."""
+    ingredient_columns = _columns(db, 'ingredients')
+    if 'desnity_g_ml' in ingredient_columns and 'density_g_ml' not in ingredient_columns:
+        db.execute('ALTER TABLE ingredients RENAME COLUMN desnity_g_ml TO density_g_ml')
+    if 'brand' not in _columns(db, 'ingredient_purchases'):
+        db.execute('ALTER TABLE ingredient_purchases ADD COLUMN brand TEXT')
+
+# --- Latest Purchase Projection ---
+
+# `latest_purchase` holds exactly one row per purchased ingredient: its most recent
+# purchase (newest purchase_date, ties broken by the highest purchase id).
+# Triggers on ingredient_purchases keep it current, so readers get a price with a
+# primary-key lookup instead of sorting the purchase history.
+LATEST_PURCHASE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS latest_purchase (
+    ingredient_id INTEGER PRIMARY KEY,
+    purchase_id INTEGER NOT NULL,
+    brand TEXT,
+    store TEXT,
+    package_amount REAL NOT NULL,
+    package_unit TEXT NOT NULL,
+    price REAL NOT NULL,
+    purchase_date TEXT NOT NULL,
+    FOREIGN KEY (ingredient_id) REFERENCES ingredients (id)
+);
+
+-- A new purchase only replaces the projection row if it is at least as recent.
+CREATE TRIGGER IF NOT EXISTS latest_purchase_after_insert
+AFTER INSERT ON ingredient_purchases
+BEGIN
+    INSERT INTO latest_purchase (ingredient_id, purchase_id, brand, store, package_amount,
+                                 package_unit, price, purchase_date)
+    VALUES (NEW.ingredient_id, NEW.id, NEW.brand, NEW.store, NEW.package_amount,
+            NEW.package_unit, NEW.price, NEW.purchase_date)
+    ON CONFLICT (ingredient_id) DO UPDATE SET
+        purchase_id = excluded.purchase_id, brand = excluded.brand, store = excluded.store,
+        package_amount = excluded.package_amount, package_unit = excluded.package_unit,
+        price = excluded.price, purchase_date = excluded.purchase_date
+    WHERE excluded.purchase_date > latest_purchase.purchase_date
+       OR (excluded.purchase_date = latest_purchase.purchase_date
+           AND excluded.purchase_id > latest_purchase.purchase_id);
+END;
+
+-- Edits can move a purchase between ingredients or change its date, so both the
+-- old and the new ingredient are re-derived from their history.
+CREATE TRIGGER IF NOT EXISTS latest_purchase_after_update
+AFTER UPDATE ON ingredient_purchases
+BEGIN
+    DELETE FROM latest_purchase WHERE ingredient_id IN (OLD.ingredient_id, NEW.ingredient_id);
+    INSERT INTO latest_purchase (ingredient_id, purchase_id, brand, store, package_amount,
+                                 package_unit, price, purchase_date)
+    SELECT ingredient_id, id, brand, store, package_amount, package_unit, price, purchase_date
+    FROM (
+        SELECT *, ROW_NUMBER() OVER (
+            PARTITION BY ingredient_id ORDER BY purchase_date DESC, id DESC
+        ) AS rn
+        FROM ingredient_purchases
+        WHERE ingredient_id IN (OLD.ingredient_id, NEW.ingredient_id)
+    )
+    WHERE rn = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS latest_purchase_after_delete
+AFTER DELETE ON ingredient_purchases
+BEGIN
+    DELETE FROM latest_purchase WHERE ingredient_id = OLD.ingredient_id;
+    INSERT INTO latest_purchase (ingredient_id, purchase_id, brand, store, package_amount,
+                                 package_unit, price, purchase_date)
+    SELECT ingredient_id, id, brand, store, package_amount, package_unit, price, purchase_date
+    FROM ingredient_purchases
+    WHERE ingredient_id = OLD.ingredient_id
+    ORDER BY purchase_date DESC, id DESC
+    LIMIT 1;
+END;
+'''
+
+def rebuild_latest_purchases(db):
+    """
+    Re-derives the whole latest_purchase projection from ingredient_purchases.
+    Returns the number of projection rows that were missing, stale or orphaned.
+    Does not commit; the caller owns the transaction.
+    """
+    derived = '''
+        SELECT ingredient_id, id AS purchase_id, brand, store, package_amount,
+               package_unit, price, purchase_date
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY ingredient_id ORDER BY purchase_date DESC, id DESC
+            ) AS rn
+            FROM ingredient_purchases
+        )
+        WHERE rn = 1
+    '''
+    stored = '''
+        SELECT ingredient_id, purchase_id, brand, store, package_amount,
+               package_unit, price, purchase_date
+        FROM latest_purchase
+    '''
+    # Rows on either side of the symmetric difference are out of sync.
+    drift = db.execute(f'''
+        SELECT COUNT(DISTINCT ingredient_id) FROM (
+            SELECT * FROM ({derived}) EXCEPT SELECT * FROM ({stored})
+            UNION ALL
+            SELECT * FROM ({stored}) EXCEPT SELECT * FROM ({derived})
+        )
+    ''').fetchone()[0]
+
+    db.execute('DELETE FROM latest_purchase')
+    db.execute(f'''
+        INSERT INTO latest_purchase (ingredient_id, purchase_id, brand, store, package_amount,
+                                     package_unit, price, purchase_date)
+        {derived}
+    ''')
+    return drift
+
+def _create_latest_purchase(db):
+    run_script(db, LATEST_PURCHASE_SCHEMA)
+    rebuild_latest_purchases(db)
+
+# --- Table Change Versions ---
+
+# A monotonically increasing version per table, bumped by triggers on every write.
+# Used as a cheap validator (ETag) for responses derived from those tables.
+VERSIONED_TABLES = ('ingredients', 'ingredient_purchases')
+
+def _change_version_schema():
+    statements = ['''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+    ''']
+    for table in VERSIONED_TABLES:
+        statements.append(f"INSERT OR IGNORE INTO table_versions (table_name) VALUES ('{table}');")
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            statements.append(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_after_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+                END;
+            ''')
+    return '\n'.join(statements)
+
+CHANGE_VERSION_SCHEMA = _change_version_schema()
+
+# --- Indexes ---
+
+# Covering indexes for the hot queries in app.py (see HOT_QUERIES below).
+INDEXES_SCHEMA = '''
+-- Latest/as-of purchase per ingredient, and the projection triggers
+CREATE INDEX IF NOT EXISTS idx_purchases_ingredient_date
+    ON ingredient_purchases (ingredient_id, purchase_date, id);
+-- Purchase list sorted by date or store
+CREATE INDEX IF NOT EXISTS idx_purchases_date ON ingredient_purchases (purchase_date, id);
+CREATE INDEX IF NOT EXISTS idx_purchases_store ON ingredient_purchases (store, id);
+-- Recipe lines in display order, and the reverse ingredient -> recipes lookup
+CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_order
+    ON recipe_ingredients (recipe_id, sort_order);
+CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_ingredient
+    ON recipe_ingredients (ingredient_id, recipe_id);
+'''
+
+# --- Keyset Pagination Support ---
+
+# Indexes matching each purchase-list sort (with id as the tiebreak), plus a row
+# count maintained by triggers so the list never has to COUNT the table.
+PURCHASE_LIST_SCHEMA = '''
+-- Sort by ingredient name walks ingredients by name, then each one's purchases by id
+CREATE INDEX IF NOT EXISTS idx_purchases_ingredient ON ingredient_purchases (ingredient_id);
+-- Sort by store treats a missing store as ''; the expression must match app.py
+DROP INDEX IF EXISTS idx_purchases_store;
+CREATE INDEX IF NOT EXISTS idx_purchases_store_key ON ingredient_purchases (IFNULL(store, ''), id);
+
+CREATE TABLE IF NOT EXISTS row_counts (
+    table_name TEXT PRIMARY KEY,
+    row_count INTEGER NOT NULL
+);
+INSERT OR REPLACE INTO row_counts (table_name, row_count)
+SELECT 'ingredient_purchases', COUNT(*) FROM ingredient_purchases;
+
+CREATE TRIGGER IF NOT EXISTS ingredient_purchases_count_after_insert
+AFTER INSERT ON ingredient_purchases
+BEGIN
+    UPDATE row_counts SET row_count = row_count + 1 WHERE table_name = 'ingredient_purchases';
+END;
+
+CREATE TRIGGER IF NOT EXISTS ingredient_purchases_count_after_delete
+AFTER DELETE ON ingredient_purchases
+BEGIN
+    UPDATE row_counts SET row_count = row_count - 1 WHERE table_name = 'ingredient_purchases';
+END;
+'''
+
+# --- Full-Text Search ---
+
+# One FTS5 document per recipe (rowid = recipes.id) holding its name, both
+# instruction fields and the names of its ingredients. Triggers re-derive a
+# recipe's document whenever the recipe, its ingredient lines or an ingredient's
+# name change.
+_REFRESH_RECIPE_SEARCH = '''
+    DELETE FROM recipe_search WHERE rowid IN ({ids});
+    INSERT INTO recipe_search (rowid, name, preparation_instructions, bake_instructions, ingredient_names)
+    SELECT r.id, r.name, r.preparation_instructions, r.bake_instructions,
+           (SELECT group_concat(i.name, ' ')
+            FROM recipe_ingredients ri JOIN ingredients i ON ri.ingredient_id = i.id
+            WHERE ri.recipe_id = r.id)
+    FROM recipes r
+    WHERE r.id IN ({ids});
+'''
+
+def _search_trigger(name, event, table, ids):
+    return f'''
+CREATE TRIGGER IF NOT EXISTS {name}
+AFTER {event} ON {table}
+BEGIN
+    {_REFRESH_RECIPE_SEARCH.format(ids=ids).strip()}
+END;
+'''
+
+SEARCH_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS recipe_search USING fts5 (
+    name, preparation_instructions, bake_instructions, ingredient_names,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS recipe_search_after_recipe_delete
+AFTER DELETE ON recipes
+BEGIN
+    DELETE FROM recipe_search WHERE rowid = OLD.id;
+END;
+''' + _search_trigger('recipe_search_after_recipe_insert', 'INSERT', 'recipes', 'NEW.id') \
+  + _search_trigger('recipe_search_after_recipe_update', 'UPDATE', 'recipes', 'OLD.id, NEW.id') \
+  + _search_trigger('recipe_search_after_line_insert', 'INSERT', 'recipe_ingredients', 'NEW.recipe_id') \
+  + _search_trigger('recipe_search_after_line_update', 'UPDATE', 'recipe_ingredients',
+                    'OLD.recipe_id, NEW.recipe_id') \
+  + _search_trigger('recipe_search_after_line_delete', 'DELETE', 'recipe_ingredients', 'OLD.recipe_id') \
+  + _search_trigger('recipe_search_after_ingredient_rename', 'UPDATE OF name', 'ingredients',
+                    'SELECT recipe_id FROM recipe_ingredients WHERE ingredient_id = NEW.id') \
+  + _REFRESH_RECIPE_SEARCH.format(ids='SELECT id FROM recipes')
+
+# --- Recipe Versions ---
+
+# A version stamp per recipe, bumped whenever anything shown on its page changes:
+# the recipe itself, its ingredient lines, the names or densities of those
+# ingredients, or their latest purchases (and so their cost). Used as the ETag and
+# Last-Modified of the recipe page and as the key of its rendered-fragment cache.
+_BUMP_RECIPE_VERSION = '''
+    INSERT INTO recipe_versions (recipe_id, version, modified_at)
+    SELECT id, 1, strftime('%Y-%m-%d %H:%M:%S', 'now') FROM recipes WHERE id IN ({ids})
+    ON CONFLICT (recipe_id) DO UPDATE SET
+        version = version + 1, modified_at = excluded.modified_at;
+'''
+
+def _recipe_version_trigger(name, event, table, ids):
+    return f'''
+CREATE TRIGGER IF NOT EXISTS {name}
+AFTER {event} ON {table}
+BEGIN
+    {_BUMP_RECIPE_VERSION.format(ids=ids).strip()}
+END;
+'''
+
+_RECIPES_USING = 'SELECT recipe_id FROM recipe_ingredients WHERE ingredient_id IN ({})'
+
+RECIPE_VERSION_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS recipe_versions (
+    recipe_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    modified_at TEXT NOT NULL  -- UTC, 'YYYY-MM-DD HH:MM:SS'
+);
+
+CREATE TRIGGER IF NOT EXISTS recipe_version_after_recipe_delete
+AFTER DELETE ON recipes
+BEGIN
+    DELETE FROM recipe_versions WHERE recipe_id = OLD.id;
+END;
+''' + _recipe_version_trigger('recipe_version_after_recipe_insert', 'INSERT', 'recipes', 'NEW.id') \
+  + _recipe_version_trigger('recipe_version_after_recipe_update', 'UPDATE', 'recipes', 'OLD.id, NEW.id') \
+  + _recipe_version_trigger('recipe_version_after_line_insert', 'INSERT', 'recipe_ingredients', 'NEW.recipe_id') \
+  + _recipe_version_trigger('recipe_version_after_line_update', 'UPDATE', 'recipe_ingredients',
+                            'OLD.recipe_id, NEW.recipe_id') \
+  + _recipe_version_trigger('recipe_version_after_line_delete', 'DELETE', 'recipe_ingredients', 'OLD.recipe_id') \
+  + _recipe_version_trigger('recipe_version_after_ingredient_update', 'UPDATE OF name, density_g_ml',
+                            'ingredients', _RECIPES_USING.format('NEW.id')) \
+  + _recipe_version_trigger('recipe_version_after_latest_purchase_insert', 'INSERT', 'latest_purchase',
+                            _RECIPES_USING.format('NEW.ingredient_id')) \
+  + _recipe_version_trigger('recipe_version_after_latest_purchase_update', 'UPDATE', 'latest_purchase',
+                            _RECIPES_USING.format('OLD.ingredient_id, NEW.ingredient_id')) \
+  + _recipe_version_trigger('recipe_version_after_latest_purchase_delete', 'DELETE', 'latest_purchase',
+                            _RECIPES_USING.format('OLD.ingredient_id')) \
+  + _BUMP_RECIPE_VERSION.format(ids='SELECT id FROM recipes')
+
+# --- Sparse Line Ordering ---
+
+# Recipe lines are ordered by sparse sort keys, so a move rewrites only sort_order.
+# The search document does not contain it, so the line-update search trigger is
+# narrowed to the columns the document depends on.
+LINE_ORDER_SCHEMA = '''
+DROP TRIGGER IF EXISTS recipe_search_after_line_update;
+''' + _search_trigger('recipe_search_after_line_update', 'UPDATE OF recipe_id, ingredient_id',
+                      'recipe_ingredients', 'OLD.recipe_id, NEW.recipe_id')
+
+# --- Normalized Unit Prices ---
+
+# Every purchase stores its price per base unit (g, ml or ea, see units.unit_price)
+# so purchases can be compared and sorted by price in SQL. The app computes it when
+# it writes a purchase; this migration backfills existing rows.
+#
+# The latest_purchase update trigger re-derives an ingredient's projection row from
+# its whole history, so it is narrowed to the columns the projection holds; the
+# backfill (and any later write of only the unit price) then leaves it alone.
+UNIT_PRICE_SCHEMA = '''
+DROP TRIGGER IF EXISTS latest_purchase_after_update;
+CREATE TRIGGER latest_purchase_after_update
+AFTER UPDATE OF ingredient_id, brand, store, package_amount, package_unit, price, purchase_date
+ON ingredient_purchases
+BEGIN
+    DELETE FROM latest_purchase WHERE ingredient_id IN (OLD.ingredient_id, NEW.ingredient_id);
+    INSERT INTO latest_purchase (ingredient_id, purchase_id, brand, store, package_amount,
+                                 package_unit, price, purchase_date)
+    SELECT ingredient_id, id, brand, store, package_amount, package_unit, price, purchase_date
+    FROM (
+        SELECT *, ROW_NUMBER() OVER (
+            PARTITION BY ingredient_id ORDER BY purchase_date DESC, id DESC
+        ) AS rn
+        FROM ingredient_purchases
+        WHERE ingredient_id IN (OLD.ingredient_id, NEW.ingredient_id)
+    )
+    WHERE rn = 1;
+END;
+'''
+
+UNIT_PRICE_INDEXES = '''
+-- Cheapest purchase per ingredient and base unit
+CREATE INDEX IF NOT EXISTS idx_purchases_cheapest
+    ON ingredient_purchases (ingredient_id, base_unit, unit_price, id);
+-- Purchase list sorted by unit price; the expression must match app.py
+CREATE INDEX IF NOT EXISTS idx_purchases_unit_price_key
+    ON ingredient_purchases (IFNULL(unit_price, 0), id);
+'''
+
+def _add_unit_prices(db):
+    columns = _columns(db, 'ingredient_purchases')
+    if 'unit_price' not in columns:
+        db.execute('ALTER TABLE ingredient_purchases ADD COLUMN unit_price REAL')
+    if 'base_unit' not in columns:
+        db.execute('ALTER TABLE ingredient_purchases ADD COLUMN base_unit TEXT')
+    run_script(db, UNIT_PRICE_SCHEMA)
+    # One UPDATE over the table, using the same function the app writes with, so
+    # packages are measured by units.package_size as recipes are costed
+    db.create_function('unit_price', 3, lambda *args: unit_price(*args)[0], deterministic=True)
+    db.create_function('base_unit', 3, lambda *args: unit_price(*args)[1], deterministic=True)
+    try:
+        db.execute('''
+            UPDATE ingredient_purchases
+            SET unit_price = unit_price(price, package_amount, package_unit),
+                base_unit = base_unit(price, package_amount, package_unit)
+        ''')
+    finally:
+        db.create_function('unit_price', 3, None)
+        db.create_function('base_unit', 3, None)
+    run_script(db, UNIT_PRICE_INDEXES)
+
+# --- Sub-Recipes ---
+
+# A recipe can be a component of other recipes (see recipe_graph.py), measured
+# against its yield_amount and yield_unit. Changing a recipe's components bumps
+# its version; the recipe page also validates against its sub-recipes' versions.
+SUB_RECIPE_SCHEMA = '''
+-- A recipe used as a component of another, measured against its yield
+CREATE TABLE IF NOT EXISTS recipe_components (
+    recipe_id INTEGER NOT NULL,
+    component_recipe_id INTEGER NOT NULL,
+    amount_needed REAL NOT NULL,
+    unit_needed TEXT NOT NULL,
+    sort_order INTEGER,
+    PRIMARY KEY (recipe_id, component_recipe_id),
+    FOREIGN KEY (recipe_id) REFERENCES recipes (id),
+    FOREIGN KEY (component_recipe_id) REFERENCES recipes (id),
+    CHECK (recipe_id != component_recipe_id)
+);
+
+-- Where a recipe is used as a component
+CREATE INDEX IF NOT EXISTS idx_recipe_components_component
+    ON recipe_components (component_recipe_id, recipe_id);
+''' + _recipe_version_trigger('recipe_version_after_component_insert', 'INSERT', 'recipe_components',
+                              'NEW.recipe_id') \
+  + _recipe_version_trigger('recipe_version_after_component_update', 'UPDATE', 'recipe_components',
+                            'OLD.recipe_id, NEW.recipe_id') \
+  + _recipe_version_trigger('recipe_version_after_component_delete', 'DELETE', 'recipe_components',
+                            'OLD.recipe_id')
+
+def _add_sub_recipes(db):
+    columns = _columns(db, 'recipes')
+    for column, column_type in (('yield_amount', 'REAL'), ('yield_unit', 'TEXT')):
+        if column not in columns:
+            db.execute(f'ALTER TABLE recipes ADD COLUMN {column} {column_type}')
+    run_script(db, SUB_RECIPE_SCHEMA)
+
+# --- Background Jobs ---
+
+# The persistent queue of jobs.py. A partial unique index keeps at most one copy
+# of a job (kind, key) queued; finished jobs are kept for a while so the status
+# endpoint can report latency. recipe_costs holds the costs stored by recost
+# jobs, each tagged with the recipe page version it was computed for, so a stored
+# cost is only served while nothing on the page has changed since. The page
+# stamp's modified_at also grows when only a sub-recipe changes, so it orders
+# stored costs where the version alone does not.
+JOBS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued' CHECK (state IN ('queued', 'running', 'done', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,  -- Unix time, like started_at and finished_at
+    started_at REAL,
+    finished_at REAL,
+    error TEXT
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_queued_once ON jobs (kind, key) WHERE state = 'queued';
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, id);
+
+CREATE TABLE IF NOT EXISTS recipe_costs (
+    recipe_id INTEGER PRIMARY KEY,
+    version TEXT NOT NULL,      -- recipe page version (see _recipe_page_stamp in app.py)
+    modified_at TEXT NOT NULL,  -- UTC modified_at of that page version, 'YYYY-MM-DD HH:MM:SS'
+    total REAL NOT NULL,
+    cost_info TEXT NOT NULL,    -- JSON, as returned by calculate_recipe_cost
+    computed_at TEXT NOT NULL   -- UTC, 'YYYY-MM-DD HH:MM:SS'
+);
+
+CREATE TRIGGER IF NOT EXISTS recipe_costs_after_recipe_delete
+AFTER DELETE ON recipes
+BEGIN
+    DELETE FROM recipe_costs WHERE recipe_id = OLD.id;
+END;
+'''
+
+# --- Pantry Inventory ---
+
+# Stock on hand (see pantry.py). A lot is one stocked purchase, measured in the
+# base unit of its dimension; pantry_movements is the ledger of everything that
+# went into or out of a lot. The lot indexes are partial: only lots with stock
+# left are indexed, so FIFO lookups and the expiry window never read used-up lots.
+PANTRY_SCHEMA = '''
+-- Pantry stock: lots of stocked purchases, production runs and the ledger between them
+CREATE TABLE IF NOT EXISTS pantry_lots (
+    id INTEGER PRIMARY KEY,
+    purchase_id INTEGER UNIQUE REFERENCES ingredient_purchases (id),
+    ingredient_id INTEGER NOT NULL REFERENCES ingredients (id),
+    base_unit TEXT NOT NULL,       -- 'g', 'ml' or 'ea'
+    quantity REAL NOT NULL,        -- as stocked, in base_unit
+    remaining REAL NOT NULL,
+    unit_cost REAL NOT NULL,       -- per base_unit
+    received_date TEXT NOT NULL,   -- 'YYYY-MM-DD'; lots are used oldest first
+    expiry_date TEXT               -- 'YYYY-MM-DD', NULL if it does not expire
+);
+
+CREATE TABLE IF NOT EXISTS production_runs (
+    id INTEGER PRIMARY KEY,
+    recipe_id INTEGER NOT NULL,
+    batches REAL NOT NULL,
+    run_date TEXT NOT NULL,        -- 'YYYY-MM-DD'
+    total_cost REAL NOT NULL,      -- value of the lots consumed
+    created_at TEXT NOT NULL       -- UTC, 'YYYY-MM-DD HH:MM:SS'
+);
+
+CREATE TABLE IF NOT EXISTS pantry_movements (
+    id INTEGER PRIMARY KEY,
+    lot_id INTEGER NOT NULL REFERENCES pantry_lots (id),
+    run_id INTEGER REFERENCES production_runs (id),
+    kind TEXT NOT NULL CHECK (kind IN ('stock', 'consume', 'discard')),
+    quantity REAL NOT NULL,        -- in the lot's base unit; negative when stock leaves
+    cost REAL NOT NULL,            -- quantity valued at the lot's unit cost
+    created_at TEXT NOT NULL       -- UTC, 'YYYY-MM-DD HH:MM:SS'
+);
+
+-- Lots with stock left, oldest first per ingredient (FIFO consumption)
+CREATE INDEX IF NOT EXISTS idx_pantry_lots_fifo
+    ON pantry_lots (ingredient_id, received_date, id) WHERE remaining > 0;
+-- Lots with stock left by expiry date ("expiring within N days")
+CREATE INDEX IF NOT EXISTS idx_pantry_lots_expiry
+    ON pantry_lots (expiry_date) WHERE remaining > 0 AND expiry_date IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_pantry_movements_lot ON pantry_movements (lot_id);
+CREATE INDEX IF NOT EXISTS idx_pantry_movements_run ON pantry_movements (run_id) WHERE run_id IS NOT NULL;
+'''
+
+# --- Migration Runner ---
+
+def run_script(db, script):
+    """
+    Executes a multi-statement SQL script statement by statement. Unlike
+    executescript, this does not commit, so it can run inside a migration's transaction.
+    """
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            db.execute(statement)
+            statement = ''
+    if statement.strip():
+        raise ValueError(f'Incomplete SQL statement in script: {statement.strip()[:60]}')
+
+# (version, description, SQL script or callable taking the connection)
+MIGRATIONS = [
+    (1, 'baseline tables', BASELINE_SCHEMA),
+    (2, 'repair drift from the original setup script', _repair_schema_drift),
+    (3, 'latest_purchase projection', _create_latest_purchase),
+    (4, 'table change versions', CHANGE_VERSION_SCHEMA),
+    (5, 'indexes for hot queries', INDEXES_SCHEMA),
+    (6, 'keyset pagination indexes and purchase row count', PURCHASE_LIST_SCHEMA),
+    (7, 'full-text search over recipes', SEARCH_SCHEMA),
+    (8, 'per-recipe version stamps', RECIPE_VERSION_SCHEMA),
+    (9, 'skip search refresh when recipe lines are reordered', LINE_ORDER_SCHEMA),
+    (10, 'normalized unit price per purchase', _add_unit_prices),
+    (11, 'sub-recipes', _add_sub_recipes),
+    (12, 'background job queue and stored recipe costs', JOBS_SCHEMA),
+    (13, 'pantry inventory', PANTRY_SCHEMA),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(db, target_version=None):
+    """
+    Applies pending migrations to an open connection, up to `target_version`
+    (default: all of them). Returns the list of (version, description) pairs applied.
+    """
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if target_version is not None and version > target_version:
+            break
+        if get_schema_version(db) >= version:
+            continue
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have applied it while we waited for the lock
+            if get_schema_version(db) < version:
+                if callable(step):
+                    step(db)
+                else:
+                    run_script(db, step)
+                db.execute(f'PRAGMA user_version = {version:d}')
+                applied.append((version, description))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+    return applied
+
+# --- Query Plan Checks ---
+
+# Queries on the request path that must stay index-driven. Parameters are dummies;
+# only the plan matters.
+HOT_QUERIES = {
+    'recipe cost lines': ('''
+        SELECT ri.ingredient_id, i.name, i.density_g_ml, ri.amount_needed, ri.unit_needed,
+               lp.ingredient_id AS purchase_ingredient_id,
+               lp.package_amount, lp.package_unit, lp.price
+        FROM recipe_ingredients ri
+        JOIN ingredients i ON ri.ingredient_id = i.id
+        LEFT JOIN latest_purchase lp ON lp.ingredient_id = ri.ingredient_id
+        WHERE ri.recipe_id = ?
+        ORDER BY ri.sort_order
+    ''', (1,)),
+    'recipe cost lines as of a date': ('''
+        SELECT ri.ingredient_id, i.name, i.density_g_ml, ri.amount_needed, ri.unit_needed,
+               lp.ingredient_id AS purchase_ingredient_id,
+               lp.package_amount, lp.package_unit, lp.price
+        FROM recipe_ingredients ri
+        JOIN ingredients i ON ri.ingredient_id = i.id
+        LEFT JOIN ingredient_purchases lp ON lp.id = (
+            SELECT p.id FROM ingredient_purchases p
+            WHERE p.ingredient_id = ri.ingredient_id AND p.purchase_date <= ?
+            ORDER BY p.purchase_date DESC, p.id DESC
+            LIMIT 1
+        )
+        WHERE ri.recipe_id = ?
+        ORDER BY ri.sort_order
+    ''', ('2000-01-01', 1)),
+    'cost lines of some recipes': ('''
+        SELECT ri.recipe_id, ri.ingredient_id, i.name, ri.amount_needed, ri.unit_needed
+        FROM recipe_ingredients ri
+        JOIN ingredients i ON ri.ingredient_id = i.id
+        WHERE ri.recipe_id IN (SELECT value FROM json_each(?))
+        ORDER BY ri.recipe_id, ri.sort_order
+    ''', ('[1]',)),
+    'recipe detail lines': ('''
+        SELECT i.name, i.density_g_ml, ri.amount_needed, ri.unit_needed
+        FROM recipe_ingredients ri
+        JOIN ingredients i ON ri.ingredient_id = i.id
+        WHERE ri.recipe_id = ?
+        ORDER BY ri.sort_order
+    ''', (1,)),
+    'recipes using an ingredient': (
+        'SELECT recipe_id FROM recipe_ingredients WHERE ingredient_id = ?', (1,)),
+    'ingredient by name': ('SELECT id FROM ingredients WHERE name = ?', ('x',)),
+    'latest purchase of one ingredient': ('''
+        SELECT * FROM ingredient_purchases WHERE ingredient_id = ?
+        ORDER BY purchase_date DESC, id DESC LIMIT 1
+    ''', (1,)),
+    'auto-fill for one ingredient': ('''
+        SELECT i.name, lp.brand, lp.store, lp.package_amount, lp.package_unit, lp.price
+        FROM latest_purchase lp
+        JOIN ingredients i ON lp.ingredient_id = i.id
+        WHERE i.name = ?
+    ''', ('x',)),
+    'next queued job': (
+        "SELECT id FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1", ()),
+    'stored recipe cost': ('SELECT version, cost_info FROM recipe_costs WHERE recipe_id = ?', (1,)),
+    'pantry lots of some ingredients, oldest first': ('''
+        SELECT id, ingredient_id, base_unit, remaining, unit_cost FROM pantry_lots
+        WHERE ingredient_id IN (SELECT value FROM json_each(?)) AND remaining > 0
+        ORDER BY ingredient_id, received_date, id
+    ''', ('[1]',)),
+    'pantry lots expiring by a date': ('''
+        SELECT l.id, i.name, l.remaining, l.expiry_date
+        FROM pantry_lots l
+        JOIN ingredients i ON i.id = l.ingredient_id
+        WHERE l.remaining > 0 AND l.expiry_date IS NOT NULL AND l.expiry_date <= ?
+        ORDER BY l.expiry_date
+    ''', ('2000-01-01',)),
+}
+
+# Table-valued functions read their arguments, not a table, so scanning one is fine
+_TABLE_VALUED_FUNCTIONS = ('json_each', 'json_tree')
+
+def _plan_problems(plan):
+    """Yields plan steps that read a whole table or sort without an index."""
+    for row in plan:
+        detail = row[3]
+        if (detail.startswith('SCAN ') and ' USING ' not in detail
+                and detail.split()[1] not in _TABLE_VALUED_FUNCTIONS):
+            yield detail
+        elif detail.startswith('USE TEMP B-TREE FOR ORDER BY'):
+            yield detail
+
+def check_query_plans(db, queries=HOT_QUERIES):
+    """
+    Runs EXPLAIN QUERY PLAN on every hot query.
+    Returns a dict of query name -> offending plan steps, empty when all are indexed.
+    """
+    problems = {}
+    for name, (sql, params) in queries.items():
+        plan = db.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        offending = list(_plan_problems(plan))
+        if offending:
+            problems[name] = offending
+    return problems
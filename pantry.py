@@ -0,0 +1,264 @@
+# pantry.py
+#
+# Pantry inventory: every stocked purchase becomes a lot holding its package in
+# the base unit of its dimension (g, ml or ea). Production runs consume lots
+# oldest first (FIFO) and are costed from the lots they used; every change to a
+# lot is recorded in the pantry_movements ledger.
+
+import json
+from datetime import date, timedelta
+
+from recipe_graph import expand_batches
+from units import BASE_UNITS, CONVERSIONS_TO_BASE, UNIT_DIMENSIONS, conversion_factor
+
+# Tolerance so float noise (e.g. 1e-12 g left over) neither blocks a run nor leaves crumbs of stock
+_AMOUNT_EPSILON = 1e-9
+
+class StockShortage(ValueError):
+    """Raised when the pantry cannot cover a production run; `shortages` lists the problems."""
+
+    def __init__(self, shortages):
+        super().__init__('Not enough stock: ' + '; '.join(shortages))
+        self.shortages = shortages
+
+def _lot_values(purchase):
+    """
+    Returns (base_unit, quantity, unit_cost) for a lot of one purchase, or None if
+    its unit is unknown. Stock is a physical count: a purchase of 12 ea is a lot
+    of 12 items, although recipe costing prices it as one (see units.package_size).
+    """
+    dimension = UNIT_DIMENSIONS.get(purchase['package_unit'])
+    if dimension is None or not purchase['package_amount'] or purchase['package_amount'] <= 0:
+        return None
+    quantity = purchase['package_amount'] * CONVERSIONS_TO_BASE[purchase['package_unit']]
+    return BASE_UNITS[dimension], quantity, purchase['price'] / quantity
+
+def stock_purchase(db, purchase_id):
+    """
+    Adds a purchase to the pantry as a new lot and records it in the ledger. Runs
+    in the caller's transaction and does not commit. Returns the lot id, or None
+    if the purchase's package cannot be measured.
+    """
+    purchase = db.execute('SELECT * FROM ingredient_purchases WHERE id = ?', (purchase_id,)).fetchone()
+    values = _lot_values(purchase)
+    if values is None:
+        return None
+    base_unit, quantity, unit_cost = values
+    lot_id = db.execute('''
+        INSERT INTO pantry_lots (purchase_id, ingredient_id, base_unit, quantity, remaining, unit_cost,
+                                 received_date, expiry_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, NULLIF(?, ''))
+    ''', (purchase_id, purchase['ingredient_id'], base_unit, quantity, quantity, unit_cost,
+          purchase['purchase_date'], purchase['expiry_date'])).lastrowid
+    db.execute('''
+        INSERT INTO pantry_movements (lot_id, kind, quantity, cost, created_at)
+        VALUES (?, 'stock', ?, ?, strftime('%Y-%m-%d %H:%M:%S', 'now'))
+    ''', (lot_id, quantity, quantity * unit_cost))
+    return lot_id
+
+def sync_purchase_lot(db, purchase_id):
+    """
+    Carries an edited purchase over to its lot, if it was stocked: the ingredient,
+    dates and unit cost always, the quantity only while nothing has been taken
+    from the lot. Runs in the caller's transaction and does not commit.
+    """
+    lot = db.execute('SELECT * FROM pantry_lots WHERE purchase_id = ?', (purchase_id,)).fetchone()
+    if lot is None:
+        return
+    purchase = db.execute('SELECT * FROM ingredient_purchases WHERE id = ?', (purchase_id,)).fetchone()
+    values = _lot_values(purchase)
+    untouched = lot['remaining'] == lot['quantity']
+    if values is not None and untouched:
+        base_unit, quantity, unit_cost = values
+        db.execute('UPDATE pantry_movements SET quantity = ?, cost = ? WHERE lot_id = ? AND kind = ?',
+                   (quantity, quantity * unit_cost, lot['id'], 'stock'))
+    elif values is not None and values[0] == lot['base_unit']:
+        base_unit, quantity, unit_cost = lot['base_unit'], lot['quantity'], values[2]
+    else:
+        base_unit, quantity, unit_cost = lot['base_unit'], lot['quantity'], lot['unit_cost']
+    db.execute('''
+        UPDATE pantry_lots
+        SET ingredient_id = ?, base_unit = ?, quantity = ?, remaining = ?, unit_cost = ?,
+            received_date = ?, expiry_date = NULLIF(?, '')
+        WHERE id = ?
+    ''', (purchase['ingredient_id'], base_unit, quantity, quantity if untouched else lot['remaining'],
+          unit_cost, purchase['purchase_date'], purchase['expiry_date'], lot['id']))
+
+def discard_lot(db, lot_id):
+    """
+    Writes off what is left of a lot (spoiled, expired, lost). Returns the amount
+    discarded in the lot's base unit; raises LookupError for an unknown lot.
+    """
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        lot = db.execute('SELECT remaining, unit_cost FROM pantry_lots WHERE id = ?', (lot_id,)).fetchone()
+        if lot is None:
+            raise LookupError(f'Pantry lot {lot_id} does not exist.')
+        if lot['remaining'] > 0:
+            db.execute('UPDATE pantry_lots SET remaining = 0 WHERE id = ?', (lot_id,))
+            db.execute('''
+                INSERT INTO pantry_movements (lot_id, kind, quantity, cost, created_at)
+                VALUES (?, 'discard', ?, ?, strftime('%Y-%m-%d %H:%M:%S', 'now'))
+            ''', (lot_id, -lot['remaining'], -lot['remaining'] * lot['unit_cost']))
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    return max(lot['remaining'], 0.0)
+
+# --- Production Runs ---
+
+def _requirements(db, recipe_id, batches):
+    """
+    Returns {ingredient_id: {'name', 'density', 'needs': {unit: amount}}} for making
+    `batches` of a recipe, sub-recipes included, plus notes about sub-recipe lines
+    that could not be measured.
+    """
+    plan, notes = expand_batches(db, {recipe_id: batches})
+    requirements = {}
+    for line in db.execute('''
+        SELECT ri.recipe_id, ri.ingredient_id, ri.amount_needed, ri.unit_needed, i.name, i.density_g_ml
+        FROM recipe_ingredients ri
+        JOIN ingredients i ON ri.ingredient_id = i.id
+        WHERE ri.recipe_id IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(list(plan)),)):
+        item = requirements.setdefault(line['ingredient_id'], {
+            'name': line['name'], 'density': line['density_g_ml'], 'needs': {}})
+        needs = item['needs']
+        needs[line['unit_needed']] = (needs.get(line['unit_needed'], 0.0)
+                                      + line['amount_needed'] * plan[line['recipe_id']])
+    return requirements, notes
+
+def _allocate(lots, item):
+    """
+    Takes an ingredient's requirement from its lots, oldest first. Returns
+    ([(lot, quantity taken)], [shortage messages]); the lots are not modified.
+    """
+    takes = []
+    left = {lot['id']: lot['remaining'] for lot in lots}
+    shortages = []
+    for unit, amount in item['needs'].items():
+        for lot in lots:
+            if amount <= _AMOUNT_EPSILON:
+                break
+            factor = conversion_factor(unit, lot['base_unit'], item['density'])
+            if factor is None or left[lot['id']] <= 0:
+                continue
+            taken = min(left[lot['id']], amount * factor)
+            left[lot['id']] -= taken
+            amount -= taken / factor
+            takes.append((lot, taken))
+        if amount > _AMOUNT_EPSILON:
+            shortages.append(f"{item['name']}: short by {amount:.4g} {unit}")
+    return takes, shortages
+
+def record_production_run(db, recipe_id, batches, run_date=None):
+    """
+    Records making `batches` of a recipe (sub-recipes included): every ingredient
+    is taken from its pantry lots oldest first, and the run is costed from the
+    lots used. All lots are read with one query and written with one executemany
+    each, in a single transaction, however many lots the run touches. Returns the
+    run id; raises LookupError for an unknown recipe and StockShortage, writing
+    nothing, if the pantry cannot cover the run.
+    """
+    run_date = run_date or date.today().isoformat()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        if db.execute('SELECT 1 FROM recipes WHERE id = ?', (recipe_id,)).fetchone() is None:
+            raise LookupError(f'Recipe {recipe_id} does not exist.')
+        requirements, notes = _requirements(db, recipe_id, batches)
+        shortages = [f'Sub-recipe not measured: {note}' for note in notes]
+
+        lots_by_ingredient = {}
+        for lot in db.execute('''
+            SELECT id, ingredient_id, base_unit, remaining, unit_cost FROM pantry_lots
+            WHERE ingredient_id IN (SELECT value FROM json_each(?)) AND remaining > 0
+            ORDER BY ingredient_id, received_date, id
+        ''', (json.dumps(list(requirements)),)):
+            lots_by_ingredient.setdefault(lot['ingredient_id'], []).append(lot)
+
+        takes = []
+        for ingredient_id, item in requirements.items():
+            ingredient_takes, ingredient_shortages = _allocate(lots_by_ingredient.get(ingredient_id, []), item)
+            takes += ingredient_takes
+            shortages += ingredient_shortages
+        if shortages:
+            raise StockShortage(shortages)
+
+        total_cost = sum(taken * lot['unit_cost'] for lot, taken in takes)
+        run_id = db.execute('''
+            INSERT INTO production_runs (recipe_id, batches, run_date, total_cost, created_at)
+            VALUES (?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%S', 'now'))
+        ''', (recipe_id, batches, run_date, total_cost)).lastrowid
+        db.executemany('''
+            UPDATE pantry_lots SET remaining = CASE WHEN remaining - ? > ? THEN remaining - ? ELSE 0 END
+            WHERE id = ?
+        ''', [(taken, _AMOUNT_EPSILON, taken, lot['id']) for lot, taken in takes])
+        db.executemany('''
+            INSERT INTO pantry_movements (lot_id, run_id, kind, quantity, cost, created_at)
+            VALUES (?, ?, 'consume', ?, ?, strftime('%Y-%m-%d %H:%M:%S', 'now'))
+        ''', [(lot['id'], run_id, -taken, -taken * lot['unit_cost']) for lot, taken in takes])
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    return run_id
+
+def production_run(db, run_id):
+    """Returns a run with its recipe name and the lots it consumed, or None."""
+    run = db.execute('''
+        SELECT pr.*, r.name AS recipe_name
+        FROM production_runs pr LEFT JOIN recipes r ON r.id = pr.recipe_id
+        WHERE pr.id = ?
+    ''', (run_id,)).fetchone()
+    if run is None:
+        return None
+    consumed = db.execute('''
+        SELECT i.name, l.id AS lot_id, l.base_unit, l.received_date, l.expiry_date,
+               -m.quantity AS quantity, -m.cost AS cost
+        FROM pantry_movements m
+        JOIN pantry_lots l ON l.id = m.lot_id
+        JOIN ingredients i ON i.id = l.ingredient_id
+        WHERE m.run_id = ?
+        ORDER BY i.name, l.received_date, l.id
+    ''', (run_id,)).fetchall()
+    return dict(run, consumed=consumed)
+
+# --- Stock Views ---
+
+def on_hand(db):
+    """Returns the stock left per ingredient and base unit, with its value and next expiry date."""
+    return db.execute('''
+        SELECT i.id AS ingredient_id, i.name, l.base_unit, COUNT(*) AS lots,
+               SUM(l.remaining) AS remaining, SUM(l.remaining * l.unit_cost) AS value,
+               MIN(l.expiry_date) AS next_expiry
+        FROM pantry_lots l
+        JOIN ingredients i ON i.id = l.ingredient_id
+        WHERE l.remaining > 0
+        GROUP BY l.ingredient_id, l.base_unit
+        ORDER BY i.name
+    ''').fetchall()
+
+def expiring_lots(db, days, today=None):
+    """
+    Returns the lots with stock left that expire within `days` days of `today`
+    (already expired ones included), soonest first. Served by the partial expiry
+    index, so only lots in the window are read.
+    """
+    today = today or date.today()
+    return db.execute('''
+        SELECT l.id, l.ingredient_id, i.name, l.base_unit, l.remaining, l.remaining * l.unit_cost AS value,
+               l.received_date, l.expiry_date
+        FROM pantry_lots l
+        JOIN ingredients i ON i.id = l.ingredient_id
+        WHERE l.remaining > 0 AND l.expiry_date IS NOT NULL AND l.expiry_date <= ?
+        ORDER BY l.expiry_date
+    ''', ((today + timedelta(days=days)).isoformat(),)).fetchall()
+
+def recent_runs(db, limit=10):
+    """Returns the latest production runs, newest first."""
+    return db.execute('''
+        SELECT pr.id, pr.recipe_id, r.name AS recipe_name, pr.batches, pr.run_date, pr.total_cost
+        FROM production_runs pr LEFT JOIN recipes r ON r.id = pr.recipe_id
+        ORDER BY pr.id DESC LIMIT ?
+    ''', (limit,)).fetchall()
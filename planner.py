@@ -0,0 +1,115 @@
+# planner.py
+#
+# Production planning: scale many recipes by a number of batches and consolidate
+# what they need into one shopping list, in whole packages of each ingredient's
+# latest purchase.
+
+import json
+import math
+
+from recipe_graph import expand_batches
+from units import UNIT_DIMENSIONS, BASE_UNITS, conversion_factor, package_size
+
+# Tolerance so float noise (e.g. 3.0000000001 packages) does not buy an extra package
+_PACKAGE_EPSILON = 1e-9
+
+def parse_plan(raw):
+    """
+    Validates a {recipe_id: batches} mapping (keys may be strings, as in JSON).
+    Returns {int recipe_id: float batches}, or raises ValueError.
+    """
+    if not isinstance(raw, dict) or not raw:
+        raise ValueError('The plan must map at least one recipe id to a number of batches.')
+    plan = {}
+    for recipe_id, batches in raw.items():
+        try:
+            recipe_id = int(recipe_id)
+            batches = float(batches)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid plan entry {recipe_id!r}: {batches!r}.")
+        if not batches > 0 or math.isinf(batches):
+            raise ValueError(f'Batches for recipe {recipe_id} must be a positive number.')
+        plan[recipe_id] = plan.get(recipe_id, 0.0) + batches
+    return plan
+
+def plan_production(db, plan):
+    """
+    Aggregates the ingredients needed to make every recipe in `plan` ({recipe_id:
+    batches}). Sub-recipes are planned too, in the batches the plan uses of them.
+    All recipe lines are fetched in one query; each line is converted into the
+    base unit (g, ml or ea) of its ingredient's latest purchase and summed.
+    Returns a dict with the recipes found, the shopping list and the total spend.
+    """
+    plan_json = json.dumps(list(plan))
+    recipes = {
+        row['id']: {'id': row['id'], 'name': row['name'], 'batches': plan[row['id']]}
+        for row in db.execute(
+            'SELECT id, name FROM recipes WHERE id IN (SELECT value FROM json_each(?))', (plan_json,))
+    }
+    batches, component_notes = expand_batches(db, {recipe_id: plan[recipe_id] for recipe_id in recipes})
+    lines = db.execute('''
+        SELECT ri.recipe_id, ri.ingredient_id, ri.amount_needed, ri.unit_needed,
+               i.name, i.density_g_ml,
+               lp.ingredient_id AS purchase_ingredient_id,
+               lp.package_amount, lp.package_unit, lp.price, lp.store, lp.brand
+        FROM recipe_ingredients ri
+        JOIN ingredients i ON ri.ingredient_id = i.id
+        LEFT JOIN latest_purchase lp ON lp.ingredient_id = ri.ingredient_id
+        WHERE ri.recipe_id IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(list(batches)),))
+
+    items = {}
+    for line in lines:
+        item = items.get(line['ingredient_id'])
+        if item is None:
+            has_purchase = line['purchase_ingredient_id'] is not None
+            dimension = UNIT_DIMENSIONS.get(line['package_unit'] if has_purchase else line['unit_needed'])
+            item = items[line['ingredient_id']] = {
+                'ingredient_id': line['ingredient_id'],
+                'name': line['name'],
+                'density': line['density_g_ml'],
+                'purchase': line if has_purchase else None,
+                'base_unit': BASE_UNITS.get(dimension),
+                'required': 0.0,
+                'notes': set(),
+            }
+        amount = line['amount_needed'] * batches[line['recipe_id']]
+        factor = None
+        if item['base_unit'] is not None:
+            factor = conversion_factor(line['unit_needed'], item['base_unit'], item['density'])
+        if factor is None:
+            item['notes'].add(f"Cannot convert {line['unit_needed']} to {item['base_unit'] or 'a known unit'}"
+                              + (' without a density value.' if item['density'] is None else '.'))
+            continue
+        item['required'] += amount * factor
+
+    shopping_list = []
+    total_spend = 0.0
+    for item in sorted(items.values(), key=lambda i: i['name'].lower()):
+        purchase = item.pop('purchase')
+        entry = dict(item, notes=sorted(item['notes']), packages=None, spend=None, used_cost=None,
+                     package_amount=None, package_unit=None, price=None, store=None, brand=None)
+        del entry['density']
+        if purchase is None:
+            entry['notes'].append('No purchase history')
+        else:
+            size = package_size(purchase['package_amount'], purchase['package_unit'])
+            packages_exact = item['required'] / size if size else 0.0
+            packages = math.ceil(packages_exact - _PACKAGE_EPSILON) if packages_exact > 0 else 0
+            entry.update(
+                package_amount=purchase['package_amount'], package_unit=purchase['package_unit'],
+                price=purchase['price'], store=purchase['store'], brand=purchase['brand'],
+                packages=packages,
+                spend=packages * purchase['price'],
+                used_cost=packages_exact * purchase['price'],
+            )
+            total_spend += entry['spend']
+        shopping_list.append(entry)
+
+    return {
+        'recipes': sorted(recipes.values(), key=lambda r: r['name'].lower()),
+        'missing_recipe_ids': sorted(set(plan) - set(recipes)),
+        'component_notes': component_notes,
+        'items': shopping_list,
+        'total_spend': total_spend,
+    }
@@ -0,0 +1,158 @@
+# recipe_entry.py
+#
+# Batch entry of recipe ingredient lines: a whole ingredient list is validated,
+# missing base ingredients are created in bulk, and every line is inserted in a
+# single transaction.
+
+import json
+import re
+
+from units import canonical_unit
+
+# One text line: "<amount> <unit> <ingredient name>", e.g. "250 g All-Purpose Flour"
+_TEXT_LINE = re.compile(r'^\s*(\S+)\s+(\S+)\s+(.+?)\s*$')
+
+class BatchResult:
+    """Outcome of one batch: lines added and ingredients created, or the per-line errors."""
+
+    def __init__(self):
+        self.added = 0
+        self.ingredients_created = 0
+        self.errors = []  # (line number, message)
+
+    def add_error(self, line_number, message):
+        self.errors.append((line_number, message))
+
+def parse_text_lines(text):
+    """
+    Turns pasted text with one "<amount> <unit> <ingredient name>" per line into
+    (line number, raw line dict) pairs. Blank lines are skipped but still counted.
+    """
+    lines = []
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        match = _TEXT_LINE.match(line)
+        if match is None:
+            lines.append((line_number, {'text': line.strip()}))
+        else:
+            amount, unit, name = match.groups()
+            lines.append((line_number, {'amount': amount, 'unit': unit, 'name': name}))
+    return lines
+
+def validate_recipe_line(raw):
+    """
+    Normalizes one line given as {'name' or 'ingredient_id', 'amount', 'unit'}.
+    Returns (name or None, ingredient_id or None, amount, unit), or raises
+    ValueError describing the first problem found.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError('Line must be an object with name (or ingredient_id), amount and unit.')
+    if 'text' in raw:
+        raise ValueError(f"Expected '<amount> <unit> <ingredient>', got '{raw['text']}'.")
+
+    ingredient_id = raw.get('ingredient_id')
+    name = str(raw.get('name') or '').strip()
+    if ingredient_id not in (None, ''):
+        try:
+            ingredient_id = int(ingredient_id)
+        except (TypeError, ValueError):
+            raise ValueError(f"ingredient_id must be an integer, got '{ingredient_id}'.")
+        name = None
+    elif not name:
+        raise ValueError('Missing ingredient name.')
+    else:
+        ingredient_id = None
+
+    try:
+        amount = float(raw.get('amount'))
+    except (TypeError, ValueError):
+        raise ValueError(f"Amount must be a number, got '{raw.get('amount')}'.")
+    if not amount > 0 or amount == float('inf'):
+        raise ValueError('Amount must be greater than zero.')
+
+    unit = canonical_unit(str(raw.get('unit') or ''))
+    if unit is None:
+        raise ValueError(f"Unknown unit '{raw.get('unit')}'.")
+    return name, ingredient_id, amount, unit
+
+def add_recipe_lines(db, recipe_id, numbered_lines, create_missing=True, sort_key_gap=1024):
+    """
+    Validates (line number, raw line) pairs and adds them to a recipe after its
+    current last line. Names are resolved with one query; unknown names are created
+    with one executemany when `create_missing` is set. The batch is all or nothing:
+    if any line is invalid, nothing is written and BatchResult.errors lists every
+    problem. Returns a BatchResult; raises ValueError for an empty batch and
+    LookupError for an unknown recipe.
+    """
+    if not numbered_lines:
+        raise ValueError('No ingredient lines were given.')
+    result = BatchResult()
+    valid = []
+    for line_number, raw in numbered_lines:
+        try:
+            valid.append((line_number, validate_recipe_line(raw)))
+        except ValueError as e:
+            result.add_error(line_number, str(e))
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        if db.execute('SELECT 1 FROM recipes WHERE id = ?', (recipe_id,)).fetchone() is None:
+            raise LookupError(f'Recipe {recipe_id} does not exist.')
+
+        names = sorted({name for _, (name, _, _, _) in valid if name is not None})
+        ids = sorted({ingredient_id for _, (_, ingredient_id, _, _) in valid if ingredient_id is not None})
+        ids_by_name = {row[1]: row[0] for row in db.execute(
+            'SELECT id, name FROM ingredients WHERE name IN (SELECT value FROM json_each(?))',
+            (json.dumps(names),))}
+        known_ids = {row[0] for row in db.execute(
+            'SELECT id FROM ingredients WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(ids),))}
+        missing = [name for name in names if name not in ids_by_name]
+        if missing and not create_missing:
+            for line_number, (name, _, _, _) in valid:
+                if name in missing:
+                    result.add_error(line_number, f"Unknown ingredient '{name}'.")
+
+        existing = {row[0] for row in db.execute(
+            'SELECT ingredient_id FROM recipe_ingredients WHERE recipe_id = ?', (recipe_id,))}
+        seen = {}
+        for line_number, (name, ingredient_id, _, _) in valid:
+            if ingredient_id is not None and ingredient_id not in known_ids:
+                result.add_error(line_number, f'Unknown ingredient id {ingredient_id}.')
+                continue
+            # A name and an id can refer to the same ingredient; new names are unique by name
+            key = ingredient_id if ingredient_id is not None else ids_by_name.get(name, name)
+            if key in seen:
+                result.add_error(line_number, f'Same ingredient as line {seen[key]}.')
+                continue
+            seen[key] = line_number
+            if key in existing:
+                result.add_error(line_number, 'This ingredient is already in the recipe.')
+
+        if result.errors:
+            result.errors.sort()
+            db.execute('ROLLBACK')
+            return result
+
+        if missing:
+            db.executemany('INSERT INTO ingredients (name) VALUES (?)', [(name,) for name in missing])
+            ids_by_name.update((row[1], row[0]) for row in db.execute(
+                'SELECT id, name FROM ingredients WHERE name IN (SELECT value FROM json_each(?))',
+                (json.dumps(missing),)))
+            result.ingredients_created = len(missing)
+
+        last_key = db.execute('SELECT IFNULL(MAX(sort_order), 0) FROM recipe_ingredients WHERE recipe_id = ?',
+                              (recipe_id,)).fetchone()[0]
+        db.executemany('''
+            INSERT INTO recipe_ingredients (recipe_id, ingredient_id, amount_needed, unit_needed, sort_order)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(recipe_id, ingredient_id if ingredient_id is not None else ids_by_name[name], amount, unit,
+               last_key + position * sort_key_gap)
+              for position, (_, (name, ingredient_id, amount, unit)) in enumerate(valid, start=1)])
+        db.execute('COMMIT')
+    except BaseException:
+        if db.in_transaction:
+            db.execute('ROLLBACK')
+        raise
+    result.added = len(valid)
+    return result
@@ -0,0 +1,127 @@
+# recipe_graph.py
+#
+# Sub-recipes: a recipe (a dough, a filling, a glaze) can be used as a component
+# of other recipes, measured against its yield amount and unit. The component
+# links form a directed acyclic graph; these helpers load the part of it below
+# some recipes, order it so every sub-recipe comes before the recipes using it,
+# and keep it acyclic when links are added.
+
+import json
+
+from units import conversion_factor
+
+class CycleError(ValueError):
+    """Raised when the component links of some recipes form a cycle."""
+
+_EDGE_COLUMNS = '''
+    rc.recipe_id, rc.component_recipe_id, rc.amount_needed, rc.unit_needed,
+    c.name, c.yield_amount, c.yield_unit
+'''
+
+def load_component_graph(db, recipe_ids=None):
+    """
+    Returns {recipe_id: [component rows]} for every recipe reachable from
+    `recipe_ids` through component links (the whole graph when None), with one
+    query. Rows hold recipe_id, component_recipe_id, amount_needed, unit_needed
+    and the component's name, yield_amount and yield_unit, in display order.
+    Recipes without components are left out.
+    """
+    if recipe_ids is None:
+        rows = db.execute(f'''
+            SELECT {_EDGE_COLUMNS}
+            FROM recipe_components rc
+            JOIN recipes c ON c.id = rc.component_recipe_id
+            ORDER BY rc.recipe_id, rc.sort_order
+        ''')
+    else:
+        # UNION (not UNION ALL) visits each recipe once, even through shared sub-recipes
+        rows = db.execute(f'''
+            WITH RECURSIVE reachable (id) AS (
+                SELECT value FROM json_each(?)
+                UNION
+                SELECT rc.component_recipe_id
+                FROM recipe_components rc JOIN reachable r ON rc.recipe_id = r.id
+            )
+            SELECT {_EDGE_COLUMNS}
+            FROM reachable r
+            JOIN recipe_components rc ON rc.recipe_id = r.id
+            JOIN recipes c ON c.id = rc.component_recipe_id
+            ORDER BY rc.recipe_id, rc.sort_order
+        ''', (json.dumps(list(recipe_ids)),))
+    graph = {}
+    for row in rows:
+        graph.setdefault(row['recipe_id'], []).append(row)
+    return graph
+
+def topological_order(recipe_ids, graph):
+    """
+    Returns `recipe_ids` and everything below them in `graph`, each recipe once
+    and after all of its sub-recipes. Raises CycleError if the links form a cycle.
+    """
+    order = []
+    state = {}  # recipe id -> 'open' while its sub-recipes are visited, then 'done'
+    for root in recipe_ids:
+        if root in state:
+            continue
+        state[root] = 'open'
+        stack = [(root, iter(graph.get(root, ())))]
+        while stack:
+            recipe_id, components = stack[-1]
+            for edge in components:
+                component_id = edge['component_recipe_id']
+                if state.get(component_id) == 'open':
+                    raise CycleError(f'Recipe {component_id} is (indirectly) a sub-recipe of itself.')
+                if component_id not in state:
+                    state[component_id] = 'open'
+                    stack.append((component_id, iter(graph.get(component_id, ()))))
+                    break
+            else:
+                stack.pop()
+                state[recipe_id] = 'done'
+                order.append(recipe_id)
+    return order
+
+def creates_cycle(db, recipe_id, component_recipe_id):
+    """True if using `component_recipe_id` in `recipe_id` would make a recipe part of itself."""
+    return db.execute('''
+        WITH RECURSIVE below (id) AS (
+            SELECT ?
+            UNION
+            SELECT rc.component_recipe_id
+            FROM recipe_components rc JOIN below b ON rc.recipe_id = b.id
+        )
+        SELECT 1 FROM below WHERE id = ? LIMIT 1
+    ''', (component_recipe_id, recipe_id)).fetchone() is not None
+
+def batch_fraction(edge):
+    """
+    The number of batches of a sub-recipe that one component line uses, e.g. 300 g
+    of a dough yielding 1.2 kg is 0.25. Returns (fraction, note); the fraction is
+    None, with a note saying why, if the amount cannot be measured against the yield.
+    """
+    if not edge['yield_amount'] or not edge['yield_unit']:
+        return None, 'Set a yield amount and unit on this sub-recipe to use it by amount.'
+    factor = conversion_factor(edge['unit_needed'], edge['yield_unit'])
+    if factor is None:
+        return None, f"Cannot convert {edge['unit_needed']} to the sub-recipe's yield unit ({edge['yield_unit']})."
+    return edge['amount_needed'] * factor / edge['yield_amount'], ''
+
+def expand_batches(db, plan):
+    """
+    Adds the sub-recipes needed to make `plan` ({recipe_id: batches}). Returns
+    ({recipe_id: batches} for the plan and all its sub-recipes, [notes about
+    component lines that could not be measured]).
+    """
+    graph = load_component_graph(db, list(plan))
+    batches = dict(plan)
+    notes = []
+    # Users before their sub-recipes, so each sub-recipe has its full demand when reached
+    for recipe_id in reversed(topological_order(list(plan), graph)):
+        for edge in graph.get(recipe_id, ()):
+            fraction, note = batch_fraction(edge)
+            if fraction is None:
+                notes.append(f"{edge['name']}: {note}")
+                continue
+            component_id = edge['component_recipe_id']
+            batches[component_id] = batches.get(component_id, 0.0) + batches.get(recipe_id, 0.0) * fraction
+    return batches, notes
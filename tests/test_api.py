@@ -0,0 +1,166 @@
+# test_api.py
+#
+# The read-only JSON API: parsing of ?ids= and ?fields=, field projection, and
+# batch costing of recipes with their sub-recipes.
+
+import re
+
+import pytest
+
+from api import MAX_BATCH_IDS, RECIPE_DEFAULT_FIELDS, parse_fields, parse_ids
+
+def test_parse_ids_keeps_the_first_of_duplicates():
+    assert parse_ids('3, 1,3,2,1') == [3, 1, 2]
+
+@pytest.mark.parametrize('value', [None, '', '  '])
+def test_parse_ids_absent(value):
+    assert parse_ids(value) is None
+
+@pytest.mark.parametrize('value, bad', [('1,x,3', 'x'), ('1,,2', ''), ('1.5', '1.5'), ('1, two', 'two')])
+def test_parse_ids_rejects_non_integers(value, bad):
+    with pytest.raises(ValueError, match=f"got '{bad}'"):
+        parse_ids(value)
+
+def test_parse_ids_limits_the_batch():
+    assert len(parse_ids(','.join(map(str, range(MAX_BATCH_IDS))))) == MAX_BATCH_IDS
+    with pytest.raises(ValueError, match='At most'):
+        parse_ids(','.join(map(str, range(MAX_BATCH_IDS + 1))))
+
+def test_parse_fields():
+    available = ['id', 'name', 'cost']
+    assert parse_fields(None, available, ['id']) == ['id']
+    assert parse_fields(' cost, id,cost,', available, ['id']) == ['cost', 'id']
+    with pytest.raises(ValueError, match='Unknown field.*: price, size'):
+        parse_fields('id,price,size', available, ['id'])
+
+def _add_ingredient(db, name, package_amount, package_unit, price):
+    ingredient_id = db.execute('INSERT INTO ingredients (name) VALUES (?)', (name,)).lastrowid
+    db.execute('''
+        INSERT INTO ingredient_purchases (ingredient_id, package_amount, package_unit, price, purchase_date)
+        VALUES (?, ?, ?, ?, '2026-01-01')
+    ''', (ingredient_id, package_amount, package_unit, price))
+    return ingredient_id
+
+def _add_recipe(db, name, lines, yield_amount=None, yield_unit=None):
+    recipe_id = db.execute('INSERT INTO recipes (name, yield_amount, yield_unit) VALUES (?, ?, ?)',
+                           (name, yield_amount, yield_unit)).lastrowid
+    for sort_order, (ingredient_id, amount_needed, unit_needed) in enumerate(lines, 1):
+        db.execute('''
+            INSERT INTO recipe_ingredients (recipe_id, ingredient_id, amount_needed, unit_needed, sort_order)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (recipe_id, ingredient_id, amount_needed, unit_needed, sort_order))
+    return recipe_id
+
+def _use(db, recipe_id, component_recipe_id, amount_needed, unit_needed):
+    db.execute('''
+        INSERT INTO recipe_components (recipe_id, component_recipe_id, amount_needed, unit_needed, sort_order)
+        VALUES (?, ?, ?, ?, 1)
+    ''', (recipe_id, component_recipe_id, amount_needed, unit_needed))
+
+@pytest.fixture
+def recipes(db):
+    """A loaf, a dough it uses half of, and a recipe with an unpriced line."""
+    flour = _add_ingredient(db, 'Flour', 1, 'kg', 2.0)
+    salt = _add_ingredient(db, 'Salt', 500, 'g', 1.0)
+    saffron = db.execute("INSERT INTO ingredients (name) VALUES ('Saffron')").lastrowid
+    dough = _add_recipe(db, 'Dough', [(flour, 500, 'g')], 1, 'kg')
+    loaf = _add_recipe(db, 'Loaf', [(salt, 10, 'g')])
+    _use(db, loaf, dough, 500, 'g')
+    rice = _add_recipe(db, 'Rice', [(saffron, 1, 'g'), (salt, 5, 'g')])
+    db.commit()
+    return dough, loaf, rice
+
+def test_recipes_default_fields(client, recipes):
+    dough, loaf, rice = recipes
+    body = client.get('/api/recipes').get_json()
+    assert [recipe['id'] for recipe in body] == [dough, loaf, rice]
+    assert all(list(recipe) == RECIPE_DEFAULT_FIELDS for recipe in body)
+
+def test_recipes_projection_keeps_the_order_asked_for(client, recipes):
+    dough, loaf, rice = recipes
+    body = client.get(f'/api/recipes?ids={loaf}&fields=components,name,ingredients').get_json()
+    assert body == [{
+        'components': [{'component_recipe_id': dough, 'name': 'Dough', 'amount_needed': 500.0,
+                        'unit_needed': 'g'}],
+        'name': 'Loaf',
+        'ingredients': [{'ingredient_id': 2, 'name': 'Salt', 'amount_needed': 10.0, 'unit_needed': 'g'}],
+    }]
+
+def test_batch_costs_include_sub_recipes(client, recipes):
+    dough, loaf, rice = recipes
+    body = client.get(f'/api/recipes?ids={loaf},{dough}&fields=id,cost,cost_breakdown').get_json()
+    costs = {recipe['id']: recipe for recipe in body}
+    assert costs[dough]['cost'] == pytest.approx(1.0)
+    # 10 g of salt plus half a dough
+    assert costs[loaf]['cost'] == pytest.approx(0.02 + 0.5)
+    assert [(line['name'], line['cost']) for line in costs[loaf]['cost_breakdown']] == [
+        ('10.0 g of Salt', '0.02'), ('500.0 g of Dough (sub-recipe)', '0.50')]
+
+def test_batch_costs_match_the_costs_of_single_recipes(client, recipes):
+    batch = client.get('/api/costs').get_json()
+    for recipe in batch:
+        single = client.get(f"/api/costs?ids={recipe['id']}").get_json()
+        assert single == [recipe]
+
+def test_costs_count_unpriced_lines(client, recipes):
+    dough, loaf, rice = recipes
+    body = client.get(f'/api/costs?ids={rice}&fields=name,total,unpriced_lines').get_json()
+    assert body == [{'name': 'Rice', 'total': pytest.approx(0.01), 'unpriced_lines': 1}]
+
+def test_duplicate_ids_are_returned_once(client, recipes):
+    dough, loaf, rice = recipes
+    body = client.get(f'/api/recipes?ids={rice},{dough},{rice}&fields=id').get_json()
+    assert body == [{'id': dough}, {'id': rice}]
+
+def test_unknown_id_is_left_out(client, recipes):
+    dough, loaf, rice = recipes
+    response = client.get(f'/api/recipes?ids={dough},999&fields=id,cost')
+    assert response.status_code == 200
+    assert response.get_json() == [{'id': dough, 'cost': pytest.approx(1.0)}]
+    assert client.get('/api/costs?ids=999').get_json() == []
+
+@pytest.mark.parametrize('url', [
+    '/api/recipes?ids=1,abc',
+    '/api/recipes?fields=id,price',
+    '/api/costs?ids=1;2',
+    '/api/costs?fields=cost',
+    '/api/ingredients?ids=1.0',
+    '/api/ingredients?fields=unit_price',
+    '/api/purchases?ingredient_ids=x',
+    '/api/purchases?fields=id,recipe',
+])
+def test_bad_parameters_are_a_400(client, recipes, url):
+    response = client.get(url)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_ingredients_and_purchases_projection(client, recipes):
+    assert client.get('/api/ingredients?ids=1,3&fields=name,latest_price').get_json() == [
+        {'name': 'Flour', 'latest_price': 2.0}, {'name': 'Saffron', 'latest_price': None}]
+    assert client.get('/api/purchases?ingredient_ids=2&fields=ingredient_name,price').get_json() == [
+        {'ingredient_name': 'Salt', 'price': 1.0}]
+
+def test_cycle_is_a_409(db, client, recipes):
+    dough, loaf, rice = recipes
+    _use(db, dough, loaf, 1, 'g')
+    db.commit()
+    response = client.get(f'/api/recipes?ids={loaf}&fields=id,cost')
+    assert response.status_code == 409
+    assert 'sub-recipe of itself' in response.get_json()['error']
+    assert client.get(f'/api/recipes?ids={loaf}&fields=id,name').status_code == 200
+
+def test_batch_is_costed_in_one_pass(db, client, recipes, monkeypatch):
+    import app as recipe_app
+    monkeypatch.setitem(recipe_app.app.config, 'INSTRUMENTATION_ENABLED', True)
+    monkeypatch.setitem(recipe_app.app.config, 'SLOW_QUERY_MS', float('inf'))
+    monkeypatch.setitem(recipe_app.app.config, 'N_PLUS_ONE_THRESHOLD', float('inf'))
+    flour = db.execute("SELECT id FROM ingredients WHERE name = 'Flour'").fetchone()[0]
+    ids = [_add_recipe(db, f'Bread {number}', [(flour, 100 + number, 'g')]) for number in range(20)]
+    db.commit()
+
+    def statements(recipe_ids):
+        response = client.get(f"/api/recipes?ids={','.join(map(str, recipe_ids))}&fields=id,cost")
+        assert response.status_code == 200
+        return int(re.search(r'desc="(\d+) queries"', response.headers['Server-Timing']).group(1))
+
+    assert 0 < statements(ids[:1]) == statements(ids)
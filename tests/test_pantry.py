@@ -0,0 +1,173 @@
+# test_pantry.py
+#
+# Pantry lots and production runs: FIFO allocation across lots and units, the
+# float tolerance, and that a run short of stock writes nothing.
+
+import pytest
+
+from pantry import _AMOUNT_EPSILON, StockShortage, _allocate, record_production_run, stock_purchase
+
+def _lot(lot_id, remaining, base_unit='g'):
+    return {'id': lot_id, 'base_unit': base_unit, 'remaining': remaining}
+
+def _item(needs, density=None):
+    return {'name': 'Flour', 'density': density, 'needs': needs}
+
+def _taken(takes):
+    return [(lot['id'], taken) for lot, taken in takes]
+
+def test_allocation_uses_the_oldest_lot_first():
+    lots = [_lot(1, 200), _lot(2, 500)]
+    takes, shortages = _allocate(lots, _item({'g': 300}))
+    assert shortages == []
+    assert _taken(takes) == [(1, 200), (2, 100)]
+    assert [lot['remaining'] for lot in lots] == [200, 500]
+
+def test_allocation_across_units_shares_the_lots():
+    lots = [_lot(1, 600), _lot(2, 1000)]
+    takes, shortages = _allocate(lots, _item({'g': 400, 'kg': 0.5}))
+    assert shortages == []
+    assert _taken(takes) == [(1, 400), (1, 200), (2, pytest.approx(300))]
+
+def test_allocation_converts_volume_by_density():
+    takes, shortages = _allocate([_lot(1, 1000)], _item({'Cup': 1}, density=0.5))
+    assert shortages == []
+    assert _taken(takes) == [(1, pytest.approx(118.294, rel=1e-4))]
+
+def test_allocation_skips_lots_it_cannot_convert_to():
+    lots = [_lot(1, 1000, 'ml'), _lot(2, 100)]
+    takes, shortages = _allocate(lots, _item({'g': 50}))
+    assert _taken(takes) == [(2, 50)]
+    assert shortages == []
+
+def test_shortage_is_reported_per_unit():
+    takes, shortages = _allocate([_lot(1, 250)], _item({'g': 200, 'kg': 0.1}))
+    assert shortages == ['Flour: short by 0.05 kg']
+    assert _taken(takes) == [(1, 200), (1, 50)]
+
+def test_shortage_without_any_lot():
+    assert _allocate([], _item({'g': 10})) == ([], ['Flour: short by 10 g'])
+
+def test_float_noise_is_not_a_shortage():
+    assert _allocate([_lot(1, 300)], _item({'g': 300 + _AMOUNT_EPSILON / 2}))[1] == []
+    assert _allocate([_lot(1, 300)], _item({'kg': 0.1 * 3}))[1] == []
+    assert _allocate([_lot(1, 300)], _item({'g': 300 + 1e-6}))[1] == ['Flour: short by 1e-06 g']
+
+def _add_ingredient(db, name, density=None):
+    return db.execute('INSERT INTO ingredients (name, density_g_ml) VALUES (?, ?)', (name, density)).lastrowid
+
+def _stock(db, ingredient_id, package_amount, package_unit, price, purchase_date):
+    purchase_id = db.execute('''
+        INSERT INTO ingredient_purchases (ingredient_id, package_amount, package_unit, price, purchase_date)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (ingredient_id, package_amount, package_unit, price, purchase_date)).lastrowid
+    lot_id = stock_purchase(db, purchase_id)
+    db.commit()
+    return lot_id
+
+def _add_recipe(db, name, lines, yield_amount=None, yield_unit=None):
+    recipe_id = db.execute('INSERT INTO recipes (name, yield_amount, yield_unit) VALUES (?, ?, ?)',
+                           (name, yield_amount, yield_unit)).lastrowid
+    for sort_order, (ingredient_id, amount_needed, unit_needed) in enumerate(lines, 1):
+        db.execute('''
+            INSERT INTO recipe_ingredients (recipe_id, ingredient_id, amount_needed, unit_needed, sort_order)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (recipe_id, ingredient_id, amount_needed, unit_needed, sort_order))
+    db.commit()
+    return recipe_id
+
+def _remaining(db):
+    return {row['id']: row['remaining'] for row in db.execute('SELECT id, remaining FROM pantry_lots')}
+
+def _consumed(db, run_id):
+    return [(row['lot_id'], row['quantity'], row['cost']) for row in db.execute(
+        "SELECT lot_id, quantity, cost FROM pantry_movements WHERE run_id = ? AND kind = 'consume' ORDER BY id",
+        (run_id,))]
+
+def test_run_consumes_the_oldest_lot_first(db):
+    flour = _add_ingredient(db, 'Flour')
+    newer = _stock(db, flour, 1, 'kg', 4.0, '2026-02-01')
+    older = _stock(db, flour, 500, 'g', 1.0, '2026-01-01')
+    bread = _add_recipe(db, 'Bread', [(flour, 400, 'g')])
+    run_id = record_production_run(db, bread, 2, run_date='2026-03-01')
+    assert _remaining(db) == {newer: pytest.approx(700), older: 0}
+    assert _consumed(db, run_id) == [(older, -500, -1.0), (newer, pytest.approx(-300), pytest.approx(-1.2))]
+    run = db.execute('SELECT * FROM production_runs WHERE id = ?', (run_id,)).fetchone()
+    assert (run['recipe_id'], run['batches'], run['run_date']) == (bread, 2, '2026-03-01')
+    assert run['total_cost'] == pytest.approx(2.2)
+
+def test_run_adds_up_units_from_sub_recipes(db):
+    flour = _add_ingredient(db, 'Flour')
+    milk = _add_ingredient(db, 'Milk', density=1.03)
+    flour_lot = _stock(db, flour, 1, 'kg', 2.0, '2026-01-01')
+    milk_lot = _stock(db, milk, 1, 'l', 1.5, '2026-01-01')
+    dough = _add_recipe(db, 'Dough', [(flour, 0.5, 'kg'), (milk, 206, 'g')], 800, 'g')
+    pie = _add_recipe(db, 'Pie', [(flour, 100, 'g')])
+    db.execute('''
+        INSERT INTO recipe_components (recipe_id, component_recipe_id, amount_needed, unit_needed, sort_order)
+        VALUES (?, ?, 400, 'g', 1)
+    ''', (pie, dough))
+    db.commit()
+    record_production_run(db, pie, 1)
+    # 100 g + half a dough's 0.5 kg of flour; half of 206 g of milk is 100 ml
+    assert _remaining(db) == {flour_lot: pytest.approx(650), milk_lot: pytest.approx(900)}
+
+def test_shortage_writes_nothing(db):
+    flour = _add_ingredient(db, 'Flour')
+    sugar = _add_ingredient(db, 'Sugar')
+    flour_lot = _stock(db, flour, 1, 'kg', 2.0, '2026-01-01')
+    sugar_lot = _stock(db, sugar, 100, 'g', 0.5, '2026-01-01')
+    cake = _add_recipe(db, 'Cake', [(flour, 300, 'g'), (sugar, 150, 'g')])
+    before = _remaining(db)
+    with pytest.raises(StockShortage) as raised:
+        record_production_run(db, cake, 1)
+    assert raised.value.shortages == ['Sugar: short by 50 g']
+    assert not db.in_transaction
+    assert _remaining(db) == before == {flour_lot: 1000, sugar_lot: 100}
+    assert db.execute('SELECT COUNT(*) FROM production_runs').fetchone()[0] == 0
+    assert db.execute("SELECT COUNT(*) FROM pantry_movements WHERE kind != 'stock'").fetchone()[0] == 0
+
+def test_unmeasured_sub_recipe_is_a_shortage(db):
+    flour = _add_ingredient(db, 'Flour')
+    _stock(db, flour, 1, 'kg', 2.0, '2026-01-01')
+    dough = _add_recipe(db, 'Dough', [(flour, 500, 'g')])
+    pie = _add_recipe(db, 'Pie', [])
+    db.execute('''
+        INSERT INTO recipe_components (recipe_id, component_recipe_id, amount_needed, unit_needed, sort_order)
+        VALUES (?, ?, 400, 'g', 1)
+    ''', (pie, dough))
+    db.commit()
+    with pytest.raises(StockShortage, match='Sub-recipe not measured: Dough'):
+        record_production_run(db, pie, 1)
+    assert db.execute('SELECT COUNT(*) FROM production_runs').fetchone()[0] == 0
+
+def test_unknown_recipe(db):
+    with pytest.raises(LookupError):
+        record_production_run(db, 999, 1)
+    assert not db.in_transaction
+
+def test_float_leftover_empties_the_lot(db):
+    flour = _add_ingredient(db, 'Flour')
+    lot = _stock(db, flour, 1, 'kg', 2.0, '2026-01-01')
+    crumb = _add_recipe(db, 'Crumb', [(flour, 1000 - _AMOUNT_EPSILON / 2, 'g')])
+    record_production_run(db, crumb, 1)
+    assert _remaining(db) == {lot: 0}
+    assert db.execute('SELECT COUNT(*) FROM pantry_lots WHERE remaining > 0').fetchone()[0] == 0
+
+def test_real_leftover_is_kept(db):
+    flour = _add_ingredient(db, 'Flour')
+    lot = _stock(db, flour, 1, 'kg', 2.0, '2026-01-01')
+    bread = _add_recipe(db, 'Bread', [(flour, 999.999, 'g')])
+    record_production_run(db, bread, 1)
+    assert _remaining(db)[lot] == pytest.approx(0.001)
+
+def test_counted_lot_holds_every_item(db):
+    eggs = _add_ingredient(db, 'Eggs')
+    lot = _stock(db, eggs, 12, 'ea', 4.0, '2026-01-01')
+    assert _remaining(db) == {lot: 12}
+    omelette = _add_recipe(db, 'Omelette', [(eggs, 3, 'ea')])
+    run_id = record_production_run(db, omelette, 4)
+    assert _remaining(db) == {lot: 0}
+    assert _consumed(db, run_id) == [(lot, -12, pytest.approx(-4.0))]
+    with pytest.raises(StockShortage, match='Eggs: short by 3 ea'):
+        record_production_run(db, omelette, 1)
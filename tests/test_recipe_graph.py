@@ -0,0 +1,131 @@
+# test_recipe_graph.py
+#
+# Sub-recipes: ordering the component graph, measuring a component line against
+# the sub-recipe's yield, and adding up the batches of shared sub-recipes.
+
+import pytest
+
+from recipe_graph import (CycleError, batch_fraction, creates_cycle, expand_batches,
+                          load_component_graph, topological_order)
+
+def _edges(*component_ids):
+    return [{'component_recipe_id': component_id} for component_id in component_ids]
+
+def _edge(amount_needed, unit_needed, yield_amount, yield_unit):
+    return {'amount_needed': amount_needed, 'unit_needed': unit_needed,
+            'yield_amount': yield_amount, 'yield_unit': yield_unit}
+
+def test_sub_recipes_come_first():
+    graph = {1: _edges(2, 3), 2: _edges(4), 3: _edges(4)}
+    order = topological_order([1], graph)
+    assert sorted(order) == [1, 2, 3, 4]
+    for recipe_id, edges in graph.items():
+        for edge in edges:
+            assert order.index(edge['component_recipe_id']) < order.index(recipe_id)
+
+def test_shared_sub_recipe_is_listed_once():
+    graph = {1: _edges(2, 3), 2: _edges(4), 3: _edges(4), 5: _edges(4)}
+    order = topological_order([1, 5, 4], graph)
+    assert order.count(4) == 1
+    assert sorted(order) == [1, 2, 3, 4, 5]
+
+def test_recipe_without_components():
+    assert topological_order([7], {}) == [7]
+
+def test_cycle_is_reported():
+    graph = {1: _edges(2), 2: _edges(3), 3: _edges(1)}
+    with pytest.raises(CycleError):
+        topological_order([1], graph)
+
+def test_cycle_below_a_shared_sub_recipe_is_reported():
+    graph = {1: _edges(2, 3), 2: _edges(4), 3: _edges(4), 4: _edges(5), 5: _edges(3)}
+    with pytest.raises(CycleError, match='sub-recipe of itself'):
+        topological_order([1], graph)
+
+def test_fraction_converts_to_the_yield_unit():
+    fraction, note = batch_fraction(_edge(300, 'g', 1.2, 'kg'))
+    assert fraction == pytest.approx(0.25)
+    assert note == ''
+
+def test_fraction_of_a_counted_yield():
+    fraction, _ = batch_fraction(_edge(6, 'ea', 24, 'ea'))
+    assert fraction == pytest.approx(0.25)
+
+@pytest.mark.parametrize('yield_amount, yield_unit', [(None, 'g'), (0, 'g'), (500, None)])
+def test_fraction_needs_a_yield(yield_amount, yield_unit):
+    fraction, note = batch_fraction(_edge(100, 'g', yield_amount, yield_unit))
+    assert fraction is None
+    assert 'yield' in note
+
+def test_fraction_across_dimensions_is_not_measured():
+    fraction, note = batch_fraction(_edge(100, 'ml', 500, 'g'))
+    assert fraction is None
+    assert 'Cannot convert' in note
+
+def _add_recipe(db, name, yield_amount=None, yield_unit=None):
+    return db.execute('INSERT INTO recipes (name, yield_amount, yield_unit) VALUES (?, ?, ?)',
+                      (name, yield_amount, yield_unit)).lastrowid
+
+def _use(db, recipe_id, component_recipe_id, amount_needed, unit_needed, sort_order=1):
+    db.execute('''
+        INSERT INTO recipe_components (recipe_id, component_recipe_id, amount_needed, unit_needed, sort_order)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (recipe_id, component_recipe_id, amount_needed, unit_needed, sort_order))
+
+@pytest.fixture
+def diamond(db):
+    """A cake using a sponge and a filling, both of which use the same syrup."""
+    cake = _add_recipe(db, 'Cake')
+    sponge = _add_recipe(db, 'Sponge', 1, 'kg')
+    filling = _add_recipe(db, 'Filling', 400, 'g')
+    syrup = _add_recipe(db, 'Syrup', 200, 'ml')
+    _use(db, cake, sponge, 500, 'g', 1)
+    _use(db, cake, filling, 800, 'g', 2)
+    _use(db, sponge, syrup, 50, 'ml')
+    _use(db, filling, syrup, 100, 'ml')
+    db.commit()
+    return cake, sponge, filling, syrup
+
+def test_load_only_what_is_below(db, diamond):
+    cake, sponge, filling, syrup = diamond
+    other = _add_recipe(db, 'Other')
+    _use(db, other, syrup, 10, 'ml')
+    graph = load_component_graph(db, [sponge])
+    assert list(graph) == [sponge]
+    assert [edge['component_recipe_id'] for edge in graph[sponge]] == [syrup]
+    graph = load_component_graph(db, [cake])
+    assert sorted(graph) == [cake, sponge, filling]
+    assert [edge['component_recipe_id'] for edge in graph[cake]] == [sponge, filling]
+    assert other in load_component_graph(db)
+
+def test_shared_sub_recipe_adds_up_every_path(db, diamond):
+    cake, sponge, filling, syrup = diamond
+    batches, notes = expand_batches(db, {cake: 2})
+    assert notes == []
+    assert batches[cake] == 2
+    assert batches[sponge] == pytest.approx(1.0)
+    assert batches[filling] == pytest.approx(4.0)
+    # 1 sponge * 50 ml + 4 fillings * 100 ml = 450 ml of a 200 ml syrup
+    assert batches[syrup] == pytest.approx(2.25)
+
+def test_planned_sub_recipe_keeps_its_own_batches(db, diamond):
+    cake, sponge, filling, syrup = diamond
+    batches, _ = expand_batches(db, {cake: 1, syrup: 1})
+    assert batches[syrup] == pytest.approx(1 + 0.125 + 1.0)
+
+def test_unmeasured_line_is_noted_and_left_out(db, diamond):
+    cake, sponge, filling, syrup = diamond
+    db.execute('UPDATE recipes SET yield_amount = NULL WHERE id = ?', (filling,))
+    batches, notes = expand_batches(db, {cake: 1})
+    assert notes == ['Filling: Set a yield amount and unit on this sub-recipe to use it by amount.']
+    assert filling not in batches
+    assert batches[syrup] == pytest.approx(0.125)
+
+def test_cycle_in_the_database(db, diamond):
+    cake, sponge, filling, syrup = diamond
+    assert creates_cycle(db, syrup, cake)
+    assert not creates_cycle(db, sponge, filling)
+    # Links written around the check still surface as a CycleError
+    _use(db, syrup, cake, 1, 'g')
+    with pytest.raises(CycleError):
+        expand_batches(db, {cake: 1})
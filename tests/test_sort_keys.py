@@ -0,0 +1,146 @@
+# test_sort_keys.py
+#
+# Sparse sort keys for recipe lines: which lines keep their keys when the lines
+# are reordered, where the moved ones land, and the fall back to renumbering
+# when the gaps run out.
+
+import itertools
+import random
+
+import pytest
+
+from app import SORT_KEY_GAP, _longest_increasing_run, _plan_sort_keys, _reorder_recipe_lines
+
+def _is_increasing(keys):
+    return all(a < b for a, b in zip(keys, keys[1:]))
+
+def _spread(count):
+    return [(position + 1) * SORT_KEY_GAP for position in range(count)]
+
+def test_longest_increasing_run():
+    assert _longest_increasing_run([]) == []
+    assert _longest_increasing_run([5]) == [0]
+    assert _longest_increasing_run([3, 1, 2]) == [1, 2]
+    run = _longest_increasing_run([10, 50, 20, 30, 5, 40])
+    assert [[10, 50, 20, 30, 5, 40][position] for position in run] == [10, 20, 30, 40]
+
+def test_longest_increasing_run_is_strict():
+    # Equal keys cannot both be kept, or two lines would share a key
+    assert len(_longest_increasing_run([7, 7, 7])) == 1
+
+def test_unchanged_order_keeps_every_key():
+    keys = _spread(5)
+    assert _plan_sort_keys(keys) == keys
+
+def test_moving_last_line_to_the_front_rewrites_one_key():
+    keys = _spread(4)
+    order = [keys[-1]] + keys[:-1]
+    new_keys = _plan_sort_keys(order)
+    assert _is_increasing(new_keys)
+    assert new_keys[1:] == keys[:-1]
+    assert new_keys[0] < keys[0]
+
+def test_moving_first_line_to_the_end_goes_past_the_last_key():
+    keys = _spread(4)
+    new_keys = _plan_sort_keys(keys[1:] + keys[:1])
+    assert _is_increasing(new_keys)
+    assert new_keys[:-1] == keys[1:]
+    assert new_keys[-1] > keys[-1]
+
+def test_moved_line_lands_between_its_neighbours():
+    new_keys = _plan_sort_keys([1024, 3072, 2048])
+    assert new_keys == [1024, 1536, 2048]
+
+def test_a_run_of_moved_lines_is_spread_evenly():
+    # Lines 5 and 6 move between 1 and 2
+    keys = _spread(6)
+    order = [keys[0], keys[4], keys[5], keys[1], keys[2], keys[3]]
+    new_keys = _plan_sort_keys(order)
+    assert _is_increasing(new_keys)
+    assert [new_keys[0]] + new_keys[3:] == keys[:4]
+    assert new_keys[1:3] == [1365, 1706]
+
+def test_every_permutation_keeps_a_longest_run():
+    keys = _spread(6)
+    for order in itertools.permutations(keys):
+        new_keys = _plan_sort_keys(list(order))
+        assert _is_increasing(new_keys), order
+        unchanged = sum(1 for old, new in zip(order, new_keys) if old == new)
+        assert unchanged == len(_longest_increasing_run(list(order))), order
+
+def test_random_shuffles_stay_increasing():
+    rng = random.Random(17)
+    keys = _spread(200)
+    for _ in range(50):
+        order = keys[:]
+        rng.shuffle(order)
+        new_keys = _plan_sort_keys(order)
+        assert new_keys is not None and _is_increasing(new_keys)
+
+def test_exhausted_gap_asks_for_renumbering():
+    # Nothing fits strictly between 1 and 2
+    assert _plan_sort_keys([1, 3, 2]) is None
+
+def test_gap_that_is_just_wide_enough():
+    # Two moved lines need three steps between the kept keys
+    assert _plan_sort_keys([1, 7, 8, 4, 5, 6]) == [1, 2, 3, 4, 5, 6]
+    assert _plan_sort_keys([1, 7, 8, 3, 5, 6]) is None
+
+def test_missing_key_asks_for_renumbering():
+    assert _plan_sort_keys([1024, None, 2048]) is None
+
+def _add_recipe_lines(db, keys):
+    recipe_id = db.execute("INSERT INTO recipes (name) VALUES ('Bread')").lastrowid
+    ingredient_ids = []
+    for number, key in enumerate(keys):
+        ingredient_id = db.execute('INSERT INTO ingredients (name) VALUES (?)', (f'Ingredient {number}',)).lastrowid
+        db.execute('''
+            INSERT INTO recipe_ingredients (recipe_id, ingredient_id, amount_needed, unit_needed, sort_order)
+            VALUES (?, ?, 1, 'g', ?)
+        ''', (recipe_id, ingredient_id, key))
+        ingredient_ids.append(ingredient_id)
+    db.commit()
+    return recipe_id, ingredient_ids
+
+def _line_order(db, recipe_id):
+    return [row[0] for row in db.execute(
+        'SELECT ingredient_id FROM recipe_ingredients WHERE recipe_id = ? ORDER BY sort_order', (recipe_id,))]
+
+def test_reorder_writes_only_the_moved_line(db):
+    recipe_id, ingredient_ids = _add_recipe_lines(db, _spread(5))
+    wanted = ingredient_ids[1:] + ingredient_ids[:1]
+    assert _reorder_recipe_lines(db, recipe_id, lambda current: wanted) == 1
+    assert _line_order(db, recipe_id) == wanted
+
+def test_reorder_renumbers_when_the_gaps_run_out(db):
+    recipe_id, ingredient_ids = _add_recipe_lines(db, [1, 2, 3])
+    wanted = [ingredient_ids[0], ingredient_ids[2], ingredient_ids[1]]
+    _reorder_recipe_lines(db, recipe_id, lambda current: wanted)
+    assert _line_order(db, recipe_id) == wanted
+    keys = [row[0] for row in db.execute(
+        'SELECT sort_order FROM recipe_ingredients WHERE recipe_id = ? ORDER BY sort_order', (recipe_id,))]
+    assert keys == _spread(3)
+
+def test_reorder_rejects_an_order_that_is_not_a_permutation(db):
+    recipe_id, ingredient_ids = _add_recipe_lines(db, _spread(3))
+    with pytest.raises(ValueError):
+        _reorder_recipe_lines(db, recipe_id, lambda current: current[:2])
+    assert _line_order(db, recipe_id) == ingredient_ids
+    assert not db.in_transaction
+
+@pytest.mark.parametrize('body', ['[3, 1, 2]', '5', '"order"', 'null', '{"order": "1,2,3"}'])
+def test_reorder_route_rejects_a_body_without_an_order_list(db, client, body):
+    recipe_id, ingredient_ids = _add_recipe_lines(db, _spread(3))
+    response = client.post(f'/recipe/{recipe_id}/reorder_ingredients', data=body,
+                           content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'The order must be a list of ingredient ids.'}
+    assert _line_order(db, recipe_id) == ingredient_ids
+
+def test_reorder_route_applies_an_order(db, client):
+    recipe_id, ingredient_ids = _add_recipe_lines(db, _spread(3))
+    wanted = ingredient_ids[::-1]
+    response = client.post(f'/recipe/{recipe_id}/reorder_ingredients', json={'order': wanted})
+    assert response.status_code == 200
+    assert response.get_json() == {'updated': 2}
+    assert _line_order(db, recipe_id) == wanted
@@ -0,0 +1,176 @@
+# units.py
+#
+# Single source of truth for units of measure and the conversions between them.
+# The string-keyed tables below are compiled once at import into integer-coded
+# lookup tables, so converting an amount is one index lookup and one multiply.
+
+# (abbreviation, full name, dimension)
+UNITS = [
+    ('g', 'Grams (g)', 'weight'),
+    ('kg', 'Kilograms (kg)', 'weight'),
+    ('lb', 'Pounds (lb)', 'weight'),
+    ('oz', 'Ounces (oz)', 'weight'),
+    ('ml', 'Milliliters (ml)', 'volume'),
+    ('l', 'Liters (l)', 'volume'),
+    ('fl.oz', 'Fluid Ounces-US (fl.oz)', 'volume'),
+    ('Gal', 'Gallon(s)-US (gal)', 'volume'),
+    ('pnt', 'Pint(s)-US (pnt)', 'volume'),
+    ('qrt', 'Quart(s)-US (qrt)', 'volume'),
+    ('tsp', 'Teaspoon-US (tsp)', 'volume'),
+    ('Tbsp', 'Tablespoon-US (Tbsp)', 'volume'),
+    ('Cup', 'Cup(s)-US', 'volume'),
+    ('ea', 'Each (ea)', 'quantity'),
+    ('pack', 'Pack', 'quantity'),
+]
+
+# Create a dictionary for quick dimension lookups: {'g': 'weight', 'kg': 'weight', ...}
+UNIT_DIMENSIONS = {unit[0]: unit[2] for unit in UNITS}
+
+# Define conversion factors TO a standard base unit (g for weight, ml for volume)
+# This is key for comparing different units of the same dimension.
+CONVERSIONS_TO_BASE = {
+    # Weight (base: g)
+    'g': 1.0,
+    'kg': 1000.0,
+    'oz': 28.35,
+    'lb': 453.59,
+    # Volume (base: ml)
+    'ml': 1.0,
+    'l': 1000.0,
+    'tsp': 4.929,
+    'Tbsp': 14.787,
+    'Cup': 236.588,
+    'fl.oz': 29.574,
+    'Gal': 3785.41,
+    'pnt': 473.18,
+    'qrt': 946.35,
+    # Quantity (base: ea) - 'pack' is treated specially in the costing logic
+    'ea': 1.0,
+    'pack': 1.0,
+}
+
+DIMENSIONS = ('weight', 'volume', 'quantity')
+
+# The unit every dimension is normalized to by CONVERSIONS_TO_BASE
+BASE_UNITS = {'weight': 'g', 'volume': 'ml', 'quantity': 'ea'}
+
+# --- Compiled Tables ---
+
+# Integer code per unit, in UNITS order: {'g': 0, 'kg': 1, ...}
+UNIT_CODES = {unit[0]: code for code, unit in enumerate(UNITS)}
+
+# Lower-cased spelling -> canonical unit: {'gal': 'Gal', 'tbsp': 'Tbsp', ...}
+_CANONICAL_UNITS = {unit[0].lower(): unit[0] for unit in UNITS}
+
+def _validate_tables():
+    """Fails fast if the unit tables disagree with each other."""
+    abbreviations = [unit[0] for unit in UNITS]
+    if len(set(abbreviations)) != len(abbreviations):
+        raise ValueError('UNITS contains duplicate abbreviations.')
+    for abbr, _, dimension in UNITS:
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unit '{abbr}' has unknown dimension '{dimension}'.")
+        if abbr not in CONVERSIONS_TO_BASE:
+            raise ValueError(f"Unit '{abbr}' has no entry in CONVERSIONS_TO_BASE.")
+        if not CONVERSIONS_TO_BASE[abbr] > 0:
+            raise ValueError(f"Conversion factor for '{abbr}' must be positive.")
+    for dimension, base_unit in BASE_UNITS.items():
+        if UNIT_DIMENSIONS.get(base_unit) != dimension or CONVERSIONS_TO_BASE[base_unit] != 1.0:
+            raise ValueError(f"Base unit '{base_unit}' for {dimension} must exist with factor 1.0.")
+    unknown = set(CONVERSIONS_TO_BASE) - set(abbreviations)
+    if unknown:
+        raise ValueError(f"CONVERSIONS_TO_BASE has units missing from UNITS: {sorted(unknown)}")
+
+def _compile_pairs():
+    """
+    Builds a flat table indexed by from_code * len(UNITS) + to_code.
+    Each cell is (ratio, density_power): the multiplier is ratio * density ** density_power,
+    where density_power is 0 within a dimension, 1 for volume -> weight and -1 for
+    weight -> volume. Incompatible pairs hold None.
+    """
+    table = []
+    for from_abbr, _, from_dim in UNITS:
+        for to_abbr, _, to_dim in UNITS:
+            ratio = CONVERSIONS_TO_BASE[from_abbr] / CONVERSIONS_TO_BASE[to_abbr]
+            if from_dim == to_dim:
+                table.append((ratio, 0))
+            elif from_dim == 'volume' and to_dim == 'weight':
+                table.append((ratio, 1))
+            elif from_dim == 'weight' and to_dim == 'volume':
+                table.append((ratio, -1))
+            else:
+                table.append(None)
+    return table
+
+_validate_tables()
+_UNIT_COUNT = len(UNITS)
+_PAIRS = _compile_pairs()
+
+# --- Conversion API ---
+
+def canonical_unit(text):
+    """
+    Returns the canonical spelling of a unit typed in any case ('TBSP' -> 'Tbsp'),
+    or None if it is not a known unit. Entered units are stored in this spelling.
+    """
+    return _CANONICAL_UNITS.get(text.strip().lower())
+
+def conversion_factor(from_unit, to_unit, density=None):
+    """
+    Returns the multiplier that converts an amount in `from_unit` to `to_unit`, or
+    None if the units are unknown, incompatible, or need a density that is missing.
+    `density` is in g/ml and only used between weight and volume.
+    """
+    from_code = UNIT_CODES.get(from_unit)
+    to_code = UNIT_CODES.get(to_unit)
+    if from_code is None or to_code is None:
+        return None
+    pair = _PAIRS[from_code * _UNIT_COUNT + to_code]
+    if pair is None:
+        return None
+    ratio, density_power = pair
+    if density_power == 0:
+        return ratio
+    if not density:
+        return None
+    return ratio * density if density_power == 1 else ratio / density
+
+def grams_factor(unit, density=None):
+    """Returns the multiplier from `unit` to grams, or None if it cannot be converted."""
+    return conversion_factor(unit, 'g', density)
+
+def convert_many(amounts, from_unit, to_unit, density=None):
+    """
+    Converts a sequence of amounts that share the same units with a single resolved
+    multiplier. Returns a list, or None if the units cannot be converted.
+    """
+    factor = conversion_factor(from_unit, to_unit, density)
+    if factor is None:
+        return None
+    return [amount * factor for amount in amounts]
+
+def package_size(package_amount, package_unit):
+    """
+    Returns the size of one purchased package in its dimension's base unit (g, ml
+    or ea), or None if the unit is unknown. A 'pack' holds `package_amount` items;
+    any other counted purchase is one item at the package price. Costing, planning
+    and unit prices all measure packages this way; pantry lots count every item.
+    """
+    dimension = UNIT_DIMENSIONS.get(package_unit)
+    if dimension is None:
+        return None
+    if dimension == 'quantity':
+        return package_amount if package_unit == 'pack' else 1.0
+    return package_amount * CONVERSIONS_TO_BASE[package_unit]
+
+def unit_price(price, package_amount, package_unit):
+    """
+    Normalizes a purchase price to the price of one base unit (g, ml or ea), so
+    purchases in different package sizes and units can be compared. Packages are
+    measured by package_size, as recipes are costed. Returns (unit price, base
+    unit), or (None, None) if the unit is unknown or the package is empty.
+    """
+    dimension = UNIT_DIMENSIONS.get(package_unit)
+    if dimension is None or not package_amount or package_amount <= 0:
+        return None, None
+    return price / package_size(package_amount, package_unit), BASE_UNITS[dimension]